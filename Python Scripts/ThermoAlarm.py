@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+# Streaming alarm rules, evaluated on every logged sample
+#
+# Channels are the sample columns T1, T1Ambient, T2, T2Ambient plus the derived dT (T1 - T2) and absdT.
+# Rolling statistics are kept per (channel, window) in fixed ring buffers with Welford add / remove
+# updates, and are shared by every rule that asks for the same window, so each sample costs O(1) per
+# distinct window and one comparison per rule.
+#
+#	ThresholdRule(name, kind, channel, above=None, below=None, hysteresis=0, holdoff=0, window=None)
+#		active while the value (or its rolling mean over window seconds) is past the threshold for
+#		holdoff seconds, and clears once it is back by more than hysteresis
+#	RateRule(name, kind, channel, window, maxRate, hysteresis=0, holdoff=0)
+#		active while the channel changes faster than maxRate C / minute over window seconds
+#	SpikeRule(name, kind, channel, window, sigmas, holdoff=0)
+#		active while the value is more than sigmas standard deviations from its rolling mean
+#
+# kind is 'level' or 'temp' and selects the levelAlarm / tempAlarm flag the rule drives.
+
+from collections import deque
+from math import sqrt
+
+
+class RollingStats():
+	def __init__(self,n):
+		self.size = max(2,n)
+		self.values = [0.0] * self.size
+		self.times = [0.0] * self.size
+		self.pos = 0
+		self.n = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+
+	def add(self,x,t):
+		if self.n == self.size:
+			old = self.values[self.pos]
+			self.n -= 1
+			d = old - self.mean
+			self.mean -= d / self.n
+			self.m2 -= d * (old - self.mean)
+		self.values[self.pos] = x
+		self.times[self.pos] = t
+		self.pos = (self.pos + 1) % self.size
+		self.n += 1
+		d = x - self.mean
+		self.mean += d / self.n
+		self.m2 += d * (x - self.mean)
+
+	def std(self):
+		if self.n < 2:
+			return 0.0
+		return sqrt(max(self.m2,0.0) / (self.n - 1))
+
+	def rate(self):
+		# Change per minute between the oldest and newest value in the window
+		if self.n < 2:
+			return 0.0
+		newest = (self.pos - 1) % self.size
+		oldest = (self.pos - self.n) % self.size
+		dt = self.times[newest] - self.times[oldest]
+		if dt <= 0:
+			return 0.0
+		return (self.values[newest] - self.values[oldest]) / dt * 60
+
+	def full(self):
+		return self.n == self.size
+
+
+class Rule():
+	def __init__(self,name,kind,channel,hysteresis=0,holdoff=0,window=None):
+		self.name = name
+		self.kind = kind
+		self.channel = channel
+		self.hysteresis = hysteresis
+		self.holdoff = holdoff
+		self.window = window
+		self.stats = None
+		self.active = False
+		self.pendingSince = None
+		self.value = None
+
+	def check(self,x,clearing):
+		# Returns True when the alarm condition holds, clearing selects the hysteresis band
+		return False
+
+	def measure(self,x):
+		return x
+
+	def update(self,x,t):
+		# Returns True when the rule changed state
+		v = self.measure(x)
+		if v is None:
+			return False
+		self.value = v
+		if self.check(v,self.active):
+			if self.active:
+				return False
+			if self.pendingSince is None:
+				self.pendingSince = t
+			if t - self.pendingSince >= self.holdoff:
+				self.active = True
+				return True
+			return False
+		self.pendingSince = None
+		if self.active:
+			self.active = False
+			return True
+		return False
+
+
+class ThresholdRule(Rule):
+	def __init__(self,name,kind,channel,above=None,below=None,hysteresis=0,holdoff=0,window=None):
+		Rule.__init__(self,name,kind,channel,hysteresis,holdoff,window)
+		self.above = above
+		self.below = below
+
+	def measure(self,x):
+		if self.stats is not None:
+			return self.stats.mean
+		return x
+
+	def check(self,v,clearing):
+		h = self.hysteresis if clearing else 0
+		if self.above is not None and v > self.above - h:
+			return True
+		if self.below is not None and v < self.below + h:
+			return True
+		return False
+
+
+class RateRule(Rule):
+	def __init__(self,name,kind,channel,window,maxRate,hysteresis=0,holdoff=0):
+		Rule.__init__(self,name,kind,channel,hysteresis,holdoff,window)
+		self.maxRate = maxRate
+
+	def measure(self,x):
+		if not self.stats.full():
+			return None
+		return self.stats.rate()
+
+	def check(self,v,clearing):
+		return abs(v) > self.maxRate - (self.hysteresis if clearing else 0)
+
+
+class SpikeRule(Rule):
+	def __init__(self,name,kind,channel,window,sigmas=5,holdoff=0):
+		Rule.__init__(self,name,kind,channel,0,holdoff,window)
+		self.sigmas = sigmas
+
+	def measure(self,x):
+		if not self.stats.full():
+			return None
+		s = self.stats.std()
+		if s == 0:
+			return 0.0
+		return abs(x - self.stats.mean) / s
+
+	def check(self,v,clearing):
+		return v > self.sigmas
+
+
+class AlarmEngine():
+	def __init__(self,rules=(),period=0.5):
+		self.rules = list(rules)
+		self.stats = dict()
+		for rule in self.rules:
+			if rule.window is not None:
+				key = (rule.channel,rule.window)
+				if key not in self.stats:
+					self.stats[key] = RollingStats(int(round(rule.window / period)))
+				rule.stats = self.stats[key]
+		self.events = deque(maxlen=100)
+		self.flags = {'level':False,'temp':False}
+
+	def update(self,t1,t1ambient,t2,t2ambient,t):
+		sample = {'T1':t1,'T1Ambient':t1ambient,'T2':t2,'T2Ambient':t2ambient,'dT':t1 - t2,'absdT':abs(t1 - t2)}
+		for (channel, window), stats in self.stats.items():
+			x = sample[channel]
+			if x == x:
+				stats.add(x,t)
+		changed = False
+		for rule in self.rules:
+			x = sample[rule.channel]
+			if x != x:
+				continue
+			if rule.update(x,t):
+				changed = True
+				self.events.append((t,rule.name,rule.kind,rule.active,rule.value))
+		if changed:
+			for kind in self.flags:
+				self.flags[kind] = any(rule.active for rule in self.rules if rule.kind == kind)
+		return changed
+
+	def status(self):
+		return [{'name':rule.name,'kind':rule.kind,'active':rule.active,'value':rule.value} for rule in self.rules]
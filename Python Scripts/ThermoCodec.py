@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+
+# Gorilla style block compression for TempLog columns
+#
+# Time stamps are stored as integer milliseconds with delta-of-delta encoding, so a regular 0.5 s / 60 s
+# cadence costs 1 - 9 bits per entry.  Temperatures are quantized to a fixed step (1/64 C by default,
+# well below the 0.25 C / 0.0625 C resolution of the MAX31855) and XOR encoded against the previous
+# value, so slowly changing readings only store the few mantissa bits that changed.
+#
+# Block layout:  b'TPG1', uint32 rows, float64 quantum, then the TimeStamp stream followed by the
+# T1, T1Ambient, T2, T2Ambient streams, each prefixed with its uint32 length in bytes.
+# Archive layout: b'TPA1', uint16 tiers, then per tier uint16 title length, title, uint32 block length, block
+
+import struct
+
+columns = ['TimeStamp','T1','T1Ambient','T2','T2Ambient']
+defaultQuantum = 1.0 / 64
+
+blockMagic = b'TPG1'
+archiveMagic = b'TPA1'
+
+
+class BitWriter():
+	def __init__(self):
+		self.buf = bytearray()
+		self.acc = 0
+		self.n = 0
+
+	def write(self,value,bits):
+		self.acc = (self.acc << bits) | (value & ((1 << bits) - 1))
+		self.n += bits
+		if self.n >= 64:
+			k = self.n >> 3
+			rest = self.n - (k << 3)
+			self.buf += (self.acc >> rest).to_bytes(k,'big')
+			self.acc &= (1 << rest) - 1
+			self.n = rest
+
+	def getBytes(self):
+		if self.n > 0:
+			pad = (8 - self.n % 8) % 8
+			self.buf += (self.acc << pad).to_bytes((self.n + pad) >> 3,'big')
+			self.acc = 0
+			self.n = 0
+		return bytes(self.buf)
+
+
+class BitReader():
+	def __init__(self,data):
+		self.data = data
+		self.pos = 0
+		self.acc = 0
+		self.n = 0
+
+	def read(self,bits):
+		while self.n < bits:
+			chunk = self.data[self.pos:self.pos + 8]
+			if not chunk:
+				raise EOFError('Compressed stream truncated')
+			self.pos += len(chunk)
+			self.acc = (self.acc << (len(chunk) << 3)) | int.from_bytes(chunk,'big')
+			self.n += len(chunk) << 3
+		self.n -= bits
+		value = self.acc >> self.n
+		self.acc &= (1 << self.n) - 1
+		return value
+
+
+def signed(value,bits):
+	if value >= 1 << (bits - 1):
+		return value - (1 << bits)
+	return value
+
+
+# (prefix, prefix length, value bits) for the delta-of-delta ranges, the last one is the escape
+dodRanges = [(0b10,2,7),(0b110,3,9),(0b1110,4,12),(0b1111,4,64)]
+
+
+def encodeTimes(values):
+	w = BitWriter()
+	prev = None
+	delta = 0
+	for v in values:
+		t = int(round(v * 1000))
+		if prev is None:
+			w.write(t,64)
+		else:
+			d = t - prev
+			dod = d - delta
+			delta = d
+			if dod == 0:
+				w.write(0,1)
+			else:
+				for prefix, plen, bits in dodRanges:
+					if -(1 << (bits - 1)) <= dod < (1 << (bits - 1)):
+						w.write(prefix,plen)
+						w.write(dod,bits)
+						break
+		prev = t
+	return w.getBytes()
+
+
+def iterTimes(data,count):
+	r = BitReader(data)
+	if count <= 0:
+		return
+	t = signed(r.read(64),64)
+	yield t / 1000
+	delta = 0
+	for ind in range(count - 1):
+		if r.read(1) == 0:
+			dod = 0
+		elif r.read(1) == 0:
+			dod = signed(r.read(7),7)
+		elif r.read(1) == 0:
+			dod = signed(r.read(9),9)
+		elif r.read(1) == 0:
+			dod = signed(r.read(12),12)
+		else:
+			dod = signed(r.read(64),64)
+		delta += dod
+		t += delta
+		yield t / 1000
+
+
+def floatBits(v):
+	return struct.unpack('>Q',struct.pack('>d',v))[0]
+
+
+def bitsFloat(b):
+	return struct.unpack('>d',struct.pack('>Q',b))[0]
+
+
+def encodeValues(values,quantum=defaultQuantum):
+	w = BitWriter()
+	prev = None
+	lead = -1
+	trail = 0
+	for v in values:
+		if quantum and v == v:
+			v = round(v / quantum) * quantum
+		b = floatBits(v)
+		if prev is None:
+			w.write(b,64)
+			prev = b
+			continue
+		x = b ^ prev
+		prev = b
+		if x == 0:
+			w.write(0,1)
+			continue
+		l = min(64 - x.bit_length(),31)
+		t = (x & -x).bit_length() - 1
+		if lead >= 0 and l >= lead and t >= trail:
+			w.write(0b10,2)
+			w.write(x >> trail,64 - lead - trail)
+		else:
+			lead, trail = l, t
+			size = 64 - l - t
+			w.write(0b11,2)
+			w.write(l,5)
+			w.write(size - 1,6)
+			w.write(x >> t,size)
+	return w.getBytes()
+
+
+def iterValues(data,count):
+	r = BitReader(data)
+	if count <= 0:
+		return
+	prev = r.read(64)
+	yield bitsFloat(prev)
+	lead = 0
+	trail = 0
+	for ind in range(count - 1):
+		if r.read(1) == 0:
+			yield bitsFloat(prev)
+			continue
+		if r.read(1) == 1:
+			lead = r.read(5)
+			trail = 64 - lead - (r.read(6) + 1)
+		prev ^= r.read(64 - lead - trail) << trail
+		yield bitsFloat(prev)
+
+
+def encodeBlock(cols,quantum=defaultQuantum):
+	count = len(cols['TimeStamp'])
+	out = [blockMagic,struct.pack('>Id',count,quantum)]
+	for col in columns:
+		if col == 'TimeStamp':
+			data = encodeTimes(cols[col])
+		else:
+			data = encodeValues(cols[col],quantum)
+		out.append(struct.pack('>I',len(data)))
+		out.append(data)
+	return b''.join(out)
+
+
+def iterBlockColumns(block):
+	# Yields (column, generator) pairs so callers can stream one column at a time
+	if block[:4] != blockMagic:
+		raise ValueError('Not a compressed TempLog block')
+	count, quantum = struct.unpack_from('>Id',block,4)
+	pos = 16
+	for col in columns:
+		size, = struct.unpack_from('>I',block,pos)
+		pos += 4
+		data = block[pos:pos + size]
+		pos += size
+		if col == 'TimeStamp':
+			yield col, iterTimes(data,count)
+		else:
+			yield col, iterValues(data,count)
+
+
+def decodeBlock(block):
+	return {col:list(values) for col, values in iterBlockColumns(block)}
+
+
+def encodeArchive(saveDict,quantum=defaultQuantum):
+	# saveDict as returned by TierStore.getDict(): {title: {column: list}}
+	out = [archiveMagic,struct.pack('>H',len(saveDict))]
+	for title, cols in saveDict.items():
+		name = title.encode('utf-8')
+		block = encodeBlock(cols,quantum)
+		out.append(struct.pack('>H',len(name)))
+		out.append(name)
+		out.append(struct.pack('>I',len(block)))
+		out.append(block)
+	return b''.join(out)
+
+
+def iterArchive(data):
+	if data[:4] != archiveMagic:
+		raise ValueError('Not a compressed TempLog archive')
+	n, = struct.unpack_from('>H',data,4)
+	pos = 6
+	for ind in range(n):
+		size, = struct.unpack_from('>H',data,pos)
+		pos += 2
+		title = data[pos:pos + size].decode('utf-8')
+		pos += size
+		size, = struct.unpack_from('>I',data,pos)
+		pos += 4
+		yield title, data[pos:pos + size]
+		pos += size
+
+
+def decodeArchive(data):
+	return {title:decodeBlock(block) for title, block in iterArchive(data)}
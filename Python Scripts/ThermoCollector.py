@@ -0,0 +1,372 @@
+#!/usr/bin/python3
+
+# Collector for several ThermoPi units
+#
+# usage: ThermoCollector.py [-l path|port [--host addr]] [--step s] [--simulate N] name=path | name=host:port ...
+#
+# Each node is a ThermoPi socket, the unix socket path on the same Pi or host:port when the daemon has
+# tcpPort set (and tcpHost for other hosts).  The collector asks every node for time stamped samples
+# ('stamp'), reads all of them from one select loop and merges them into one store aligned to step seconds
+# with a T1 and T2 column per node.
+# Samples are buffered per step and a row is committed for all nodes together once the step is a few
+# steps old, so late nodes still land in the right row and ingestion costs one row per step whatever the
+# number of nodes.  Nodes that drop are reconnected every retryInterval seconds.
+#
+# Clients of the collector socket (-l, ./ThermoCollector.pe by default) can send
+#	nodes										NODES: {name: {connected, samples, last, ambient}}
+#	query:start,end,maxPoints[,name;name...]	Q: {'TimeStamp': [...], 'name:T1': [...], 'name:T2': [...]}
+#	stop
+# start / end <= 0 are relative to now, as for the ThermoPi query command.  Malformed requests are answered
+# with 'ERROR: reason'.  A TCP port only listens on localhost unless --host says otherwise.
+#
+# SimNode is a stand-in ThermoPi that streams a slowly warming sample every period seconds; --simulate N
+# starts N of them on local TCP ports and collects from those.
+
+import sys, os, socket, errno, json, argparse, threading, random
+from select import select
+from time import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+channels = ['T1','T2']
+
+
+class AlignedStore():
+	# One row per step, a float64 array per 'node:channel' column, oldest rows dropped beyond capacity
+	def __init__(self,step=1.0,capacity=86400):
+		self.step = step
+		self.capacity = capacity
+		self.times = array('d')
+		self.cols = dict()
+
+	def addColumn(self,key):
+		if key not in self.cols:
+			self.cols[key] = array('d',[float('NaN')]) * len(self.times)
+
+	def addRow(self,t,values):
+		self.times.append(t)
+		for key, col in self.cols.items():
+			col.append(values.get(key,float('NaN')))
+		# Trim in chunks so dropping old rows stays amortized O(1)
+		extra = len(self.times) - self.capacity
+		if extra > self.capacity // 10:
+			del self.times[:extra]
+			for col in self.cols.values():
+				del col[:extra]
+
+	def query(self,start=None,end=None,maxPoints=500,nodes=None):
+		if maxPoints < 1:
+			raise ValueError('maxPoints must be at least 1')
+		lo = 0 if start is None else bisect_left(self.times,start)
+		hi = len(self.times) if end is None else bisect_right(self.times,end)
+		keys = [key for key in self.cols if nodes is None or key.split(':',1)[0] in nodes]
+		ts = self.times[lo:hi]
+		cols = {key:self.cols[key][lo:hi] for key in keys}
+		if len(ts) <= maxPoints or len(ts) < 2:
+			out = {key:list(col) for key, col in cols.items()}
+			out['TimeStamp'] = list(ts)
+			return out
+		# Average into maxPoints equal width buckets, ignoring NaN from nodes that were offline.  The last row
+		# sits on the upper edge and goes into the last bucket.
+		width = (ts[-1] - ts[0]) / maxPoints
+		last = maxPoints - 1
+		out = {key:[] for key in keys}
+		out['TimeStamp'] = []
+		ind = 0
+		n = len(ts)
+		while ind < n:
+			bucket = min(int((ts[ind] - ts[0]) / width),last)
+			stop = ind + 1
+			while stop < n and min(int((ts[stop] - ts[0]) / width),last) == bucket:
+				stop += 1
+			out['TimeStamp'].append(sum(ts[ind:stop]) / (stop - ind))
+			for key, col in cols.items():
+				values = [v for v in col[ind:stop] if v == v]
+				out[key].append(sum(values) / len(values) if values else None)
+			ind = stop
+		return out
+
+
+class Node():
+	def __init__(self,name,address):
+		self.name = name
+		self.address = address	# unix socket path, or (host, port)
+		self.sock = None
+		self.connecting = False
+		self.incoming = b''
+		self.retryAt = 0
+		self.samples = 0
+		self.last = None
+		self.ambient = None
+
+	def connect(self):
+		family = socket.AF_UNIX if isinstance(self.address,str) else socket.AF_INET
+		self.sock = socket.socket(family,socket.SOCK_STREAM)
+		self.sock.setblocking(False)
+		err = self.sock.connect_ex(self.address)
+		if err not in (0,errno.EINPROGRESS,errno.EAGAIN,errno.EWOULDBLOCK):
+			self.close()
+			return
+		self.connecting = True
+
+	def connected(self):
+		# Called once the socket is writable, finishes the non-blocking connect
+		self.connecting = False
+		if self.sock.getsockopt(socket.SOL_SOCKET,socket.SO_ERROR) != 0:
+			self.close()
+			return False
+		self.sock.sendall(b'stamp')
+		sys.stdout.write('Node connected: {}\n'.format(self.name))
+		sys.stdout.flush()
+		return True
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+		self.sock = None
+		self.connecting = False
+		self.incoming = b''
+
+	def messages(self,data):
+		self.incoming += data
+		*complete, self.incoming = self.incoming.split(b'\a')
+		return [m.decode('utf-8','replace') for m in complete]
+
+
+class Collector():
+	def __init__(self,nodes,listen='./ThermoCollector.pe',step=1.0,capacity=86400,lag=3,retryInterval=10,
+			listenHost='127.0.0.1'):
+		# nodes: list of (name, address), lag: steps a row stays open for late samples
+		self.nodes = [Node(name,address) for name, address in nodes]
+		self.store = AlignedStore(step,capacity)
+		for node in self.nodes:
+			for ch in channels:
+				self.store.addColumn(node.name + ':' + ch)
+		self.step = step
+		self.lag = lag
+		self.retryInterval = retryInterval
+		self.pending = dict()	# step number -> {column: [sum, count]}
+		self.committed = None	# last step number written to the store
+		self.late = 0
+		self.clients = []
+		self.running = True
+		if isinstance(listen,int):
+			self.listenSock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+			self.listenSock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+			# Clients can stop the collector, so only local ones unless listenHost says otherwise
+			self.listenSock.bind((listenHost,listen))
+		else:
+			try:
+				os.unlink(listen)
+			except OSError:
+				if os.path.exists(listen):
+					raise
+			self.listenSock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+			self.listenSock.bind(listen)
+		self.listenSock.listen(10)
+		self.listen = listen
+
+	def ingest(self,node,message):
+		fields = message.replace(':',' ').split()
+		if fields[0] == 'T1':
+			values = dict(zip(fields[0::2],fields[1::2]))
+			try:
+				t = float(values['TimeStamp']) if 'TimeStamp' in values else time()
+				sample = [(ch,float(values[ch])) for ch in channels]
+			except (KeyError,ValueError):
+				return
+			node.samples += 1
+			node.last = t
+			stepNo = int(t // self.step)
+			if self.committed is not None and stepNo <= self.committed:
+				self.late += 1
+				return
+			row = self.pending.setdefault(stepNo,dict())
+			for ch, v in sample:
+				if v == v:
+					acc = row.setdefault(node.name + ':' + ch,[0.0,0])
+					acc[0] += v
+					acc[1] += 1
+		elif fields[0] == 'Ambient1':
+			try:
+				node.ambient = [float(fields[1]),float(fields[3])]
+			except (IndexError,ValueError):
+				pass
+
+	def commit(self,now):
+		cutoff = int(now // self.step) - self.lag
+		for stepNo in sorted(stepNo for stepNo in self.pending if stepNo <= cutoff):
+			row = self.pending.pop(stepNo)
+			self.store.addRow(stepNo * self.step,{key:s / n for key, (s, n) in row.items()})
+			self.committed = stepNo
+
+	def status(self):
+		return {node.name:{'connected':node.sock is not None and not node.connecting,'samples':node.samples,
+			'last':node.last,'ambient':node.ambient} for node in self.nodes}
+
+	def command(self,client,message):
+		try:
+			self.answer(client,message)
+		except ValueError as e:
+			client.sendall(('ERROR: ' + str(e) + '\a').encode('utf-8'))
+
+	def answer(self,client,message):
+		if message.startswith('nodes'):
+			client.sendall(('NODES: ' + json.dumps(self.status()) + '\a').encode('utf-8'))
+		elif message.startswith('query'):
+			args = (message.split(':',1)[1].split(',') if ':' in message else []) + ['','','','']
+			now = time()
+			start = float(args[0]) if args[0].strip() else None
+			end = float(args[1]) if args[1].strip() else None
+			if start is not None and start <= 0:
+				start += now
+			if end is not None and end <= 0:
+				end += now
+			maxPoints = int(args[2]) if args[2].strip() else 500
+			nodes = set(args[3].strip().split(';')) if args[3].strip() else None
+			result = self.store.query(start,end,maxPoints,nodes)
+			client.sendall(('Q: ' + json.dumps(result) + '\a').encode('utf-8'))
+		elif message.startswith('stop'):
+			self.running = False
+
+	def run(self):
+		socks = dict()
+		try:
+			while self.running:
+				now = time()
+				for node in self.nodes:
+					if node.sock is None and now >= node.retryAt:
+						node.retryAt = now + self.retryInterval
+						node.connect()
+						if node.sock is not None:
+							socks[node.sock] = node
+				rlist = [self.listenSock] + self.clients + [n.sock for n in self.nodes if n.sock is not None and not n.connecting]
+				wlist = [n.sock for n in self.nodes if n.connecting]
+				r,w,e = select(rlist,wlist,[],self.step / 2)
+				for sock in w:
+					node = socks[sock]
+					if not node.connected():
+						del socks[sock]
+				for sock in r:
+					if sock is self.listenSock:
+						client, addr = sock.accept()
+						self.clients.append(client)
+					elif sock in socks:
+						node = socks[sock]
+						try:
+							data = sock.recv(65536)
+						except OSError:
+							data = b''
+						if not data:
+							sys.stdout.write('Node disconnected: {}\n'.format(node.name))
+							sys.stdout.flush()
+							del socks[sock]
+							node.close()
+							continue
+						for message in node.messages(data):
+							if message:
+								self.ingest(node,message)
+					else:
+						try:
+							data = sock.recv(256)
+						except OSError:
+							data = b''
+						if data:
+							try:
+								self.command(sock,data.decode('utf-8','replace'))
+							except OSError:
+								data = b''
+						if not data:
+							sock.close()
+							self.clients.remove(sock)
+				self.commit(time())
+		finally:
+			for node in self.nodes:
+				node.close()
+			for client in self.clients:
+				client.close()
+			self.listenSock.close()
+			if not isinstance(self.listen,int):
+				os.unlink(self.listen)
+
+
+class SimNode(threading.Thread):
+	# Stand-in ThermoPi on a local TCP port, streams the ThermoPi sample messages every period seconds
+	def __init__(self,port=0,period=0.5,t1=-195.0,t2=-120.0,warming=0.5):
+		threading.Thread.__init__(self,daemon=True)
+		self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+		self.sock.bind(('127.0.0.1',port))
+		self.sock.listen(10)
+		self.port = self.sock.getsockname()[1]
+		self.period = period
+		self.t1 = t1
+		self.t2 = t2
+		self.warming = warming / 60	# C per second
+		self.running = True
+
+	def run(self):
+		clients = []
+		stamped = set()
+		next = time()
+		while self.running:
+			r,w,e = select([self.sock] + clients,[],[],max(0,next - time()))
+			for sock in r:
+				if sock is self.sock:
+					client, addr = sock.accept()
+					clients.append(client)
+					client.sendall(b'Ambient1: 21.000  Ambient2: 21.500\aS1: True, True, True, True\a'
+						b'S2: True, True, True, True\a')
+				elif sock.recv(256).startswith(b'stamp'):
+					stamped.add(sock)
+			now = time()
+			if now < next:
+				continue
+			next += self.period
+			self.t1 += self.warming * self.period + random.gauss(0,0.05)
+			self.t2 += self.warming * self.period + random.gauss(0,0.05)
+			for client in list(clients):
+				msg = 'T1: {:.3f}  T2: {:.3f}'.format(self.t1,self.t2)
+				if client in stamped:
+					msg += '  TimeStamp: {:.3f}'.format(now)
+				try:
+					client.sendall((msg + '\a').encode('utf-8'))
+				except OSError:
+					clients.remove(client)
+					stamped.discard(client)
+					client.close()
+		self.sock.close()
+
+
+def parseNode(arg):
+	name, address = arg.split('=',1)
+	if ':' in address and not os.path.exists(address):
+		host, port = address.rsplit(':',1)
+		return name, (host,int(port))
+	return name, address
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Collect and merge samples from several ThermoPi units')
+	parser.add_argument('nodes',nargs='*',help='name=socket path or name=host:port')
+	parser.add_argument('-l','--listen',default='./ThermoCollector.pe',help='unix socket path or TCP port to serve queries on')
+	parser.add_argument('--host',default='127.0.0.1',help='address the TCP port listens on, \'\' for all')
+	parser.add_argument('--step',type=float,default=1.0,help='seconds per aligned row')
+	parser.add_argument('--capacity',type=int,default=86400,help='rows kept')
+	parser.add_argument('--simulate',type=int,default=0,help='start N simulated nodes on local ports')
+	parser.add_argument('--period',type=float,default=0.5,help='sample period of the simulated nodes')
+	args = parser.parse_args()
+
+	nodes = [parseNode(arg) for arg in args.nodes]
+	for ind in range(args.simulate):
+		sim = SimNode(period=args.period,t1=-195.0 + random.random(),t2=-120.0 + 10 * random.random())
+		sim.start()
+		nodes.append(('sim{}'.format(ind),('127.0.0.1',sim.port)))
+	if not nodes:
+		parser.error('no nodes given')
+	listen = int(args.listen) if args.listen.isdigit() else args.listen
+	collector = Collector(nodes,listen,args.step,args.capacity,listenHost=args.host)
+	try:
+		collector.run()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+# Columnar export of the log tiers as a NumPy .npz archive, written with the standard library only
+#
+# The archive is an uncompressed zip with one .npy member per column, named '<tier>/<column>.npy', and a
+# meta.json member with the tier definitions and, per column, how stored values map to floats:
+#	value = offset + stored * scale, stored == nan (when given) is a missing reading
+# Packed columns (ThermoTiers.PackedColumn) are written as their raw int16 / int32 arrays, list columns
+# as float64 (offset 0, scale 1), so the export is a few bulk copies with no per row work.
+#
+# Every member's data starts on a 64 byte boundary of the file, so the columns can be memory mapped:
+#	numpy:	z = np.load('Log.npz'); t1 = z['SecondsX2/T1'] / 16
+#	no numpy:	meta, tiers = loadNpz('Log.npz'); tiers['SecondsX2']['T1'] is a memoryview into an mmap
+#			(np.frombuffer(view, dtype) wraps it without a copy)
+
+import sys, json, zipfile, struct, mmap, ast
+from array import array
+from time import time
+
+align = 64
+endian = '<' if sys.byteorder == 'little' else '>'
+dtypes = {'d':'f8','f':'f4','h':'i2','i':'i4','l':'i8','q':'i8'}
+typecodes = {'f8':'d','f4':'f','i2':'h','i4':'i','i8':'q'}
+
+
+def npyHeader(typecode,n):
+	# Magic, version 1.0 and the header dict, padded with spaces so the data starts on an aligned offset
+	header = "{{'descr': '{}{}', 'fortran_order': False, 'shape': ({},), }}".format(endian,dtypes[typecode],n)
+	header += ' ' * (-(10 + len(header) + 1) % align) + '\n'
+	return b'\x93NUMPY\x01\x00' + struct.pack('<H',len(header)) + header.encode('latin1')
+
+
+def columnArray(col):
+	# Returns (typed array, column metadata)
+	from ThermoTiers import PackedColumn
+	if isinstance(col,PackedColumn):
+		data = col.data[:]
+		meta = {'dtype':dtypes[data.typecode],'scale':col.resolution,'offset':col.epoch or 0.0}
+		if data.typecode == 'h':
+			meta['nan'] = -32768
+		return data, meta
+	if isinstance(col,array):
+		return col, {'dtype':dtypes[col.typecode],'scale':1.0,'offset':0.0}
+	return array('d',col[:]), {'dtype':'f8','scale':1.0,'offset':0.0}
+
+
+def writeNpz(fname,tiers,tierSpecs=None):
+	# tiers: {title: {column: list, array or PackedColumn}}, tierSpecs: TierStore.tiers for the metadata
+	meta = {'created':time(),'byteorder':sys.byteorder,'columns':{},
+		'tiers':None if tierSpecs is None else [list(tier) for tier in tierSpecs]}
+	with zipfile.ZipFile(fname,'w',zipfile.ZIP_STORED) as zf:
+		for title, cols in tiers.items():
+			meta['columns'][title] = dict()
+			for col, values in cols.items():
+				data, colMeta = columnArray(values)
+				meta['columns'][title][col] = colMeta
+				name = '{}/{}.npy'.format(title,col)
+				info = zipfile.ZipInfo(name,date_time=(2000,1,1,0,0,0))
+				info.compress_type = zipfile.ZIP_STORED
+				# Pad the local header's extra field (zipalign style) so the .npy data lands on an aligned offset
+				pad = -(zf.fp.tell() + 30 + len(name.encode('utf-8'))) % align
+				if 0 < pad < 4:
+					pad += align
+				if pad:
+					info.extra = struct.pack('<HH',0xD935,pad - 4) + bytes(pad - 4)
+				zf.writestr(info,npyHeader(data.typecode,len(data)) + data.tobytes())
+		zf.writestr('meta.json',json.dumps(meta))
+
+
+def loadNpz(fname):
+	# Returns (meta, {title: {column: memoryview}}), the views stay valid while the returned objects live
+	with zipfile.ZipFile(fname) as zf:
+		meta = json.loads(zf.read('meta.json').decode('utf-8'))
+		infos = [info for info in zf.infolist() if info.filename.endswith('.npy')]
+	with open(fname,'rb') as fid:
+		mm = mmap.mmap(fid.fileno(),0,access=mmap.ACCESS_READ)
+	view = memoryview(mm)
+	tiers = dict()
+	for info in infos:
+		nameLen, extraLen = struct.unpack_from('<HH',mm,info.header_offset + 26)
+		pos = info.header_offset + 30 + nameLen + extraLen
+		headerLen, = struct.unpack_from('<H',mm,pos + 8)
+		header = ast.literal_eval(mm[pos + 10:pos + 10 + headerLen].decode('latin1'))
+		typecode = typecodes[header['descr'][1:]]
+		n = header['shape'][0]
+		start = pos + 10 + headerLen
+		data = view[start:start + n * array(typecode).itemsize]
+		if header['descr'][0] == endian or header['descr'][0] == '|':
+			data = data.cast(typecode)
+		else:
+			data = array(typecode,data.tobytes())
+			data.byteswap()
+		title, col = info.filename[:-4].split('/',1)
+		tiers.setdefault(title,dict())[col] = data
+	return meta, tiers
+
+
+def columnValues(data,colMeta):
+	# Stored values to floats, NaN for missing readings
+	offset = colMeta['offset']
+	scale = colMeta['scale']
+	nan = colMeta.get('nan')
+	return [float('NaN') if v == nan else offset + v * scale for v in data]
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+# Per-channel digital filter stages for ThermoRead
+#
+# Every stage works on a fixed size buffer allocated up front, so update() is O(1) in the length of the
+# stream and allocates nothing in the read loop.  NaN readings (open thermocouple) are skipped and the
+# previous output is held.
+#
+# A chain is described by a list of (stage, parameter) tuples, e.g.
+#	[('median',5),('ema',0.1)]		# reject single sample spikes, then smooth
+#	[('boxcar',5)]					# plain moving average over one logging interval
+#	[('fir',[0.25,0.5,0.25])]		# arbitrary FIR taps, newest sample first
+
+from bisect import insort, bisect_left
+
+
+class EMAFilter():
+	def __init__(self,alpha=0.1):
+		self.alpha = alpha
+		self.value = None
+
+	def prime(self,x):
+		self.value = x
+
+	def update(self,x):
+		if self.value is None:
+			self.value = x
+		else:
+			self.value += self.alpha * (x - self.value)
+		return self.value
+
+
+class MedianFilter():
+	def __init__(self,n=5):
+		self.n = n
+		self.ring = [0.0] * n
+		self.sorted = []
+		self.pos = 0
+		self.value = None
+
+	def prime(self,x):
+		self.ring = [x] * self.n
+		self.sorted = [x] * self.n
+		self.pos = 0
+		self.value = x
+
+	def update(self,x):
+		if self.value is None:
+			self.prime(x)
+			return x
+		old = self.ring[self.pos]
+		self.ring[self.pos] = x
+		self.pos = (self.pos + 1) % self.n
+		del self.sorted[bisect_left(self.sorted,old)]
+		insort(self.sorted,x)
+		self.value = self.sorted[self.n // 2]
+		return self.value
+
+
+class FIRFilter():
+	def __init__(self,taps=(1.0,)):
+		self.taps = list(taps)
+		self.n = len(self.taps)
+		self.ring = [0.0] * self.n
+		self.pos = 0
+		self.value = None
+
+	def prime(self,x):
+		self.ring = [x] * self.n
+		self.pos = 0
+		self.value = x * sum(self.taps)
+
+	def update(self,x):
+		if self.value is None:
+			self.prime(x)
+			return self.value
+		self.pos = (self.pos - 1) % self.n
+		self.ring[self.pos] = x
+		acc = 0.0
+		n = self.n
+		for ind in range(n):
+			acc += self.taps[ind] * self.ring[(self.pos + ind) % n]
+		self.value = acc
+		return acc
+
+
+class BoxcarFilter():
+	# Moving average with a running sum, so the cost does not grow with the window length
+	def __init__(self,n=5):
+		self.n = n
+		self.ring = [0.0] * n
+		self.pos = 0
+		self.total = 0.0
+		self.value = None
+
+	def prime(self,x):
+		self.ring = [x] * self.n
+		self.pos = 0
+		self.total = x * self.n
+		self.value = x
+
+	def update(self,x):
+		if self.value is None:
+			self.prime(x)
+			return x
+		self.total += x - self.ring[self.pos]
+		self.ring[self.pos] = x
+		self.pos = (self.pos + 1) % self.n
+		self.value = self.total / self.n
+		return self.value
+
+
+filterTypes = {'ema':EMAFilter,'median':MedianFilter,'boxcar':BoxcarFilter,'fir':FIRFilter}
+
+
+class FilterChain():
+	def __init__(self,config=(('ema',0.1),)):
+		self.stages = [filterTypes[name](param) for name, param in config]
+		self.value = float('NaN')
+
+	def prime(self,x):
+		if x != x:
+			return
+		for stage in self.stages:
+			stage.prime(x)
+			x = stage.value
+		self.value = x
+
+	def update(self,x):
+		if x != x:
+			return self.value
+		for stage in self.stages:
+			x = stage.update(x)
+		self.value = x
+		return x
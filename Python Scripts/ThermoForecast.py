@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+# Online boil-off / refill forecasting
+#
+# For each tracked tier and channel an exponentially weighted least squares line is kept as five running
+# sums, updated in O(1) whenever that tier receives a rollup entry.  The slope is the warming rate and
+# the time until the channel reaches its threshold is extrapolated from the fitted line.
+#
+# T1 sits below the LN fill line, so the T1 forecast is the time until the level drops below the probe;
+# T2 near the plug tracks how fast the head space warms as the level falls.
+
+from math import log
+from time import time
+
+# (channel, threshold C) pairs that are forecast
+defaultTargets = [('T1',-185.0),('T2',-100.0)]
+# tier title -> number of entries for the weights to halve
+defaultTiers = {'Minutes':120,'Hours':24}
+
+channelIndex = {'T1':0,'T1Ambient':1,'T2':2,'T2Ambient':3}
+
+
+class LineFit():
+	def __init__(self,halfLife):
+		self.decay = 0.5 ** (1.0 / halfLife)
+		self.t0 = None
+		self.sw = self.sx = self.sy = self.sxx = self.sxy = 0.0
+		self.n = 0
+		self.lastX = 0.0
+		self.lastY = 0.0
+
+	def add(self,t,y):
+		if y != y:
+			return
+		if self.t0 is None:
+			self.t0 = t
+		x = (t - self.t0) / 3600
+		d = self.decay
+		self.sw = self.sw * d + 1
+		self.sx = self.sx * d + x
+		self.sy = self.sy * d + y
+		self.sxx = self.sxx * d + x * x
+		self.sxy = self.sxy * d + x * y
+		self.n += 1
+		self.lastX = x
+		self.lastY = y
+
+	def slope(self):
+		# C per hour, None until at least three points
+		den = self.sw * self.sxx - self.sx * self.sx
+		if self.n < 3 or den <= 0:
+			return None
+		return (self.sw * self.sxy - self.sx * self.sy) / den
+
+	def fitted(self,x):
+		b = self.slope()
+		if b is None:
+			return self.lastY
+		return (self.sy - b * self.sx) / self.sw + b * x
+
+	def timeTo(self,threshold):
+		# Seconds from the last point until the fitted line reaches threshold, None if it never will
+		b = self.slope()
+		if b is None:
+			return None
+		now = self.fitted(self.lastX)
+		if (threshold - now) * b <= 0:
+			return 0.0 if (b > 0 and now >= threshold) or (b < 0 and now <= threshold) else None
+		return (threshold - now) / b * 3600
+
+
+class Forecaster():
+	def __init__(self,tiers=defaultTiers,targets=defaultTargets):
+		self.targets = list(targets)
+		self.fits = {title:{ch:LineFit(halfLife) for ch, th in self.targets} for title, halfLife in tiers.items()}
+		self.updated = dict()
+
+	def update(self,title,entry):
+		# entry is a TempLog row: (t1, t1ambient, t2, t2ambient, timestamp)
+		fits = self.fits.get(title)
+		if fits is None or entry is None:
+			return
+		for ch, fit in fits.items():
+			fit.add(entry[4],entry[channelIndex[ch]])
+		self.updated[title] = entry[4]
+
+	def report(self):
+		out = {'Generated':time(),'Tiers':{}}
+		for title, fits in self.fits.items():
+			tier = {}
+			for ch, threshold in self.targets:
+				fit = fits[ch]
+				slope = fit.slope()
+				eta = fit.timeTo(threshold)
+				tier[ch] = {'RatePerHour':slope,'Threshold':threshold,'SecondsToThreshold':eta,
+					'ExpectedAt':None if eta is None else self.updated.get(title,0) + eta,'Points':fit.n}
+			out['Tiers'][title] = tier
+		return out
@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+
+# Persistent e-mail notifier for ThermoPi
+#
+# A single worker thread owns one SMTP session, which is kept open between messages (checked with NOOP
+# before use) and closed after idleClose seconds without traffic.  Callers only put requests on a queue.
+#
+#	notifier.send(to, subject, body, attachment)	log / plot mails, sent in order
+#	notifier.alarm(to, key, text)					alarm lines; repeats of the same key (the rule name)
+#												within dedupWindow are dropped whatever their text (the
+#												value), and everything raised within coalesceWindow goes
+#												out as a single mail
+#
+# At most one mail is sent every minInterval seconds, later requests wait in the queue.  Attachments are
+# base64 encoded and streamed to the server in chunks, so a large log never has to fit in memory.
+#
+# LocalSMTPServer is a minimal plain text SMTP stand-in for testing:
+#	server = LocalSMTPServer(); server.start()
+#	notifier = Notifier(host='127.0.0.1',port=server.port,useSSL=False,user=None)
+#
+# The SMTP login is not kept in the code, loadCredentials() reads it from the THERMOPI_SMTP_USER /
+# THERMOPI_SMTP_PASSWORD environment variables or from credentialsFile, {"user": ..., "password": ...}.
+
+import sys, os, threading, queue, socketserver, json
+from time import time, strftime, localtime
+
+defaultHost = 'smtp.gmail.com'
+defaultPort = 465
+defaultSender = 'LN Monitor<robinsonlabiot@gmail.com>'
+credentialsFile = 'SMTPCredentials.json'
+
+
+def loadCredentials(fname=credentialsFile):
+	# Returns (user, password), (None, None) when neither the environment nor the file has them
+	user = os.environ.get('THERMOPI_SMTP_USER')
+	if user is not None:
+		return user, os.environ.get('THERMOPI_SMTP_PASSWORD')
+	try:
+		with open(fname) as fid:
+			creds = json.load(fid)
+	except FileNotFoundError:
+		return None, None
+	return creds.get('user'), creds.get('password')
+
+# 57 input bytes encode to one 76 character base64 line
+chunkLines = 512
+chunkBytes = 57 * chunkLines
+
+
+class Notifier(threading.Thread):
+	def __init__(self,host=defaultHost,port=defaultPort,user=None,password=None,
+			sender=defaultSender,useSSL=True,minInterval=10,coalesceWindow=30,dedupWindow=3600,idleClose=300):
+		threading.Thread.__init__(self,daemon=True)
+		self.host = host
+		self.port = port
+		self.user = user
+		self.password = password
+		self.sender = sender
+		self.useSSL = useSSL
+		self.minInterval = minInterval
+		self.coalesceWindow = coalesceWindow
+		self.dedupWindow = dedupWindow
+		self.idleClose = idleClose
+		self.q = queue.Queue()
+		self.smtp = None
+		self.lastUse = 0
+		self.lastSend = 0
+		self.alarms = dict()	# to -> [first raised time, [lines]]
+		self.recent = dict()	# key -> time last queued
+		self.sent = 0
+		self.failed = 0
+		self.running = True
+
+	def send(self,to,subject='LN Monitor Log',body=None,attachment=None,done=None):
+		# done(ok) is called from the worker thread once the mail has been handed to the server
+		self.q.put(('mail',to,subject,body,attachment,done))
+
+	def alarm(self,to,key,text):
+		self.q.put(('alarm',to,key,text))
+
+	def stop(self,timeout=5):
+		self.q.put(('stop',))
+		self.join(timeout)
+
+	def run(self):
+		while self.running:
+			wait = self.idleClose
+			if self.alarms:
+				wait = max(0,min(first for first, lines in self.alarms.values()) + self.coalesceWindow - time())
+			try:
+				item = self.q.get(timeout=max(wait,0.01))
+			except queue.Empty:
+				item = None
+			if item is not None:
+				if item[0] == 'stop':
+					self.running = False
+				elif item[0] == 'mail':
+					self.deliver(*item[1:])
+				elif item[0] == 'alarm':
+					self.queueAlarm(*item[1:])
+			self.flushAlarms(force=not self.running)
+			if self.smtp is not None and time() - self.lastUse > self.idleClose:
+				self.disconnect()
+		self.disconnect()
+
+	def queueAlarm(self,to,key,text):
+		now = time()
+		last = self.recent.get(key)
+		if last is not None and now - last < self.dedupWindow:
+			return
+		self.recent[key] = now
+		if len(self.recent) > 256:
+			self.recent = {k:t for k, t in self.recent.items() if now - t < self.dedupWindow}
+		pending = self.alarms.setdefault(to,[now,[]])
+		pending[1].append(strftime('%Y-%m-%d %H:%M:%S',localtime(now)) + '  ' + text)
+
+	def flushAlarms(self,force=False):
+		now = time()
+		for to in list(self.alarms):
+			first, lines = self.alarms[to]
+			if force or now - first >= self.coalesceWindow:
+				del self.alarms[to]
+				subject = 'LN Monitor Alarm' if len(lines) == 1 else 'LN Monitor Alarms ({})'.format(len(lines))
+				self.deliver(to,subject,'\n'.join(lines) + '\n',None,None)
+
+	def connect(self):
+		import smtplib
+		if self.smtp is not None:
+			try:
+				if self.smtp.noop()[0] == 250:
+					return self.smtp
+			except Exception:
+				pass
+			self.disconnect()
+		if self.useSSL:
+			self.smtp = smtplib.SMTP_SSL(self.host,self.port,timeout=30)
+		else:
+			self.smtp = smtplib.SMTP(self.host,self.port,timeout=30)
+		if self.user is not None:
+			self.smtp.login(self.user,self.password)
+		return self.smtp
+
+	def disconnect(self):
+		if self.smtp is None:
+			return
+		try:
+			self.smtp.quit()
+		except Exception:
+			pass
+		self.smtp = None
+
+	def deliver(self,to,subject,body,attachment,done):
+		wait = self.lastSend + self.minInterval - time()
+		if wait > 0:
+			threading.Event().wait(wait)
+		ok = False
+		for attempt in range(2):
+			try:
+				self.stream(self.connect(),to,subject,body,attachment)
+			except Exception as e:
+				sys.stdout.write('Email Failed: {}\n'.format(e))
+				sys.stdout.flush()
+				self.disconnect()
+			else:
+				ok = True
+				break
+		self.lastSend = self.lastUse = time()
+		if ok:
+			self.sent += 1
+		else:
+			self.failed += 1
+		if done is not None:
+			done(ok)
+
+	def stream(self,smtp,to,subject,body,attachment):
+		import uuid
+		from email.utils import formatdate
+		smtp.ehlo_or_helo_if_needed()
+		rcpts = [r.strip() for r in to.split(',')]
+		code, resp = smtp.mail(self.sender.split('<')[-1].rstrip('>'))
+		if code != 250:
+			raise RuntimeError('MAIL FROM refused: {}'.format(resp))
+		for r in rcpts:
+			code, resp = smtp.rcpt(r)
+			if code not in (250,251):
+				raise RuntimeError('RCPT TO refused: {}'.format(resp))
+		smtp.putcmd('data')
+		code, resp = smtp.getreply()
+		if code != 354:
+			raise RuntimeError('DATA refused: {}'.format(resp))
+		boundary = '=_' + uuid.uuid4().hex
+		head = ['From: ' + self.sender,'To: ' + to,'Subject: ' + subject,'Date: ' + formatdate(localtime=True),
+			'MIME-Version: 1.0','Content-Type: multipart/mixed; boundary="{}"'.format(boundary),'',
+			'--' + boundary,'Content-Type: text/plain; charset="utf-8"','Content-Transfer-Encoding: 8bit','']
+		for line in (body or '').splitlines():
+			# Dot stuffing, a line starting with '.' would otherwise end the DATA section
+			head.append('.' + line if line.startswith('.') else line)
+		smtp.send(('\r\n'.join(head) + '\r\n').encode('utf-8'))
+		if attachment is not None:
+			self.streamAttachment(smtp,boundary,attachment)
+		smtp.send(('--' + boundary + '--\r\n.\r\n').encode('utf-8'))
+		code, resp = smtp.getreply()
+		if code != 250:
+			raise RuntimeError('Message refused: {}'.format(resp))
+
+	def streamAttachment(self,smtp,boundary,fname):
+		import binascii, mimetypes
+		ctype, encoding = mimetypes.guess_type(fname)
+		if ctype is None or encoding is not None:
+			ctype = 'application/octet-stream'
+		name = os.path.basename(fname)
+		smtp.send(('--{}\r\nContent-Type: {}\r\nContent-Transfer-Encoding: base64\r\n'
+			'Content-Disposition: attachment; filename="{}"\r\n\r\n').format(boundary,ctype,name).encode('utf-8'))
+		with open(fname,'rb') as fid:
+			while True:
+				data = fid.read(chunkBytes)
+				if not data:
+					break
+				smtp.send(b''.join(binascii.b2a_base64(data[ind:ind + 57]).replace(b'\n',b'\r\n')
+					for ind in range(0,len(data),57)))
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+	# Accepts everything and keeps (sender, recipients, raw message bytes) in self.messages
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self,host='127.0.0.1',port=0):
+		self.messages = []
+		self.connections = 0
+		socketserver.ThreadingTCPServer.__init__(self,(host,port),LocalSMTPHandler)
+		self.port = self.server_address[1]
+		self.thread = threading.Thread(target=self.serve_forever,daemon=True)
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+class LocalSMTPHandler(socketserver.StreamRequestHandler):
+	def reply(self,text):
+		self.wfile.write((text + '\r\n').encode('utf-8'))
+
+	def handle(self):
+		self.server.connections += 1
+		self.reply('220 localhost ThermoPi test SMTP')
+		sender = None
+		rcpts = []
+		while True:
+			line = self.rfile.readline()
+			if not line:
+				return
+			cmd = line.decode('utf-8','replace').strip()
+			verb = cmd[:4].upper()
+			if verb in ('EHLO','HELO'):
+				self.reply('250 localhost')
+			elif verb == 'MAIL':
+				sender = cmd.split(':',1)[1].strip().strip('<>')
+				rcpts = []
+				self.reply('250 OK')
+			elif verb == 'RCPT':
+				rcpts.append(cmd.split(':',1)[1].strip().strip('<>'))
+				self.reply('250 OK')
+			elif verb == 'DATA':
+				self.reply('354 End data with <CR><LF>.<CR><LF>')
+				lines = []
+				while True:
+					line = self.rfile.readline()
+					if not line or line == b'.\r\n':
+						break
+					lines.append(line[1:] if line.startswith(b'..') else line)
+				self.server.messages.append((sender,rcpts,b''.join(lines)))
+				self.reply('250 OK queued')
+			elif verb == 'NOOP':
+				self.reply('250 OK')
+			elif verb == 'RSET':
+				sender = None
+				rcpts = []
+				self.reply('250 OK')
+			elif verb == 'QUIT':
+				self.reply('221 Bye')
+				return
+			else:
+				self.reply('502 Not implemented')
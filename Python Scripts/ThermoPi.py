@@ -24,18 +24,26 @@
 # The thermocouple itself is not linear, particularly in the extremes of its range.  It may need compensation.
 
 from time import sleep, time, localtime, strftime, ctime
+bootTime = time()
 from threading import Thread, Event, RLock
 import multiprocessing as mp
 from multiprocessing import Process, Manager, Queue
 from select import select
 import sys, os, errno, socket, fcntl, math, json, csv, signal
 from math import ceil
-# import smtplib, mimetypes
-# from email.message import EmailMessage
+from collections import deque
+# Lazy import policy: only modules needed to reach the first sample are imported here.  matplotlib,
+# smtplib / email, http.server, cProfile / tracemalloc and the archive codecs are imported inside the
+# functions (or child processes) that use them, so they never delay a restart.
 
-from Adafruit_GPIO import SPI
-from Adafruit_MAX31855 import MAX31855 as mx3
-# https://github.com/adafruit/Adafruit_Python_MAX31855/blob/master/Adafruit_MAX31855/MAX31855.py
+from ThermoFilter import FilterChain
+from ThermoTiers import TierStore, defaultTiers
+from ThermoStats import StageStats
+from ThermoProfile import ProfileSession
+from ThermoNotify import Notifier, loadCredentials
+from ThermoAlarm import AlarmEngine, ThresholdRule, RateRule
+from ThermoForecast import Forecaster
+from ThermoStream import StreamHub, parseSubscription
 
 
 class TermHandler:
@@ -54,176 +62,6 @@ def c_to_f(c):
 	return c * 9.0 / 5.0 + 32.0
 
 
-class TempLog():
-	def __init__(self,title='generic',t1=None,t1a=None,t2=None,t2a=None,ts=None):
-		self.Title = title
-		self.numEntries = 0
-		if t1 is not None and t1a is not None and t2 is not None and t2a is not None and ts is not None:
-			self.T1 = t1
-			self.T1Ambient = t1a
-			self.T2 = t2
-			self.T2Ambient = t2a
-			self.TimeStamp = ts
-
-		else:
-			self.T1 = []
-			self.T1Ambient = []
-			self.T2 = []
-			self.T2Ambient = []
-			self.TimeStamp = []
-	
-	def addTemp(self,t1=0,t1ambient=0,t2=0,t2ambient=0,logtime=None):
-		if logtime is None:
-			self.TimeStamp.append(time())
-		else:
-			self.TimeStamp.append(logtime)
-		self.T1.append(t1)
-		self.T1Ambient.append(t1ambient)
-		self.T2.append(t2)
-		self.T2Ambient.append(t2ambient)
-		self.numEntries += 1
-	
-	def average(self,howMany=None):
-		if howMany is None:
-			howMany = self.numEntries
-		T1 = self.T1[-howMany:]
-		t1 = sum(T1) / howMany
-		T1A = self.T1Ambient[-howMany:]
-		t1ambient = sum(T1A) / howMany
-		T2 = self.T2[-howMany:]
-		t2 = sum(T2) / howMany
-		T2A = self.T2Ambient[-howMany:]
-		t2ambient = sum(T2A) / howMany
-		TS = self.TimeStamp[-howMany:]
-		logtime = sum(TS) / howMany
-		return t1, t1ambient, t2, t2ambient, logtime
-	
-	def max(self,howMany=None):
-		if howMany is None:
-			howMany = self.numEntries
-		T1 = self.T1[-howMany:]
-		t1 = max(T1)
-		T1A = self.T1Ambient[-howMany:]
-		t1ambient = max(T1A)
-		T2 = self.T2[-howMany:]
-		t2 = max(T2)
-		T2A = self.T2Ambient[-howMany:]
-		t2ambient = max(T2A)
-		TS = self.TimeStamp[-howMany:]
-		logtime = sum(TS) / howMany
-		return t1, t1ambient, t2, t2ambient, logtime
-	
-	def purge(self,howMany=0):
-		if howMany >= self.numEntries:
-			self.T1.clear()
-			self.T1Ambient.clear()
-			self.T2.clear()
-			self.T2Ambient.clear()
-			self.TimeStamp.clear()
-			self.numEntries = 0
-			return
-		# self.T1 = self.T1[howMany:]
-		# self.T1Ambient = self.T1Ambient[howMany:]
-		del self.T1[:howMany]
-		del self.T1Ambient[:howMany]
-		# self.T2 = self.T2[howMany:]
-		# self.T2Ambient = self.T2Ambient[howMany:]
-		del self.T2[:howMany]
-		del self.T2Ambient[:howMany]
-		# self.TimeStamp = self.TimeStamp[howMany:]
-		del self.TimeStamp[:howMany]
-		self.numEntries = len(self.T1)
-	
-	def keep_only(self,howMany=None):
-		if howMany is None or howMany >= self.numEntries:
-			return
-		# self.T1 = self.T1[-howMany:]
-		# self.T1Ambient = self.T1Ambient[-howMany:]
-		del self.T1[:-howMany]
-		del self.T1Ambient[:-howMany]
-		# self.T2 = self.T2[-howMany:]
-		# self.T2Ambient = self.T2Ambient[-howMany:]
-		del self.T2[:-howMany]
-		del self.T2Ambient[:-howMany]
-		# self.TimeStamp = self.TimeStamp[-howMany:]
-		del self.TimeStamp[:-howMany]
-		self.numEntries = howMany
-	
-	def saveTo(self,fid=None,format='csv'):
-		if format == 'json':
-			if fid is None:
-				closeFile = True
-				fname = 'Log_' + str(time()) + '.json'
-				print('Saving log: {}'.format(fname))
-				fid = open(fname,'w')
-			else:
-				closeFile = False
-			saveDict = {'LogType':self.Title,'TimeStamp':self.TimeStamp[:],'T1':self.T1[:],
-				'T1Ambient':self.T1Ambient[:],'T2':self.T2[:],'T2Ambient':self.T2Ambient[:]}
-			json.dump(saveDict,fid)
-			if closeFile:
-				fid.close()
-		else:
-			if fid is None:
-				fname = 'Log_' + str(time()) + '.csv'
-				print('Saving log: {}'.format(fname))
-				fid = open(fname,'w', newline='')
-				closeFile = True
-			else:
-				closeFile = False
-			try:
-				writer = csv.writer(fid)
-				writer.writerow(['Log Type','Time Stamp','T1','T2','T1 Ambient','T2 Ambient'])
-				writer.writerow([self.Title])
-				t = self.getTable()
-				for ind in range(len(t)):
-					writer.writerow([''] + t[ind])
-				if closeFile:
-					fid.close()
-			except Exception as e:
-				print(e)
-				lastLogSaveName = 'failed'
-			else:
-				lastLogSaveName = fname
-	
-	def getDict(self):
-		saveDict = {'TimeStamp':self.TimeStamp[:],'T1':self.T1[:],
-			'T1Ambient':self.T1Ambient[:],'T2':self.T2[:],'T2Ambient':self.T2Ambient[:]}
-		return {self.Title:saveDict}
-	
-	def load(self,logdict):
-		if self.numEntries > 0:
-			self.TimeStamp.clear()
-			self.T1.clear()
-			self.T1Ambient.clear()
-			self.T2.clear()
-			self.T2Ambient.clear()
-		self.TimeStamp.extend(logdict['TimeStamp'])
-		self.T1.extend(logdict['T1'])
-		self.T1Ambient.extend(logdict['T1Ambient'])
-		self.T2.extend(logdict['T2'])
-		self.T2Ambient.extend(logdict['T2Ambient'])
-		self.numEntries = len(self.TimeStamp)
-	
-	def getJSONBytes(self):
-		saveDict = {'LogType':self.Title,'TimeStamp':self.TimeStamp[:],'T1':self.T1[:],
-			'T1Ambient':self.T1Ambient[:],'T2':self.T2[:],'T2Ambient':self.T2Ambient[:]}
-		return json.dumps(saveDict).encode()
-	
-	def getTable(self):
-		ts = self.TimeStamp[:]
-		t1 = self.T1[:]
-		t1a = self.T1Ambient[:]
-		t2 = self.T2[:]
-		t2a = self.T2Ambient[:]
-		t = []
-		for ind in range(self.numEntries):
-			t.append([ts[ind],t1[ind],t2[ind],t1a[ind],t2a[ind]])
-			if ind % 1000 == 0:
-				sleep(0)
-		return t
-
-
 def linearizeTemp(t,i):
 	thermocoupleVoltage = (t - i) * 0.041276
 	coldJunctionVoltage = (-0.176004136860E-01 +
@@ -284,9 +122,20 @@ def linearizeTemp(t,i):
 	return t
 
 
+def readWords():
+	# Raw words of both readers, read back to back
+	if sensorBus is not None:
+		return sensorBus.read32All()
+	return T1._read32(), T2._read32()
+
+
 def readAll():
 	global T1, T2, state1, state2, linearizeTemps
-	v = T1._read32()
+	t = stats.start()
+	v1, v2 = readWords()
+	stats.stop('spi',t)
+	t = stats.start()
+	v = v1
 	state1 = [(v & (1 << 0)) == 0,(v & (1 << 1)) == 0,(v & (1 << 2)) == 0,(v & (1 << 16)) == 0]
 	if v & 0x7:
 		t1 = float('NaN')
@@ -300,7 +149,9 @@ def readAll():
 	if v & 0x800:
 		i1 -= 4096
 	i1 *= 0.0625
-	v = T2._read32()
+	stats.stop('decode',t)
+	t = stats.start()
+	v = v2
 	state2 = [(v & (1 << 0)) == 0,(v & (1 << 1)) == 0,(v & (1 << 2)) == 0,(v & (1 << 16)) == 0]
 	if v & 0x7:
 		# t2 = float('NaN')
@@ -318,6 +169,7 @@ def readAll():
 	if v & 0x800:
 		i2 -= 4096
 	i2 *= 0.0625
+	stats.stop('decode',t)
 	if linearizeTemps:
 		pass
 		# thermocoupleVoltage = (t1 - i1) * 0.041276
@@ -462,21 +314,16 @@ def emailLog(log=None):
 
 
 def saveLogsJSON(filename=None):
-	global fastLog, minutesLog, hoursLog, daysLog, lastLogSaveName
+	global logStore, lastLogSaveName
 	if filename is None:
 		fname = 'Log_' + str(time()) + '.json'
 	else:
 		fname = filename + '.json'
-	saveDict = dict()
 	print('Saving log: {}'.format(fname))
 	try:
-		with open(fname,'w') as logfile:
-			saveDict.update(fastLog.getDict())
-			saveDict.update(minutesLog.getDict())
-			saveDict.update(hoursLog.getDict())
-			saveDict.update(daysLog.getDict())
-			print(saveDict.keys())
-			json.dump(saveDict,logfile)
+		t = stats.start()
+		logStore.saveJSON(fname,{'Forecast':forecaster.report()})
+		stats.stop('save',t)
 	except Exception as e:
 		print(e)
 		lastLogSaveName = 'failed'
@@ -484,58 +331,114 @@ def saveLogsJSON(filename=None):
 		lastLogSaveName = fname
 
 
-def loadLogsJSON(filename=None):
-	global fastLog, minutesLog, hoursLog, daysLog
+def saveLogsCompressed(filename=None):
+	global logStore, lastLogSaveName
 	if filename is None:
-		fname = 'LogDump.json'
+		fname = 'Log_' + str(time()) + '.tpc'
 	else:
-		fname = filename + '.json'
+		fname = filename + '.tpc'
+	print('Saving log: {}'.format(fname))
+	try:
+		t = stats.start()
+		logStore.saveCompressed(fname)
+		stats.stop('save',t)
+	except Exception as e:
+		print(e)
+		lastLogSaveName = 'failed'
+	else:
+		lastLogSaveName = fname
+
+
+def saveLogsNpz(filename=None):
+	global logStore, lastLogSaveName
+	if filename is None:
+		fname = 'Log_' + str(time()) + '.npz'
+	else:
+		fname = filename + '.npz'
+	print('Saving log: {}'.format(fname))
+	try:
+		t = stats.start()
+		logStore.saveNpz(fname)
+		stats.stop('save',t)
+	except Exception as e:
+		print(e)
+		lastLogSaveName = 'failed'
+	else:
+		lastLogSaveName = fname
+
+
+def syncLogs():
+	global lastSyncOk
+	t = stats.start()
+	lastSyncOk = syncer.sync()
+	stats.stop('sync',t)
+
+
+def saveLogsBinary(filename='LogDump'):
+	global logStore
+	fname = filename + '.bin'
+	print('Saving snapshot: {}'.format(fname))
+	try:
+		t = stats.start()
+		# Written next to the old snapshot and renamed, so a crash mid-write keeps the previous one
+		logStore.saveBinary(fname + '.tmp')
+		os.replace(fname + '.tmp',fname)
+		stats.stop('save',t)
+	except Exception as e:
+		print(e)
+
+
+def loadLogsJSON(filename=None):
+	global logStore
+	if filename is None:
+		filename = 'LogDump'
+	# Prefer the raw binary snapshot, then the compressed archive, then the SQLite history when enabled,
+	# then a JSON dump from older versions
+	for ext, loader in [('.bin',logStore.loadBinary),('.tpc',logStore.loadCompressed)]:
+		fname = filename + ext
+		if os.path.isfile(fname):
+			try:
+				t = stats.start()
+				loader(fname)
+				stats.stop('restore',t)
+			except Exception as e:
+				print('Previous Log Unreadable: {}'.format(fname))
+				print(e)
+			else:
+				print('Loaded Previous Log')
+				return
+	if sqlLog is not None and os.path.isfile(sqlLog):
+		try:
+			logStore.loadSQLite(sqlLog)
+		except Exception as e:
+			print('Previous Log Unreadable: {}'.format(sqlLog))
+			print(e)
+		else:
+			print('Loaded Previous Log')
+			return
+	fname = filename + '.json'
 	if not os.path.isfile(fname):
 		print('No previous log found')
 		return
 	try:
-		with open(fname) as f:
-			saveDict = json.load(f)
+		logStore.loadJSON(fname)
 	except json.decoder.JSONDecodeError as e:
 		print('Previous Log File Empty')
 		return
-	fastLog.load(saveDict['SecondsX2'])
-	minutesLog.load(saveDict['Minutes'])
-	hoursLog.load(saveDict['Hours'])
-	daysLog.load(saveDict['Days'])
 	print('Loaded Previous Log')
 
 
-def saveLogsCSV():
-	global fastLog, minutesLog, hoursLog, daysLog, lastLogSaveName
-	fname = 'Log_' + str(time()) + '.csv'
+def saveLogsCSV(filename=None):
+	global logStore, lastLogSaveName
+	if filename is None:
+		fname = 'Log_' + str(time()) + '.csv'
+	else:
+		fname = filename + '.csv'
 	print('Saving log: {}'.format(fname))
 	try:
-		with open(fname,'w', newline='') as logfile:
-			writer = csv.writer(logfile)
-			writer.writerow(['Log Type','Time Stamp','T1','T2','T1 Ambient','T2 Ambient'])
-			writer.writerow(['Seconds x2'])
-			t = fastLog.getTable()
-			for ind in range(len(t)):
-				writer.writerow([''] + t[ind])
-			writer.writerow(['\t'])
-			writer.writerow(['Log Type','Time Stamp','T1','T2','T1 Ambient','T2 Ambient'])
-			writer.writerow(['Minutes'])
-			t = minutesLog.getTable()
-			for ind in range(len(t)):
-				writer.writerow([''] + t[ind])
-			writer.writerow(['\t'])
-			writer.writerow(['Log Type','Time Stamp','T1','T2','T1 Ambient','T2 Ambient'])
-			writer.writerow(['Hours'])
-			t = hoursLog.getTable()
-			for ind in range(len(t)):
-				writer.writerow([''] + t[ind])
-			writer.writerow(['\t'])
-			writer.writerow(['Log Type','Time Stamp','T1','T2','T1 Ambient','T2 Ambient'])
-			writer.writerow(['Days'])
-			t = daysLog.getTable()
-			for ind in range(len(t)):
-				writer.writerow([''] + t[ind])
+		t = stats.start()
+		logStore.saveCSV(fname)
+		stats.stop('save',t)
 	except Exception as e:
 		print(e)
 		lastLogSaveName = 'failed'
@@ -543,125 +446,96 @@ def saveLogsCSV():
 		lastLogSaveName = fname
 
 
-def savePlot(format='.png'):
-	global fastLog, minutesLog, hoursLog, daysLog, lastLogSaveName
-	fname = 'Log_' + str(time()) + format
-	sys.stdout.write('Generating plot: {}\n'.format(fname))
-	sys.stdout.flush()
-	fig = plt.figure()
-	fig.set_size_inches(32,8)
-	fig.set_dpi(200)
-	#print('Acquiring lock 1')
-	#fastLog.lock.acquire()
-	# ts = fastLog.TimeStamp[-7200:]
-	# t1 = fastLog.T1[-7200:]
-	# t1amb = fastLog.T1Ambient[-7200:]
-	# t2 = fastLog.T2[-7200:]
-	# t2amb = fastLog.T2Ambient[-7200:]
-	# #fastLog.lock.release()
-	# sleep(0)
-	# if len(ts) > 0:
-		# plt.subplot(2,4,1)
-		# initTime = ts[0]
-		# for ii in range(len(ts)):
-			# ts[ii] -= initTime
-		# plt.xlabel('Seconds since ' + strftime('%Y-%m-%d %H:%M:%S',localtime(initTime)))
-		# plt.ylabel('Degrees C')
-		# plt.plot(ts,t1amb,'r',ts,t2amb,'b')
-		# sleep(0)
-		# plt.subplot(2,4,5)
-		# plt.xlabel('Seconds since ' + strftime('%Y-%m-%d %H:%M:%S',localtime(initTime)))
-		# plt.ylabel('Degrees C')
-		# plt.plot(ts,t1,'r',ts,t2,'b',)
-		# plt.ylim(-200,ceil(max([max(t1),max(t2)])))
-		# sleep(0)
-	
-	#print('Acquiring lock 2')
-	# minutesLog.lock.acquire()
-	ts = minutesLog.TimeStamp[:]
-	t1 = minutesLog.T1[:]
-	t1amb = minutesLog.T1Ambient[:]
-	t2 = minutesLog.T2[:]
-	t2amb = minutesLog.T2Ambient[:]
-	# minutesLog.lock.release()
-	sleep(0)
-	if len(ts) > 0:
-		# plt.subplot(2,4,2)
-		plt.subplot(2,3,1)
-		initTime = ts[0]
-		for ii in range(len(ts)):
-			ts[ii] = round((ts[ii] - initTime) / 60)
-		plt.xlabel('Minutes since ' + strftime('%Y-%m-%d %H:%M',localtime(initTime)))
-		plt.ylabel('Degrees C')
-		plt.plot(ts,t1amb,'r',ts,t2amb,'b')
-		sleep(0)
-		# plt.subplot(2,4,6)
-		plt.subplot(2,3,4)
-		plt.xlabel('Minutes since ' + strftime('%Y-%m-%d %H:%M',localtime(initTime)))
-		plt.ylabel('Degrees C')
-		plt.plot(ts,t1,'r',ts,t2,'b',)
-		plt.ylim(-200,ceil(max([max(t1),max(t2)])))
-		sleep(0)
-	
-	#print('Acquiring lock 3')
-	# hoursLog.lock.acquire()
-	ts = hoursLog.TimeStamp[:]
-	t1 = hoursLog.T1[:]
-	t1amb = hoursLog.T1Ambient[:]
-	t2 = hoursLog.T2[:]
-	t2amb = hoursLog.T2Ambient[:]
-	# hoursLog.lock.release()
-	sleep(0)
-	if len(ts) > 0:
-		# plt.subplot(2,4,3)
-		plt.subplot(2,3,2)
-		initTime = ts[0]
-		for ii in range(len(ts)):
-			ts[ii] = round((ts[ii] - initTime) / 3600)
-		plt.xlabel('Hours since ' + strftime('%Y-%m-%d %H:%M',localtime(initTime)))
-		plt.ylabel('Degrees C')
-		plt.plot(ts,t1amb,'r',ts,t2amb,'b')
-		sleep(0)
-		# plt.subplot(2,4,7)
-		plt.subplot(2,3,5)
-		plt.xlabel('Hours since ' + strftime('%Y-%m-%d %H:%M',localtime(initTime)))
-		plt.ylabel('Degrees C')
-		plt.plot(ts,t1,'r',ts,t2,'b',)
-		plt.ylim(-200,ceil(max([max(t1),max(t2)])))
-		sleep(0)
-	
-	#print('Acquiring lock 4')
-	# daysLog.lock.acquire()
-	ts = daysLog.TimeStamp[:]
-	t1 = daysLog.T1[:]
-	t1amb = daysLog.T1Ambient[:]
-	t2 = daysLog.T2[:]
-	t2amb = daysLog.T2Ambient[:]
-	# daysLog.lock.release()
-	sleep(0)
-	if len(ts) > 0:
-		# plt.subplot(2,4,4)
-		plt.subplot(2,3,3)
-		initTime = ts[0]
-		for ii in range(len(ts)):
-			ts[ii] = round((ts[ii] - initTime) / 43200)
-		plt.xlabel('Days since ' + strftime('%Y-%m-%d',localtime(initTime)))
-		plt.ylabel('Degrees C')
-		plt.plot(ts,t1amb,'r',ts,t2amb,'b')
-		sleep(0)
-		# plt.subplot(2,4,8)
-		plt.subplot(2,3,6)
-		plt.xlabel('Days since ' + strftime('%Y-%m-%d',localtime(initTime)))
-		plt.ylabel('Degrees C')
-		plt.plot(ts,t1,'r',ts,t2,'b',)
-		plt.ylim(-200,ceil(max([max(t1),max(t2)])))
-		sleep(0)
-	
-	sys.stdout.write('Saving plot: {}'.format(fname))
+def parseQuery(message):
+	# query:start,end,maxPoints - start / end <= 0 are relative to now, empty fields use the defaults
+	args = (message.split(':',1)[1].split(',') if ':' in message else []) + ['','','']
+	now = time()
+	start = float(args[0]) if args[0].strip() else None
+	end = float(args[1]) if args[1].strip() else None
+	if start is not None and start <= 0:
+		start += now
+	if end is not None and end <= 0:
+		end += now
+	maxPoints = int(args[2]) if args[2].strip() else 500
+	return start, end, maxPoints
+
+
+def rssBytes(pid='self'):
+	try:
+		with open('/proc/{}/status'.format(pid)) as f:
+			for line in f:
+				if line.startswith('VmRSS:'):
+					return int(line.split()[1]) * 1024
+	except OSError:
+		pass
+	return None
+
+
+def warmForkserver():
+	from multiprocessing import forkserver
+	t = stats.start()
+	forkserver.ensure_running()
+	stats.stop('forkserver',t)
+
+
+def sendEvent(client,reqId,event,**fields):
+	# Requests sent as '#<id> <command>\a' get 'EVENT: {"id": <id>, "event": ...}\a' replies, where event is
+	# queued, started, done or failed.  Legacy commands without an id get no events.
+	if client is None or reqId is None:
+		return
+	fields['id'] = reqId
+	fields['event'] = event
+	try:
+		client.sendall(('EVENT: ' + json.dumps(fields) + '\a').encode('utf-8'))
+	except OSError:
+		pass
+
+
+def reply(client,reqId,prefix,result):
+	# Legacy clients get '<prefix>: <result>', requests with an id a done event carrying the result
+	if reqId is None:
+		try:
+			client.sendall((prefix + ': ' + (result if isinstance(result,str) else json.dumps(result)) + '\a').encode('utf-8'))
+		except OSError:
+			pass
+	else:
+		sendEvent(client,reqId,'done',ok=True,result=result)
+
+
+def dropClient(client):
+	# Closes a client and forgets its stamp, stream and request buffer entries
+	client.close()
+	if client in clients:
+		clients.remove(client)
+	stampedClients.discard(client)
+	tcpClients.discard(client)
+	streams.unsubscribe(client)
+	requestBuffers.pop(client,None)
+	print('Client disconnected')
+
+
+def queueJob(kind,client=None,reqId=None):
+	if len(jobs) >= maxJobs:
+		sendEvent(client,reqId,'failed',error='queue full')
+		return
+	jobs.append((kind,client,reqId))
+	sendEvent(client,reqId,'queued',kind=kind,position=len(jobs) + (runningJob is not None))
+
+
+def emailCallback(client,reqId,attachment):
+	# Runs on the notifier thread, the completion event is sent from the server loop
+	def done(ok):
+		emailDone(ok)
+		mailsDone.append((client,reqId,ok,attachment))
+	return done
+
+
+def emailDone(ok):
+	if ok:
+		sys.stdout.write('Email Sent\n')
+	else:
+		sys.stdout.write('Email Failed\n')
 	sys.stdout.flush()
-	plt.savefig(fname, bbox_inches='tight')
-	plt.close()
-	lastLogSaveName = fname
 
 
 def keyboardListener():
@@ -677,66 +551,100 @@ def keyboardListener():
 
 
 def ThermoRead():
-	global temp1, temp2, inter1, inter2, counter, state1, state2, sendStatus, saveLog
-	global fastLog, minutesLog, hoursLog, daysLog
-	global levelAlarm, tempAlarm, shuttingDown
+	global temp1, temp2, inter1, inter2, counter, state1, state2, sendStatus
 	
 	fault = False
 	
-	temp1,inter1,temp2,inter2 = readAll()
-	sleep(.1)
-	for ii in range(9):
-		t1,i1,t2,i2 = readAll()
-		temp1+= t1
-		inter1 += i1
-		temp2 += t2
-		inter2 += i2
+	# One filter chain per channel: T1, Ambient1, T2, Ambient2
+	filters = [FilterChain(tempFilter),FilterChain(ambientFilter),FilterChain(tempFilter),FilterChain(ambientFilter)]
+	for chain, x in zip(filters,readAll()):
+		chain.prime(x)
+	for ii in range(filterWarmup):
 		sleep(.1)
-	
-	temp1 /= 10
-	inter1 /= 10
-	temp2 /= 10
-	inter2 /= 10
+		for chain, x in zip(filters,readAll()):
+			chain.update(x)
+	temp1,inter1,temp2,inter2 = [chain.value for chain in filters]
+	f1,fi1,f2,fi2 = filters
 	
 	while not shuttingDown and not fault:
 		looptime = time()
-		if temp1 == float('NaN'):
-			temp1 = 0
-		if temp2 == float('NaN'):
-			temp2 = 0
 		t1,i1,t2,i2 = readAll()
 		if False in state1 + state2:
 			print('Thermocouple Fault')
 			fault = True
 			continue
-		temp1 = (9 * temp1 + t1) / 10
-		inter1 = (inter1 * 9 + i1) / 10
-		temp2 = (9 * temp2 + t2) / 10
-		inter2= (inter2 * 9 + i2) / 10
+		t = stats.start()
+		temp1 = f1.update(t1)
+		inter1 = fi1.update(i1)
+		temp2 = f2.update(t2)
+		inter2 = fi2.update(i2)
+		stats.stop('filter',t)
 		if counter % 5 == 0:
-			fastLog.addTemp(linearizeTemp(temp1,inter1),inter1,linearizeTemp(temp2,inter2),inter2,looptime)
-			if fastLog.numEntries % 120 == 0:
-				minutesLog.addTemp(*fastLog.max(120))
-				fastLog.keep_only(7200)
-				if minutesLog.numEntries % 60 == 0:
-					hoursLog.addTemp(*minutesLog.average(60))
-					minutesLog.keep_only(1440)
-					if abs(hoursLog.T1[-1] - hoursLog.T2[-1]) <= 1:
-						pass
-					if hoursLog.numEntries % 24 == 0:
-						daysLog.addTemp(*hoursLog.average(24))
-						hoursLog.keep_only(168)
-						daysLog.keep_only(42)
-						sys.stdout.write('Daily Save\n')
-						sys.stdout.flush()
-						saveLog = True
-			newEntry.set()
+			t = stats.start()
+			lt1 = linearizeTemp(temp1,inter1)
+			lt2 = linearizeTemp(temp2,inter2)
+			stats.stop('linearize',t)
+			logSample((lt1,inter1,lt2,inter2,looptime))
 		if counter == 0:
 			sendStatus = True
 		counter = (counter + 1) % 100
+		stats.record('tick',int((time() - looptime) * 1e9))
 		sleep(max(looptime + 0.1 - time(),0.05))
 
 
+def logSample(sample):
+	# Stores, publishes and checks one (t1, t1ambient, t2, t2ambient, timestamp) sample, then wakes the server
+	# loop to broadcast it.  Shared by ThermoRead and ReplayRead.
+	global saveLog, sampleCount, lastSample, levelAlarm, tempAlarm
+	t = stats.start()
+	lastSample = sample
+	updated = logStore.addSample(*lastSample)
+	if sqlWriter is not None:
+		sqlWriter.add(updated,[logStore.lastEntry(title) for title in updated])
+	if telemetry is not None:
+		telemetry.publish(lastSample)
+	# 'store' is the column appends, 'rollup' the samples that also consolidated tiers
+	stats.stop('store',t)
+	if len(updated) > 1:
+		stats.stop('rollup',t)
+		for title in updated[1:]:
+			forecaster.update(title,logStore.lastEntry(title))
+	t = stats.start()
+	if alarmEngine.update(*lastSample):
+		levelAlarm = alarmEngine.flags['level']
+		tempAlarm = alarmEngine.flags['temp']
+	stats.stop('alarm',t)
+	# The SQLite writer replaces the daily CSV save, unless it has stopped on an error
+	if logStore.titles[-1] in updated and (sqlWriter is None or sqlWriter.error is not None):
+		sys.stdout.write('Daily Save\n')
+		sys.stdout.flush()
+		saveLog = True
+	sampleCount += 1
+	if sampleCount == 1:
+		stats.record('startup',int((time() - bootTime) * 1e9))
+		sys.stdout.write('First sample {:.3f} s after start\n'.format(time() - bootTime))
+		sys.stdout.flush()
+		Thread(target=warmForkserver,daemon=True).start()
+	newEntry.set()
+
+
+def ReplayRead():
+	# Stands in for ThermoRead in replay mode, see ThermoReplay.py
+	global temp1, temp2, inter1, inter2, counter, sendStatus
+	for due, sample in replaySamples(replayRows,replaySpeed):
+		if shuttingDown:
+			break
+		sleep(max(due - time(),0))
+		temp1, inter1, temp2, inter2 = sample[:4]
+		logSample(sample)
+		# Status lines every 20 samples, as often as ThermoRead sends them
+		if counter == 0:
+			sendStatus = True
+		counter = (counter + 1) % 20
+	sys.stdout.write('Replay finished\n')
+	sys.stdout.flush()
+
+
 if __name__ == '__main__':
 	
 	sys.stdout.write('Starting ThermoPi\n')
@@ -754,9 +662,36 @@ if __name__ == '__main__':
 	serveSock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
 	serveSock.bind('./ThermoPi.pe')
 	serveSock.listen(10)
+	# Optional TCP listener speaking the same protocol, used by ThermoCollector.py on other hosts.  None to disable.
+	# It only listens on localhost unless tcpHost says otherwise ('' for all interfaces), and TCP clients may
+	# only run the read-only commands in tcpCommands, the rest (stop, save, email, sync...) stay on the unix socket.
+	tcpPort = None
+	tcpHost = '127.0.0.1'
+	tcpCommands = ('stamp','query','subscribe','unsubscribe','streams','drop')
+	tcpClients = set()
+	listenSocks = [serveSock]
+	if tcpPort is not None:
+		tcpSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		tcpSock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		tcpSock.bind((tcpHost,tcpPort))
+		tcpSock.listen(10)
+		listenSocks.append(tcpSock)
+	# Clients that asked for the sample time stamp on every T1 message ('stamp' command)
+	stampedClients = set()
+	# Clients on a decimated stream instead of every sample ('subscribe' command, see ThermoStream.py)
+	streams = StreamHub()
 	
-	# Set multiprocessing start method to forkserver to minimize overhead
+	# Set multiprocessing start method to forkserver to minimize overhead.  Plot workers are forked from
+	# a forkserver that already has matplotlib (Agg) and the log modules loaded, see ThermoPiPreload.py
+	# and benchSpawn.py.  The forkserver itself is started in the background after the first sample so
+	# the preload never delays acquisition.
 	mp.set_start_method('forkserver')
+	mp.set_forkserver_preload(['ThermoPiPreload'])
+	
+	# Per-stage timing counters, reported by the 'stats' command
+	stats = StageStats()
+	# On-demand profiler / memory tracer sessions, driven by the 'profile' and 'memtrace' commands
+	profiler = ProfileSession()
 	
 	# Define globals for worker interactions
 	newEntry = Event()
@@ -765,9 +700,7 @@ if __name__ == '__main__':
 	lastLogSaveName = None
 	shuttingDown = False
 	tempAlarm = False
-	tempAlarmSent = False
 	levelAlarm = False
-	levelAlarmSent = False
 	
 	# Set term and int signals to be ignored - passed to child processes
 	signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -782,8 +715,31 @@ if __name__ == '__main__':
 	CS1 = 9
 	CS2 = 11
 
-	T1 = mx3.MAX31855(CLK,CS1,SO)   # Sensor 1, placed below the LN fill line
-	T2 = mx3.MAX31855(CLK,CS2,SO) # Sensor 2, placed near the top plug
+	# sensorDriver 'gpio' bit-bangs the board pins through the Adafruit driver, 'spidev' reads the kernel
+	# SPI devices in spiDevices through ThermoSPI.py (needs the board on the SPI pins or an spi-gpio overlay),
+	# 'replay' streams the recording replayFile at replaySpeed instead (see ThermoReplay.py), also set by
+	#	ThermoPi.py replay <file> [speed]
+	sensorDriver = 'gpio'
+	spiDevices = [(0,0),(0,1)]
+	replayFile = None
+	replaySpeed = 1.0
+	replayTier = None
+	if len(sys.argv) > 2 and sys.argv[1] == 'replay':
+		sensorDriver = 'replay'
+		replayFile = sys.argv[2]
+		replaySpeed = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+	sensorBus = None
+	if sensorDriver == 'spidev':
+		from ThermoSPI import MAX31855Bus
+		sensorBus = MAX31855Bus(spiDevices)
+		T1, T2 = sensorBus.sensors
+	elif sensorDriver == 'replay':
+		T1 = T2 = None
+	else:
+		from Adafruit_MAX31855 import MAX31855 as mx3
+		# https://github.com/adafruit/Adafruit_Python_MAX31855/blob/master/Adafruit_MAX31855/MAX31855.py
+		T1 = mx3.MAX31855(CLK,CS1,SO)   # Sensor 1, placed below the LN fill line
+		T2 = mx3.MAX31855(CLK,CS2,SO) # Sensor 2, placed near the top plug
 	
 	# Define globals for current readings
 	temp1 = 0
@@ -794,33 +750,44 @@ if __name__ == '__main__':
 	state1 = [True,True,True,True]
 	state2 = [True,True,True,True]
 	counter = 0
+	sampleCount = 0
+	lastSample = None
 	linearizeTemps = True
 	
-	alarmCondition = 0
+	# Filter chains applied to every 100 ms reading (see ThermoFilter.py), and the number of
+	# readings fed through them before logging starts.  The chains are primed from the first reading,
+	# so no warmup is needed and the first sample is logged immediately.
+	tempFilter = [('ema',0.1)]
+	ambientFilter = [('ema',0.1)]
+	filterWarmup = 0
 	
-	# Initialize logs
-	m = Manager()
-	# sd = m.dict() # Shared Dict
-	ll = dict()
-	t1 = 'T1'
-	t1a = 'T1Ambient'
-	t2 = 'T2'
-	t2a = 'T2Ambient'
-	ts = 'TimeStamp'
-	for log in ['fastLog','minutesLog','hoursLog','daysLog']:
-		ll.update({log+t1:m.list(),log+t1a:m.list(),log+t2:m.list(),log+t2a:m.list(),log+ts:m.list()})
-	log = 'fastLog'
-	fastLog = TempLog('SecondsX2',ll[log+t1],ll[log+t1a],ll[log+t2],ll[log+t2a],ll[log+ts])
-	log = 'minutesLog'
-	minutesLog = TempLog('Minutes',ll[log+t1],ll[log+t1a],ll[log+t2],ll[log+t2a],ll[log+ts])
-	log = 'hoursLog'
-	hoursLog = TempLog('Hours',ll[log+t1],ll[log+t1a],ll[log+t2],ll[log+t2a],ll[log+ts])
-	log = 'daysLog'
-	daysLog = TempLog('Days',ll[log+t1],ll[log+t1a],ll[log+t2],ll[log+t2a],ll[log+ts])
-	# fastLog = TempLog('SecondsX2')
-	# minutesLog = TempLog('Minutes')
-	# hoursLog = TempLog('Hours')
-	# daysLog = TempLog('Days')
+	# Alarm rules evaluated on every logged sample (see ThermoAlarm.py).  T1 sits below the LN fill line
+	# and T2 near the plug, so T1 warming up towards T2 means the level has dropped below T1.
+	alarmRules = [
+		ThresholdRule('LN below T1','level','absdT',below=5,hysteresis=5,holdoff=30),
+		ThresholdRule('T1 out of LN','level','T1',above=-185,hysteresis=3,holdoff=30,window=10),
+		RateRule('T1 warming','level','T1',window=300,maxRate=2,hysteresis=1,holdoff=60),
+		ThresholdRule('Room temperature','temp','T1Ambient',above=35,hysteresis=2,holdoff=120,window=60),
+	]
+	alarmEngine = AlarmEngine(alarmRules)
+	
+	# Warming rate / refill forecast, updated on every Minutes and Hours rollup (see ThermoForecast.py)
+	forecaster = Forecaster()
+	
+	# Initialize logs.  Each tier is (title, step in seconds, capacity, consolidation), see ThermoTiers.py
+	logTiers = defaultTiers
+	# compactLogs keeps the tier columns packed in this process (int32 time stamps, int16 temperatures,
+	# 12 bytes per entry), plot workers get a pickled copy.  Otherwise the columns are lists in a Manager
+	# process that plot workers read through proxies.  The 'memory' command reports the bytes per tier.
+	compactLogs = True
+	m = None
+	if compactLogs:
+		logStore = TierStore(logTiers,packed=True)
+	else:
+		# The Manager is forked directly, it is needed before the first sample and must not wait on the preload
+		m = mp.get_context('fork').Manager()
+		logStore = TierStore(logTiers,m.list)
+	ll = logStore.shared
 	
 	# Term signal handler for systemd implementation
 	termHandler = TermHandler()
@@ -832,22 +799,103 @@ if __name__ == '__main__':
 	
 	# plt.ioff()
 	
-	# Load previous log
-	loadLogsJSON()
+	# Optional HTTP endpoint (Prometheus /metrics and live dashboard), None to disable
+	httpPort = None
+	web = None
+	if httpPort is not None:
+		from ThermoWeb import WebServer
+		web = WebServer(httpPort,history=logStore.query)
+		web.start()
+	
+	# Optional SQLite history (see ThermoSQL.py), None to disable.  Every sample and rollup is committed
+	# incrementally by a writer thread, which replaces the daily full CSV rewrite.
+	sqlLog = None
+	sqlWriter = None
+	sqlErrorShown = False
+	if sqlLog is not None:
+		from ThermoSQL import SQLiteLog
+		sqlWriter = SQLiteLog(sqlLog,logTiers)
+		sqlWriter.start()
+	
+	# Optional MQTT telemetry (see ThermoTelemetry.py), None to disable.  Samples are published in batches
+	# every telemetryInterval seconds and spooled to disk while the broker is unreachable.
+	telemetryHost = None
+	telemetryPort = 1883
+	telemetryInterval = 10
+	telemetry = None
+	# A replay publishes and syncs as <host>-replay with its own spool, so its rows never mix with the real node's
+	nodeName = None
+	spoolDir = 'TelemetrySpool'
+	if sensorDriver == 'replay':
+		nodeName = socket.gethostname() + '-replay'
+		spoolDir = 'ReplaySpool'
+	if telemetryHost is not None:
+		from ThermoTelemetry import TelemetryPublisher
+		telemetry = TelemetryPublisher(telemetryHost,telemetryPort,node=nodeName,interval=telemetryInterval,
+			spoolDir=spoolDir)
+		telemetry.start()
+	
+	# Optional incremental sync of the tiers (see ThermoSync.py), directories or tcp://[token@]host:port of a
+	# ThermoSync.py server.  Only the rows after each destination's high-water mark are sent, every
+	# syncInterval seconds and on the 'sync' command.
+	syncTargets = []
+	syncInterval = 3600
+	syncer = None
+	lastSyncOk = False
+	nextSync = time() + syncInterval
+	if syncTargets:
+		from ThermoSync import Syncer
+		syncer = Syncer(logStore,syncTargets,node=nodeName)
+	
+	# Load previous log, or the recording in replay mode.  A replay starts from an empty store and its
+	# shutdown snapshot goes to ReplayDump.bin, so the LogDump of the real runs is left alone.
+	dumpName = 'LogDump'
+	readerTarget = ThermoRead
+	if sensorDriver == 'replay':
+		from ThermoReplay import loadRecording, replaySamples
+		replayTitle, replayRows = loadRecording(replayFile,logTiers,replayTier)
+		sys.stdout.write('Replaying {} rows of {} from {} at {:g}x\n'.format(len(replayRows['TimeStamp']),
+			replayTitle,replayFile,replaySpeed))
+		sys.stdout.flush()
+		dumpName = 'ReplayDump'
+		readerTarget = ReplayRead
+	else:
+		loadLogsJSON()
+	
+	# Persistent e-mail worker, keeps one SMTP session open and coalesces alarm bursts.  A replay raises the
+	# alarms of the recording, so its mail goes to a LocalSMTPServer stand-in and is only logged.
+	smtpStandIn = None
+	if sensorDriver == 'replay':
+		from ThermoNotify import LocalSMTPServer
+		smtpStandIn = LocalSMTPServer()
+		smtpStandIn.start()
+		notifier = Notifier(host='127.0.0.1',port=smtpStandIn.port,user=None,useSSL=False)
+	else:
+		smtpUser, smtpPassword = loadCredentials()
+		if smtpUser is None:
+			sys.stdout.write('No SMTP credentials, set THERMOPI_SMTP_USER / THERMOPI_SMTP_PASSWORD or SMTPCredentials.json\n')
+		notifier = Notifier(user=smtpUser,password=smtpPassword)
+	notifier.start()
 	
 	# Create and start keyboard listener thread worker
 	keyListener = Thread(target=keyboardListener,daemon=True)
 	keyListener.start()
 	# Create and start thermocouple reader thread worker
-	thermoReader = Thread(target=ThermoRead)
+	thermoReader = Thread(target=readerTarget)
 	thermoReader.start()
 	
-	# Create client list and worker variables
+	# Create client list and worker variables.  save / plot / email requests are queued in jobs and run one
+	# at a time in saver, see queueJob for the request and event format.
 	clients = []
-	emailer = None
-	doEmail = False
+	requestBuffers = dict()
+	jobs = deque()
+	maxJobs = 32
+	# Longest unfinished '#<id> ...' request kept while waiting for its \a
+	maxRequestBytes = 4096
+	jobMessages = {'plot':'Plot Saved','sync':'Log Synced'}
+	runningJob = None
+	mailsDone = deque()
 	saver = None
-	doSave = None
 	
 	try:
 		while not shuttingDown:
@@ -865,23 +913,38 @@ if __name__ == '__main__':
 					# thermoReader.start()
 				# if termHandler.termSig:
 					# shuttingDown = True
-			r,w,e = select([serveSock],[],[],0)
-			for client in r:
-				newConn, addr = serveSock.accept()
+			r,w,e = select(listenSocks,[],[],0)
+			for listener in r:
+				newConn, addr = listener.accept()
+				if listener is not serveSock:
+					newConn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+					tcpClients.add(newConn)
 				clients.append(newConn)
 				sys.stdout.write('Client connected\n')
 				sys.stdout.flush()
 				sendStatus = True
 			if not thermoReader.is_alive() and not shuttingDown:
 				thermoReader.join(0.01)
-				thermoReader = Thread(target=ThermoRead)
+				thermoReader = Thread(target=readerTarget)
 				thermoReader.start()
+			# Nothing to publish before the first sample, lastSample is still None
+			if web is not None and sampleCount > 0 and web.seq != sampleCount:
+				web.publish(sampleCount,{'T1':lastSample[0],'T2':lastSample[2],'Ambient1':lastSample[1],
+					'Ambient2':lastSample[3],'S1':state1[:],'S2':state2[:],'TimeStamp':lastSample[4],
+					'Tiers':[(log.Title,log.numEntries) for log in logStore.logs],'Stats':stats.snapshot()})
 			if newEntry.is_set() and len(clients) > 0:
-				t1 = linearizeTemp(temp1,inter1)
-				t2 = linearizeTemp(temp2,inter2)
-				for client in clients:
+				t = stats.start()
+				# The logged sample, so every client gets the values and time stamp stored in the tiers
+				t1 = lastSample[0]
+				t2 = lastSample[2]
+				for client in clients[:]:
+					if client in streams:
+						continue
 					try:
-						client.sendall('T1: {0:.3f}  T2: {1:.3f}\a'.format(t1,t2).encode('utf-8'))
+						if client in stampedClients:
+							client.sendall('T1: {0:.3f}  T2: {1:.3f}  TimeStamp: {2:.3f}\a'.format(t1,t2,lastSample[4]).encode('utf-8'))
+						else:
+							client.sendall('T1: {0:.3f}  T2: {1:.3f}\a'.format(t1,t2).encode('utf-8'))
 						if sendStatus:
 							client.sendall('Ambient1: {0:.3f}  Ambient2: {1:.3f}\a'.format(inter1,inter2).encode('utf-8'))
 							client.sendall('S1: {}, {}, {}, {}\a'.format(*state1).encode('utf-8'))
@@ -890,94 +953,235 @@ if __name__ == '__main__':
 						sys.stdout.write('Client Send Failed\n')
 						print(e)
 						sys.stdout.flush()
-						clients.remove(client)
+						dropClient(client)
+				for client, line in streams.add(lastSample):
+					try:
+						client.sendall(line)
+					except Exception as e:
+						sys.stdout.write('Client Send Failed\n')
+						print(e)
+						sys.stdout.flush()
+						dropClient(client)
+				stats.stop('broadcast',t)
 				newEntry.clear()
 				if sendStatus:
 					sendStatus = False
 				if saveLog:
 					saveLog = False
-					saver = Thread(target=saveLogsCSV)
-					saver.start()
+					queueJob('csv')
+			if syncer is not None and time() >= nextSync:
+				nextSync = time() + syncInterval
+				queueJob('sync')
+			if sqlWriter is not None and sqlWriter.error is not None and not sqlErrorShown:
+				sqlErrorShown = True
+				sys.stdout.write('SQLite writer stopped, rows are dropped: {}\n'.format(sqlWriter.error))
+				sys.stdout.flush()
 			sleep(0.01)
 			r,w,e = select(clients,[],[],0)
-			if r:
-				for client in r:
-					data = client.recv(32)
-					if data:
-						message = data.decode('utf-8')
-						if message.startswith('stop'):
-							shuttingDown = True
-							continue
-						elif message.startswith('save'):
-							if doSave is None:
-								if 'json' in message:
-									doSave = 'json'
-								else:
-									doSave = 'csv'
-						elif message.startswith('plot'):
-							if doSave is None:
-								doSave = 'plot'
-						elif message.startswith('email'):
-							doEmail = True
-						elif message.startswith('linearize'):
-							if 'off' in message:
-								linearizeTemps = False
-							else:
-								linearizeTemps = True
-						elif message.startswith('drop'):
-							client.close()
-							clients.remove(client)
-							print('Client disconnected')
-			if emailer is not None:
-				if not emailer.is_alive():
-					emailer.join(0.01)
-					emailer = None
-					sys.stdout.write('Email Sent\n')
-					sys.stdout.flush()
-			elif doEmail:
-				if saver is None:
-					doEmail = False
-					sys.stdout.write('Sending email\n')
+			for client in r:
+				# A client that closed or reset its end is dropped, it must not take the daemon down
+				try:
+					data = client.recv(256)
+				except OSError:
+					data = b''
+				if not data:
+					dropClient(client)
+					continue
+				# Requests ending in \a may be pipelined, anything else is a single legacy command
+				buffer = requestBuffers.pop(client,'') + data.decode('utf-8','replace')
+				if '\a' in buffer:
+					*requests, rest = buffer.split('\a')
+				elif buffer.startswith('#'):
+					requests = []
+					rest = buffer
+				else:
+					requests = [buffer]
+					rest = ''
+				if len(rest) > maxRequestBytes:
+					sys.stdout.write('Request too long, dropped\n')
 					sys.stdout.flush()
-					emailer = Process(target=ThermoPiMP.emailFile,args=(lastLogSaveName,notification_email))
-					# emailer = Thread(target=emailLog)
-					emailer.start()
+					if rest.startswith('#'):
+						sendEvent(client,rest[1:].partition(' ')[0][:32],'failed',error='request too long')
+				elif rest:
+					requestBuffers[client] = rest
+				for request in requests:
+					reqId = None
+					message = request
+					if request.startswith('#'):
+						reqId, sep, message = request[1:].partition(' ')
+					if client in tcpClients and not message.startswith(tcpCommands):
+						sendEvent(client,reqId,'failed',error='not allowed over tcp')
+					elif message.startswith('stop'):
+						shuttingDown = True
+						sendEvent(client,reqId,'done',ok=True)
+					elif message.startswith('save'):
+						if 'json' in message:
+							queueJob('json',client,reqId)
+						elif 'compressed' in message:
+							queueJob('compressed',client,reqId)
+						elif 'npz' in message:
+							queueJob('npz',client,reqId)
+						else:
+							queueJob('csv',client,reqId)
+					elif message.startswith('plot'):
+						queueJob('plot',client,reqId)
+					elif message.startswith('email'):
+						queueJob('email',client,reqId)
+					elif message.startswith('jobs'):
+						reply(client,reqId,'JOBS',{'running':runningJob[0] if runningJob is not None else None,
+							'queued':[job[0] for job in jobs]})
+					elif message.startswith('memory'):
+						report = logStore.memory()
+						report['rss'] = rssBytes()
+						if m is not None:
+							report['managerRss'] = rssBytes(m._process.pid)
+						reply(client,reqId,'MEMORY',report)
+					elif message.startswith('sync'):
+						if syncer is None:
+							sendEvent(client,reqId,'failed',error='sync not configured')
+						elif 'status' in message:
+							reply(client,reqId,'SYNC',syncer.status())
+						else:
+							queueJob('sync',client,reqId)
+					elif message.startswith('sql'):
+						reply(client,reqId,'SQL',sqlWriter.status() if sqlWriter is not None else None)
+					elif message.startswith('telemetry'):
+						reply(client,reqId,'TELEMETRY',telemetry.status() if telemetry is not None else None)
+					elif message.startswith('forecast'):
+						reply(client,reqId,'FORECAST',forecaster.report())
+					elif message.startswith('alarms'):
+						reply(client,reqId,'ALARMS',alarmEngine.status())
+					elif message.startswith('stats'):
+						reply(client,reqId,'STATS',stats.snapshot())
+					elif message.startswith('profile') or message.startswith('memtrace'):
+						try:
+							reply(client,reqId,'PROFILE',profiler.command(message))
+						except ValueError as e:
+							sendEvent(client,reqId,'failed',error=str(e))
+					elif message.startswith('query'):
+						try:
+							t = stats.start()
+							result = logStore.query(*parseQuery(message))
+							stats.stop('query',t)
+							reply(client,reqId,'Q',result)
+						except Exception as e:
+							sys.stdout.write('Query Failed\n')
+							print(e)
+							sys.stdout.flush()
+							sendEvent(client,reqId,'failed',error=str(e))
+					elif message.startswith('linearize'):
+						if 'off' in message:
+							linearizeTemps = False
+						else:
+							linearizeTemps = True
+						sendEvent(client,reqId,'done',ok=True)
+					elif message.startswith('stamp'):
+						stampedClients.add(client)
+						sendEvent(client,reqId,'done',ok=True)
+					elif message.startswith('subscribe'):
+						try:
+							streams.subscribe(client,*parseSubscription(message.partition(':')[2]))
+						except ValueError as e:
+							sendEvent(client,reqId,'failed',error=str(e))
+						else:
+							sendEvent(client,reqId,'done',ok=True)
+					elif message.startswith('unsubscribe'):
+						streams.unsubscribe(client)
+						sendEvent(client,reqId,'done',ok=True)
+					elif message.startswith('streams'):
+						reply(client,reqId,'STREAMS',streams.status())
+					elif message.startswith('drop'):
+						sendEvent(client,reqId,'done',ok=True)
+						dropClient(client)
+						break
+					else:
+						sendEvent(client,reqId,'failed',error='unknown command')
+			while alarmEngine.events:
+				t, name, kind, active, value = alarmEngine.events.popleft()
+				if active:
+					sys.stdout.write('Alarm: {} ({:.2f})\n'.format(name,value))
+					notifier.alarm(notification_email,name,'{} alarm: {} ({:.2f})'.format(kind,name,value))
+				else:
+					sys.stdout.write('Alarm cleared: {}\n'.format(name))
+				sys.stdout.flush()
+			# E-mail completions arrive from the notifier thread
+			while mailsDone:
+				client, reqId, ok, attachment = mailsDone.popleft()
+				sendEvent(client,reqId,'done' if ok else 'failed',ok=ok,file=attachment)
 			if saver is not None:
 				if not saver.is_alive():
 					saver.join(0.01)
+					if isinstance(saver,Process):
+						ok = saver.exitcode == 0
+					elif runningJob[0] == 'sync':
+						ok = lastSyncOk
+					else:
+						ok = lastLogSaveName != 'failed'
 					saver = None
-					sys.stdout.write('Log Saved\n')
+					kind, client, reqId, fname = runningJob
+					runningJob = None
+					sendEvent(client,reqId,'done' if ok else 'failed',ok=ok,file=fname if ok else None)
+					if ok:
+						sys.stdout.write(jobMessages.get(kind,'Log Saved') + '\n')
+					else:
+						sys.stdout.write('{} job failed\n'.format(kind.capitalize()))
 					sys.stdout.flush()
-			elif doSave is not None:
-				if doSave == 'plot':
-					doSave = None
-					# saver = Thread(target=savePlot)
-					fname = 'Log_' + str(time()) + '.png'
-					lastLogSaveName = fname
-					saver = Process(target=ThermoPiMP.savePlot,kwargs={'fname':fname,'d':ll})
-					saver.start()
-				elif doSave == 'json':
-					doSave = None
-					saver = Thread(target=saveLogsJSON)
-					saver.start()
-				elif doSave == 'csv':
-					doSave = None
-					saver = Thread(target=saveLogsCSV)
+			elif jobs:
+				kind, client, reqId = jobs.popleft()
+				base = 'Log_' + str(time())
+				if kind == 'email':
+					sys.stdout.write('Sending email\n')
+					sys.stdout.flush()
+					attachment = lastLogSaveName if lastLogSaveName is not None and os.path.isfile(lastLogSaveName) else None
+					notifier.send(notification_email,attachment=attachment,done=emailCallback(client,reqId,attachment))
+					sendEvent(client,reqId,'started',kind=kind,file=attachment)
+				else:
+					if kind == 'plot':
+						fname = base + '.png'
+						lastLogSaveName = fname
+						saver = Process(target=ThermoPiMP.savePlot,kwargs={'fname':fname,'d':ll,'tiers':logTiers})
+					elif kind == 'json':
+						fname = base + '.json'
+						saver = Thread(target=saveLogsJSON,args=(base,))
+					elif kind == 'compressed':
+						fname = base + '.tpc'
+						saver = Thread(target=saveLogsCompressed,args=(base,))
+					elif kind == 'npz':
+						fname = base + '.npz'
+						saver = Thread(target=saveLogsNpz,args=(base,))
+					elif kind == 'sync':
+						fname = None
+						saver = Thread(target=syncLogs)
+					else:
+						fname = base + '.csv'
+						saver = Thread(target=saveLogsCSV,args=(base,))
 					saver.start()
+					runningJob = (kind,client,reqId,fname)
+					sendEvent(client,reqId,'started',kind=kind,file=fname)
+			profiler.poll()
 			if termHandler.termSig:
 				shuttingDown = True
 	except Exception as e:
 		print(e)
 	finally:
 		shuttingDown = True
-		saveLogsJSON('LogDump')
+		saveLogsBinary(dumpName)
 		sleep(0.001)
-		serveSock.close()
+		for listener in listenSocks:
+			listener.close()
 		os.unlink('./ThermoPi.pe')
+		if web is not None:
+			web.stop()
 		for client in clients:
 			client.close()
-		if emailer is not None:
-			emailer.join(5)
+		notifier.stop(5)
+		if smtpStandIn is not None:
+			sys.stdout.write('Replay mail kept local, {} messages not sent\n'.format(len(smtpStandIn.messages)))
+			smtpStandIn.stop()
+		if sqlWriter is not None:
+			sqlWriter.stop(5)
+		if telemetry is not None:
+			telemetry.stop()
 		if saver is not None:
 			saver.join(5)
 		sleep(0.001)
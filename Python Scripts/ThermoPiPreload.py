@@ -0,0 +1,13 @@
+#!/usr/bin/python3
+
+# Modules preloaded into the multiprocessing forkserver (see mp.set_forkserver_preload in ThermoPi.py)
+#
+# Every worker Process is forked from the forkserver, so anything imported here is already loaded and
+# initialized in the child instead of being imported cold on every plot.
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+plt.ioff()
+
+import ThermoPiMP, ThermoTiers
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+# On-demand profiling of the running daemon
+#
+# profile:sample:<seconds>	sample the stacks of every thread every 10 ms from a helper thread and write
+#							Profile_<time>.txt in collapsed stack format (one 'frame;frame;frame count' per line,
+#							usable with flamegraph.pl / speedscope)
+# profile:cprofile:<seconds>	run cProfile on the server loop thread and write Profile_<time>.prof (pstats)
+# profile:stop				end the running profile session early
+# memtrace:start:<seconds>	start tracemalloc, a snapshot is written automatically after <seconds>
+# memtrace:snapshot			write MemTrace_<time>.snap (tracemalloc.Snapshot.load) and a top-50 text summary
+# memtrace:stop				write a final snapshot and stop tracing
+#
+# Neither profiler runs code on the ThermoRead thread: the sampler only reads its frames and cProfile is
+# only enabled on the thread that calls poll().  tracemalloc does add a small cost to every allocation
+# while it is running, so it is always time boxed.
+
+import sys, threading
+from time import time
+
+
+class SamplingProfiler(threading.Thread):
+	def __init__(self,duration=30,interval=0.01,fname=None):
+		threading.Thread.__init__(self,daemon=True)
+		self.duration = duration
+		self.interval = interval
+		self.fname = fname if fname is not None else 'Profile_' + str(time()) + '.txt'
+		self.stopEvent = threading.Event()
+		self.counts = dict()
+		self.samples = 0
+
+	def run(self):
+		me = threading.get_ident()
+		names = dict()
+		deadline = time() + self.duration
+		while not self.stopEvent.is_set() and time() < deadline:
+			for t in threading.enumerate():
+				names[t.ident] = t.name
+			for ident, frame in sys._current_frames().items():
+				if ident == me:
+					continue
+				stack = []
+				while frame is not None:
+					code = frame.f_code
+					stack.append('{}:{}'.format(code.co_filename.rsplit('/',1)[-1],code.co_name))
+					frame = frame.f_back
+				stack.append(names.get(ident,str(ident)))
+				key = ';'.join(reversed(stack))
+				self.counts[key] = self.counts.get(key,0) + 1
+			self.samples += 1
+			self.stopEvent.wait(self.interval)
+		with open(self.fname,'w') as fid:
+			for key, n in sorted(self.counts.items(), key=lambda kv: -kv[1]):
+				fid.write('{} {}\n'.format(key,n))
+		sys.stdout.write('Profile saved: {} ({} samples)\n'.format(self.fname,self.samples))
+		sys.stdout.flush()
+
+	def stop(self):
+		self.stopEvent.set()
+
+
+class ProfileSession():
+	def __init__(self):
+		self.sampler = None
+		self.cprof = None
+		self.cprofEnd = 0
+		self.cprofName = None
+		self.traceEnd = 0
+
+	def command(self,message):
+		# Returns a short status string for the client
+		args = message.strip().split(':')
+		if args[0] == 'profile':
+			mode = args[1] if len(args) > 1 else 'sample'
+			duration = float(args[2]) if len(args) > 2 and args[2] else 30
+			if mode == 'stop':
+				return self.stopProfile()
+			if self.sampler is not None or self.cprof is not None:
+				return 'busy'
+			if mode == 'cprofile':
+				import cProfile
+				self.cprofName = 'Profile_' + str(time()) + '.prof'
+				self.cprofEnd = time() + duration
+				self.cprof = cProfile.Profile()
+				self.cprof.enable()
+				return 'started ' + self.cprofName
+			self.sampler = SamplingProfiler(duration)
+			self.sampler.start()
+			return 'started ' + self.sampler.fname
+		elif args[0] == 'memtrace':
+			import tracemalloc
+			mode = args[1] if len(args) > 1 else 'snapshot'
+			if mode == 'start':
+				duration = float(args[2]) if len(args) > 2 and args[2] else 300
+				if not tracemalloc.is_tracing():
+					tracemalloc.start(10)
+				self.traceEnd = time() + duration
+				return 'tracing'
+			if not tracemalloc.is_tracing():
+				return 'not tracing'
+			# Snapshots can take a while on a Pi, so they are written from a helper thread
+			fname = 'MemTrace_' + str(time())
+			if mode == 'stop':
+				self.traceEnd = 0
+			threading.Thread(target=self.snapshot,args=(fname,mode == 'stop'),daemon=True).start()
+			return 'saving ' + fname + '.snap'
+		return 'unknown'
+
+	def stopProfile(self):
+		fname = 'none'
+		if self.sampler is not None:
+			self.sampler.stop()
+			fname = self.sampler.fname
+			self.sampler = None
+		if self.cprof is not None:
+			self.cprof.disable()
+			self.cprof.dump_stats(self.cprofName)
+			fname = self.cprofName
+			self.cprof = None
+			sys.stdout.write('Profile saved: {}\n'.format(fname))
+			sys.stdout.flush()
+		return 'stopped ' + fname
+
+	def snapshot(self,fname,stopAfter=False):
+		import tracemalloc
+		snap = tracemalloc.take_snapshot()
+		current, peak = tracemalloc.get_traced_memory()
+		if stopAfter:
+			tracemalloc.stop()
+		snap.dump(fname + '.snap')
+		with open(fname + '.txt','w') as fid:
+			fid.write('current {} bytes, peak {} bytes\n'.format(current,peak))
+			for stat in snap.statistics('lineno')[:50]:
+				fid.write('{}\n'.format(stat))
+		sys.stdout.write('Memory trace saved: {}.snap\n'.format(fname))
+		sys.stdout.flush()
+
+	def poll(self):
+		# Called from the server loop to end time boxed sessions
+		if self.sampler is not None and not self.sampler.is_alive():
+			self.sampler = None
+		if self.cprof is not None and time() >= self.cprofEnd:
+			self.stopProfile()
+		if self.traceEnd and time() >= self.traceEnd:
+			import tracemalloc
+			self.traceEnd = 0
+			if tracemalloc.is_tracing():
+				threading.Thread(target=self.snapshot,args=('MemTrace_' + str(time()),True),daemon=True).start()
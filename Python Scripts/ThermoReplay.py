@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+# Recorded data for the ThermoPi replay mode
+#
+# ThermoPi.py replay <file> [speed] (or sensorDriver = 'replay' with replayFile) runs the daemon on a
+# recording instead of the sensors.  The rows go through the same logging, broadcast and command path as
+# live samples, at speed times their recorded rate, and the recording starts over when it runs out.
+#
+# Recordings are anything the daemon or its tools write: a LogDump.bin snapshot, a compressed .tpc
+# archive, a .json dump, an SQLite history (.db), a .npz export, a single ThermoCodec .tpg block, or a
+# ThermoSync tier directory of .tpg blocks.  Multi-tier files replay their finest tier with data (the raw
+# 0.5 s samples for a fresh snapshot) unless a tier title is given.
+#
+# Replayed samples are stamped with the wall clock time they are emitted at, so clients see live-looking
+# time stamps and latencies measured against them (benchClients.py) are real.
+#
+# Alarms raised by the recording are mailed to a LocalSMTPServer stand-in instead of the notification
+# address, and telemetry and sync run as node <host>-replay, so a replay never looks like the real node.
+
+import os
+from time import time
+
+from ThermoTiers import TierStore, defaultTiers, columns
+
+
+def loadRecording(fname,tiers=defaultTiers,tier=None):
+	# Returns (title, {column: list}) for the replayed tier, ValueError when it holds no rows
+	if os.path.isdir(fname):
+		from ThermoCodec import decodeBlock
+		blocks = sorted((f for f in os.listdir(fname) if f.endswith('.tpg')),key=lambda f: float(f.split('_')[0]))
+		cols = {col:[] for col in columns}
+		for f in blocks:
+			with open(os.path.join(fname,f),'rb') as fid:
+				block = decodeBlock(fid.read())
+			for col in columns:
+				cols[col].extend(block[col])
+		return os.path.basename(os.path.normpath(fname)), checkRows(cols)
+	ext = os.path.splitext(fname)[1]
+	if ext == '.tpg':
+		from ThermoCodec import decodeBlock
+		with open(fname,'rb') as fid:
+			return os.path.basename(fname), checkRows(decodeBlock(fid.read()))
+	if ext == '.npz':
+		from ThermoExport import loadNpz, columnValues
+		meta, data = loadNpz(fname)
+		saveDict = {title:{col:columnValues(view,meta['columns'][title][col]) for col, view in cols.items()}
+			for title, cols in data.items()}
+	else:
+		store = TierStore(tiers)
+		if ext == '.bin':
+			store.loadBinary(fname)
+		elif ext == '.tpc':
+			store.loadCompressed(fname)
+		elif ext == '.json':
+			store.loadJSON(fname)
+		elif ext in ('.db','.sqlite'):
+			store.loadSQLite(fname)
+		else:
+			raise ValueError('Unknown recording type: {}'.format(fname))
+		saveDict = {log.Title:{col:getattr(log,col)[:] for col in columns} for log in store.logs}
+	titles = [tier] if tier is not None else [title for title in saveDict if saveDict[title]['TimeStamp']]
+	if not titles or titles[0] not in saveDict:
+		raise ValueError('No rows to replay in {}'.format(fname))
+	return titles[0], checkRows(saveDict[titles[0]])
+
+
+def checkRows(cols):
+	if len(cols['TimeStamp']) < 2:
+		raise ValueError('Need at least two rows to replay')
+	return cols
+
+
+def replaySamples(cols,speed=1.0,loop=True):
+	# Yields (due, sample) with sample a TempLog entry (t1, t1ambient, t2, t2ambient, due).  due is the wall
+	# clock time the sample should be emitted at, following the recorded spacing divided by speed.  Gaps in
+	# the recording longer than a minute are shortened to one second.
+	ts = cols['TimeStamp']
+	rows = list(zip(cols['T1'],cols['T1Ambient'],cols['T2'],cols['T2Ambient']))
+	due = time()
+	while True:
+		for ind, row in enumerate(rows):
+			if ind > 0:
+				step = ts[ind] - ts[ind - 1]
+				due += (step if 0 <= step <= 60 else 1.0) / speed
+			yield due, row + (due,)
+		if not loop:
+			return
+		due += (ts[-1] - ts[-2]) / speed
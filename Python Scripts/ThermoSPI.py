@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+# Kernel SPI (spidev) driver for the MAX31855 readers
+#
+# The Adafruit driver in software SPI mode toggles the clock from Python for every bit, 32 clocks and about
+# a hundred GPIO calls per read.  Here a read is a single read() on /dev/spidev<bus>.<device>, the clocking
+# is done by the kernel, and MAX31855Bus reads every chip select back to back in one call.
+#
+# The ThermoPi board routes SCK / MISO / CS1 / CS2 to GPIO24 / GPIO10 / GPIO9 / GPIO11, which are not the
+# SPI0 pins (SCLK GPIO11, MISO GPIO9, CE0 GPIO8, CE1 GPIO7).  Either rewire the board to the SPI0 pins or
+# describe the board pins with an spi-gpio device tree overlay; both give spidev devices and this driver
+# works unchanged.
+#
+#	bus = MAX31855Bus([(0,0),(0,1)])
+#	T1, T2 = bus.sensors				same _read32 / readTempC / readInternalC / readState as Adafruit
+#	v1, v2 = bus.read32All()
+#
+# MockSpiDev stands in for spidev.SpiDev in tests and benchmarks, encodeWord builds the raw 32 bit words.
+
+maxSpeed = 5000000		# MAX31855 maximum SCK frequency
+defaultDevices = [(0,0),(0,1)]
+
+
+def encodeWord(temp,internal,faults=0):
+	# faults: bit 0 open circuit, bit 1 short to GND, bit 2 short to VCC
+	word = (int(round(temp / 0.25)) & 0x3FFF) << 18
+	word |= (int(round(internal / 0.0625)) & 0xFFF) << 4
+	if faults & 0x7:
+		word |= (1 << 16) | (faults & 0x7)
+	return word
+
+
+class MAX31855SPI():
+	def __init__(self,bus=0,device=0,speed=maxSpeed,spi=None):
+		if spi is None:
+			import spidev
+			spi = spidev.SpiDev()
+		spi.open(bus,device)
+		spi.max_speed_hz = speed
+		spi.mode = 0
+		self.spi = spi
+
+	def _read32(self):
+		b = self.spi.readbytes(4)
+		return (b[0] << 24) | (b[1] << 16) | (b[2] << 8) | b[3]
+
+	def readTempC(self):
+		v = self._read32()
+		if v & 0x7:
+			return float('NaN')
+		v >>= 18
+		if v & 0x2000:
+			v -= 16384
+		return v * 0.25
+
+	def readInternalC(self):
+		v = self._read32() >> 4
+		internal = v & 0xFFF
+		if v & 0x800:
+			internal -= 4096
+		return internal * 0.0625
+
+	def readState(self):
+		v = self._read32()
+		return {'openCircuit':(v & (1 << 0)) > 0,'shortGND':(v & (1 << 1)) > 0,'shortVCC':(v & (1 << 2)) > 0,
+			'fault':(v & (1 << 16)) > 0}
+
+	def close(self):
+		self.spi.close()
+
+
+class MAX31855Bus():
+	def __init__(self,devices=defaultDevices,speed=maxSpeed,spiFactory=None):
+		# spiFactory() returns an unopened SpiDev like object, spidev.SpiDev by default
+		self.sensors = [MAX31855SPI(bus,device,speed,None if spiFactory is None else spiFactory())
+			for bus, device in devices]
+
+	def read32All(self):
+		return [sensor._read32() for sensor in self.sensors]
+
+	def close(self):
+		for sensor in self.sensors:
+			sensor.close()
+
+
+class MockSpiDev():
+	# Returns word (or successive words from a list, repeating the last one) on every 4 byte read
+	def __init__(self,word=0):
+		self.words = word if isinstance(word,list) else [word]
+		self.max_speed_hz = 0
+		self.mode = 0
+		self.bus = None
+		self.device = None
+		self.reads = 0
+
+	def open(self,bus,device):
+		self.bus = bus
+		self.device = device
+
+	def setReading(self,temp,internal,faults=0):
+		self.words = [encodeWord(temp,internal,faults)]
+
+	def readbytes(self,n):
+		word = self.words[min(self.reads,len(self.words) - 1)]
+		self.reads += 1
+		return [(word >> (8 * (n - 1 - ind))) & 0xFF for ind in range(n)]
+
+	def xfer2(self,data):
+		return self.readbytes(len(data))
+
+	def close(self):
+		self.bus = None
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+
+# Optional SQLite storage for the ThermoPi log tiers
+#
+# One table per tier, named after the tier title, with the TimeStamp as primary key so time range queries
+# use the index:
+#	SELECT TimeStamp, T1, T2 FROM Minutes WHERE TimeStamp BETWEEN strftime('%s','now','-1 day') AND strftime('%s','now')
+#
+# The database runs in WAL mode, so readers (sqlite3 shell, reprocessing scripts) never block the writer
+# and the writer never blocks them.  SQLiteLog is a writer thread fed by ThermoRead: every sample and rollup
+# entry is queued, and the queued rows are inserted and committed in one transaction whenever the first
+# tier rolls up into the next one (or after maxDelay seconds).  Old rows are pruned per tier by retention
+# once a day, tiers without a retention are kept forever.  NaN readings are stored as NULL.
+#
+# The queue holds at most maxQueued samples, rows that do not fit are dropped and counted.  An exception in
+# the writer (a broken or full database) ends it with the error kept in status(), and rows added after that
+# are dropped and counted too, so memory stays bounded while the daemon logs the failure.
+
+import threading, queue, sqlite3
+from time import time
+
+from ThermoTiers import defaultTiers, columns
+
+# tier title -> seconds of history kept in the database
+defaultRetention = {'SecondsX2':30 * 86400}
+
+
+def openDatabase(fname,titles):
+	db = sqlite3.connect(fname,check_same_thread=False)
+	db.execute('PRAGMA journal_mode=WAL')
+	db.execute('PRAGMA synchronous=NORMAL')
+	with db:
+		for title in titles:
+			db.execute('CREATE TABLE IF NOT EXISTS "{}" (TimeStamp REAL PRIMARY KEY, T1 REAL, T1Ambient REAL, '
+				'T2 REAL, T2Ambient REAL) WITHOUT ROWID'.format(title))
+	return db
+
+
+def insertRows(db,title,rows):
+	# rows are TempLog entries, (t1, t1ambient, t2, t2ambient, timestamp)
+	db.executemany('INSERT OR REPLACE INTO "{}" ({}) VALUES (?,?,?,?,?)'.format(title,','.join(columns)),rows)
+
+
+def readRows(db,title,start=None,end=None,limit=None):
+	# Returns {column: list} in time order, the last limit rows when limit is given
+	sql = 'SELECT {} FROM "{}" WHERE TimeStamp BETWEEN ? AND ? ORDER BY TimeStamp DESC'.format(','.join(columns),title)
+	args = [float('-inf') if start is None else start,float('inf') if end is None else end]
+	if limit is not None:
+		sql += ' LIMIT ?'
+		args.append(limit)
+	rows = db.execute(sql,args).fetchall()
+	rows.reverse()
+	nan = float('NaN')
+	out = {col:[nan if row[ind] is None else row[ind] for row in rows] for ind, col in enumerate(columns)}
+	return out
+
+
+class SQLiteLog(threading.Thread):
+	def __init__(self,fname,tiers=defaultTiers,retention=defaultRetention,maxDelay=60,maxQueued=7200):
+		threading.Thread.__init__(self,daemon=True)
+		self.fname = fname
+		self.titles = [tier[0] for tier in tiers]
+		self.retention = dict(retention)
+		self.maxDelay = maxDelay
+		self.q = queue.Queue(maxQueued)
+		self.rows = {title:[] for title in self.titles}
+		self.inserted = 0
+		self.commits = 0
+		self.dropped = 0
+		self.error = None
+		self.lastCommit = time()
+		self.lastPrune = 0
+
+	def add(self,updated,entries):
+		# updated is the title list returned by TierStore.addSample, entries the matching new entries
+		if self.error is not None:
+			self.dropped += 1
+			return
+		try:
+			self.q.put_nowait((updated,entries))
+		except queue.Full:
+			self.dropped += 1
+
+	def stop(self,timeout=5):
+		try:
+			self.q.put(None,timeout=timeout)
+		except queue.Full:
+			pass
+		self.join(timeout)
+
+	def run(self):
+		try:
+			self.write()
+		except Exception as e:
+			self.error = '{}: {}'.format(type(e).__name__,e)
+			# Nothing reads the queue any more
+			while True:
+				try:
+					item = self.q.get_nowait()
+				except queue.Empty:
+					break
+				if item is not None:
+					self.dropped += 1
+
+	def write(self):
+		db = openDatabase(self.fname,self.titles)
+		try:
+			while True:
+				try:
+					item = self.q.get(timeout=max(0.01,self.lastCommit + self.maxDelay - time()))
+				except queue.Empty:
+					item = False
+				if item is None:
+					break
+				rollup = False
+				if item:
+					updated, entries = item
+					for title, entry in zip(updated,entries):
+						self.rows[title].append(entry)
+					rollup = len(updated) > 1
+				if rollup or time() - self.lastCommit >= self.maxDelay:
+					self.flush(db)
+				if time() - self.lastPrune >= 86400:
+					self.prune(db)
+			self.flush(db)
+		finally:
+			db.close()
+
+	def flush(self,db):
+		self.lastCommit = time()
+		n = sum(len(rows) for rows in self.rows.values())
+		if n == 0:
+			return
+		with db:
+			for title, rows in self.rows.items():
+				if rows:
+					insertRows(db,title,rows)
+		self.rows = {title:[] for title in self.titles}
+		self.inserted += n
+		self.commits += 1
+
+	def prune(self,db):
+		self.lastPrune = time()
+		with db:
+			for title, seconds in self.retention.items():
+				if title in self.titles:
+					db.execute('DELETE FROM "{}" WHERE TimeStamp < ?'.format(title),(time() - seconds,))
+
+	def status(self):
+		return {'file':self.fname,'inserted':self.inserted,'commits':self.commits,'queued':self.q.qsize(),
+			'dropped':self.dropped,'error':self.error}
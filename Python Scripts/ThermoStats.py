@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+# Low overhead per-stage timing counters for the ThermoPi hot paths
+#
+# Each stage keeps a call count, total and maximum time and a fixed bucket latency histogram.  Recording
+# is one perf_counter_ns() call and a handful of integer updates, cheap enough to leave on permanently.
+#
+#	t = stats.start()
+#	v = T1._read32()
+#	stats.stop('spi',t)
+
+from time import perf_counter_ns, time
+from bisect import bisect_left
+
+# Histogram bucket upper bounds in microseconds, the last bucket catches everything slower
+bucketBounds = [10,50,100,500,1000,5000,10000,50000,100000,500000]
+
+
+class StageStats():
+	def __init__(self,bounds=bucketBounds):
+		self.bounds = [b * 1000 for b in bounds]
+		self.stages = dict()
+		self.since = time()
+
+	def start(self):
+		return perf_counter_ns()
+
+	def stop(self,stage,t0):
+		self.record(stage,perf_counter_ns() - t0)
+
+	def record(self,stage,ns):
+		s = self.stages.get(stage)
+		if s is None:
+			# [count, total ns, max ns, histogram]
+			s = self.stages[stage] = [0,0,0,[0] * (len(self.bounds) + 1)]
+		s[0] += 1
+		s[1] += ns
+		if ns > s[2]:
+			s[2] = ns
+		s[3][bisect_left(self.bounds,ns)] += 1
+
+	def reset(self):
+		self.stages = dict()
+		self.since = time()
+
+	def snapshot(self):
+		snap = {'since':self.since,'buckets_us':[b // 1000 for b in self.bounds],'stages':{}}
+		for stage, s in list(self.stages.items()):
+			n = s[0]
+			snap['stages'][stage] = {'n':n,'mean_us':round(s[1] / n / 1000,1) if n else 0,
+				'max_us':round(s[2] / 1000,1),'hist':s[3][:]}
+		return snap
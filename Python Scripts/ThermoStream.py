@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+# Decimated live streams for ThermoPi.pe clients
+#
+# By default every client gets each 0.5 s sample and the status lines.  A client can instead subscribe to
+#	subscribe:interval[,field;field...[,mode]]		e.g. subscribe:60,T1;T2,max
+# with fields from T1, T2, Ambient1, Ambient2, TimeStamp (default T1;T2;TimeStamp) and mode one of avg,
+# min, max, last (default avg).  It then receives one line per interval, aligned to multiples of the
+# interval, in the usual format:
+#	T1: 21.250  T2: -195.500  TimeStamp: 1700000040.000
+# where TimeStamp is the start of the interval.  interval 0 streams every sample with the chosen fields.
+# 'unsubscribe' returns to the default stream.
+#
+# Subscribers with the same interval and mode share one RateBucket, so each distinct (interval, mode)
+# costs one aggregation per sample however many clients use it, and each finished interval is formatted
+# once per distinct field selection.  NaN readings are left out of the aggregates.
+
+import math
+
+fields = ['T1','T2','Ambient1','Ambient2','TimeStamp']
+modes = ['avg','min','max','last']
+defaultFields = ('T1','T2','TimeStamp')
+
+
+def parseSubscription(text):
+	# 'interval[,field;field...[,mode]]' -> (interval, fields, mode), ValueError when malformed
+	parts = text.split(',')
+	interval = float(parts[0])
+	if not math.isfinite(interval) or interval < 0 or len(parts) > 3:
+		raise ValueError('Bad subscription: {}'.format(text))
+	selected = defaultFields
+	if len(parts) > 1 and parts[1].strip():
+		names = set(f.strip() for f in parts[1].split(';'))
+		if not names <= set(fields):
+			raise ValueError('Unknown fields: {}'.format(';'.join(sorted(names - set(fields)))))
+		selected = tuple(f for f in fields if f in names)
+	mode = parts[2].strip() if len(parts) > 2 else 'avg'
+	if mode not in modes:
+		raise ValueError('Unknown mode: {}'.format(mode))
+	if interval == 0:
+		# Every sample, the mode is meaningless and all such subscribers share one bucket
+		mode = 'last'
+	return interval, selected, mode
+
+
+def formatLine(selected,values,timestamp):
+	out = []
+	for f in selected:
+		out.append('{}: {:.3f}'.format(f,timestamp if f == 'TimeStamp' else values[fields.index(f)]))
+	return ('  '.join(out) + '\a').encode('utf-8')
+
+
+class RateBucket():
+	# Aggregates T1, T2, Ambient1, Ambient2 over aligned intervals
+	def __init__(self,interval,mode):
+		self.interval = interval
+		self.mode = mode
+		self.start = None
+		self.subscribers = dict()
+		self.reset()
+
+	def reset(self):
+		self.n = [0] * 4
+		self.acc = [float('NaN')] * 4
+
+	def add(self,values,timestamp):
+		# Returns (start, aggregated values) when the sample closes the previous interval, else None
+		if self.interval == 0:
+			return timestamp, values
+		slot = timestamp - timestamp % self.interval
+		out = None
+		if slot != self.start:
+			if self.start is not None and any(self.n):
+				out = (self.start,[acc / n if self.mode == 'avg' and n else acc for acc, n in zip(self.acc,self.n)])
+			self.start = slot
+			self.reset()
+		for ind, x in enumerate(values):
+			if math.isnan(x):
+				continue
+			if self.n[ind] == 0 or self.mode == 'last':
+				self.acc[ind] = x
+			elif self.mode == 'avg':
+				self.acc[ind] += x
+			elif self.mode == 'min':
+				self.acc[ind] = min(self.acc[ind],x)
+			else:
+				self.acc[ind] = max(self.acc[ind],x)
+			self.n[ind] += 1
+		return out
+
+
+class StreamHub():
+	def __init__(self):
+		# (interval, mode) -> RateBucket, client -> its bucket key
+		self.buckets = dict()
+		self.clients = dict()
+
+	def __contains__(self,client):
+		return client in self.clients
+
+	def subscribe(self,client,interval,selected,mode):
+		self.unsubscribe(client)
+		key = (interval,mode)
+		if key not in self.buckets:
+			self.buckets[key] = RateBucket(interval,mode)
+		self.buckets[key].subscribers[client] = selected
+		self.clients[client] = key
+
+	def unsubscribe(self,client):
+		key = self.clients.pop(client,None)
+		if key is None:
+			return
+		bucket = self.buckets[key]
+		del bucket.subscribers[client]
+		if not bucket.subscribers:
+			del self.buckets[key]
+
+	def add(self,sample):
+		# sample is a TempLog entry (t1, t1ambient, t2, t2ambient, timestamp), returns [(client, message)]
+		values = (sample[0],sample[2],sample[1],sample[3])
+		out = []
+		for bucket in self.buckets.values():
+			done = bucket.add(values,sample[4])
+			if done is None:
+				continue
+			lines = dict()
+			for client, selected in bucket.subscribers.items():
+				if selected not in lines:
+					lines[selected] = formatLine(selected,done[1],done[0])
+				out.append((client,lines[selected]))
+		return out
+
+	def status(self):
+		return {'{:g}s {}'.format(*key):len(bucket.subscribers) for key, bucket in self.buckets.items()}
@@ -0,0 +1,342 @@
+#!/usr/bin/python3
+
+# Incremental sync of the log tiers to a central store
+#
+# usage: ThermoSync.py root [port] [--host addr] [--token secret]
+#	serves the store directory root over TCP (default port 8765, localhost only).  Listening on any other
+#	address needs a token, which clients give as tcp://secret@host:port.
+#
+# A destination keeps, per node and tier, the time stamp of the last row it holds (its high-water mark).
+# Syncer.sync asks every destination for its marks and sends only the rows after them, as ThermoCodec
+# blocks of at most maxRows rows, so the bytes sent and the encoding work follow the new data whatever the
+# length of the history.  The store layout is
+#	root/<node>/<tier>/<first>_<last>.tpg	committed blocks (ThermoCodec.decodeBlock)
+#	root/<node>/<tier>/HighWater			TimeStamp of the last committed row
+#	root/<node>/partial/<tier>_<first>_<last>_<digest>.part	upload in progress
+# Blocks are uploaded in chunks to a .part file and only renamed into place, moving the high-water mark,
+# once the sha256 of the whole block checks out.  An interrupted upload is resumed from the size of its
+# .part on the next sync: the block is encoded again from the same rows and the rest sent if its digest
+# still matches the name, otherwise the partial is dropped and the rows sent afresh.
+#
+# Node names, tier titles and block names must be single plain path components, anything else is refused.
+#
+# Destinations are given as a directory path, or tcp://[token@]host:port for a SyncServer:
+#	syncer = Syncer(logStore,['/media/usb/ThermoArchive','tcp://archive.local:8765'])
+#	syncer.sync()
+
+import sys, os, socket, json, hashlib, hmac, threading, socketserver, argparse
+from time import time
+
+from ThermoCodec import encodeBlock
+
+defaultPort = 8765
+# Largest data part of one request, chunks are chunkSize (64 KiB by default)
+maxRequestBytes = 4 * 2 ** 20
+
+
+def blockName(title,first,last,digest):
+	return '{}_{!r}_{!r}_{}'.format(title,first,last,digest[:16])
+
+
+def checkComponent(name):
+	# Node names, tier titles and block names become directory and file names under the store root
+	if not isinstance(name,str) or name in ('','.','..','partial') or '\0' in name or '/' in name \
+			or '\\' in name or (os.altsep is not None and os.altsep in name):
+		raise ValueError('Not a plain name: {!r}'.format(name))
+	return name
+
+
+def parseBlockName(name):
+	# Returns (title, first, last, digest prefix)
+	title, first, last, digest = checkComponent(name).rsplit('_',3)
+	return checkComponent(title), float(first), float(last), digest
+
+
+class DirectoryTarget():
+	def __init__(self,root):
+		self.root = root
+		self.name = root
+
+	def partPath(self,node,name):
+		parseBlockName(name)
+		return os.path.join(self.root,checkComponent(node),'partial',name + '.part')
+
+	def state(self,node):
+		# {'highWater': {title: TimeStamp}, 'partial': {name: bytes received}}
+		highWater = dict()
+		nodeDir = os.path.join(self.root,checkComponent(node))
+		if os.path.isdir(nodeDir):
+			for title in os.listdir(nodeDir):
+				fname = os.path.join(nodeDir,title,'HighWater')
+				if os.path.isfile(fname):
+					with open(fname) as fid:
+						highWater[title] = float(fid.read())
+		partial = dict()
+		partDir = os.path.join(nodeDir,'partial')
+		if os.path.isdir(partDir):
+			for f in os.listdir(partDir):
+				if f.endswith('.part'):
+					partial[f[:-5]] = os.path.getsize(os.path.join(partDir,f))
+		return {'highWater':highWater,'partial':partial}
+
+	def write(self,node,name,offset,data):
+		fname = self.partPath(node,name)
+		os.makedirs(os.path.dirname(fname),exist_ok=True)
+		size = os.path.getsize(fname) if os.path.isfile(fname) else 0
+		if not 0 <= offset <= size:
+			raise ValueError('{} has {} bytes, cannot write at {}'.format(name,size,offset))
+		with open(fname,'r+b' if size else 'wb') as fid:
+			fid.truncate(offset)
+			fid.seek(offset)
+			fid.write(data)
+		return offset + len(data)
+
+	def commit(self,node,name,digest):
+		fname = self.partPath(node,name)
+		h = hashlib.sha256()
+		with open(fname,'rb') as fid:
+			for data in iter(lambda: fid.read(65536),b''):
+				h.update(data)
+			os.fsync(fid.fileno())
+		if h.hexdigest() != digest:
+			os.remove(fname)
+			raise ValueError('Checksum mismatch for {}'.format(name))
+		title, first, last, prefix = parseBlockName(name)
+		tierDir = os.path.join(self.root,node,title)
+		os.makedirs(tierDir,exist_ok=True)
+		os.replace(fname,os.path.join(tierDir,'{!r}_{!r}.tpg'.format(first,last)))
+		mark = os.path.join(tierDir,'HighWater')
+		with open(mark + '.tmp','w') as fid:
+			fid.write(repr(last))
+		os.replace(mark + '.tmp',mark)
+		return last
+
+	def abort(self,node,name):
+		fname = self.partPath(node,name)
+		if os.path.isfile(fname):
+			os.remove(fname)
+
+	def close(self):
+		pass
+
+
+class RemoteTarget():
+	# Same calls as DirectoryTarget, forwarded to a SyncServer.  Every request is one JSON line, followed by
+	# 'size' bytes for writes, and answered by one JSON line.
+	def __init__(self,host,port=defaultPort,timeout=30,token=None):
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.token = token
+		self.name = 'tcp://{}:{}'.format(host,port)
+		self.sock = None
+		self.rfile = None
+
+	def request(self,op,data=b'',**fields):
+		if self.sock is None:
+			self.sock = socket.create_connection((self.host,self.port),timeout=self.timeout)
+			self.rfile = self.sock.makefile('rb')
+		fields['op'] = op
+		fields['size'] = len(data)
+		if self.token is not None:
+			fields['token'] = self.token
+		try:
+			self.sock.sendall((json.dumps(fields) + '\n').encode('utf-8') + data)
+			line = self.rfile.readline()
+		except OSError:
+			self.close()
+			raise
+		if not line:
+			self.close()
+			raise ConnectionError('Sync server closed the connection')
+		answer = json.loads(line.decode('utf-8'))
+		if not answer['ok']:
+			raise RuntimeError(answer['error'])
+		return answer['result']
+
+	def state(self,node):
+		return self.request('state',node=node)
+
+	def write(self,node,name,offset,data):
+		return self.request('write',data,node=node,name=name,offset=offset)
+
+	def commit(self,node,name,digest):
+		return self.request('commit',node=node,name=name,digest=digest)
+
+	def abort(self,node,name):
+		return self.request('abort',node=node,name=name)
+
+	def close(self):
+		if self.sock is not None:
+			self.rfile.close()
+			self.sock.close()
+			self.sock = None
+			self.rfile = None
+
+
+def openTarget(spec):
+	if spec.startswith('tcp://'):
+		token, sep, address = spec[6:].rpartition('@')
+		host, sep, port = address.rpartition(':')
+		return RemoteTarget(host,int(port),token=token or None)
+	return DirectoryTarget(spec)
+
+
+class Syncer():
+	def __init__(self,store,targets,node=None,maxRows=3600,chunkSize=65536):
+		self.store = store
+		self.targets = [openTarget(t) if isinstance(t,str) else t for t in targets]
+		self.node = node if node is not None else socket.gethostname()
+		self.maxRows = maxRows
+		self.chunkSize = chunkSize
+		self.report = {target.name:{'highWater':{},'blocks':0,'rows':0,'bytes':0,'resumed':0,'last':None,'error':None}
+			for target in self.targets}
+
+	def sync(self):
+		# Returns True when every destination is up to date
+		ok = True
+		for target in self.targets:
+			report = self.report[target.name]
+			try:
+				self.syncTarget(target,report)
+			except (OSError,ValueError,RuntimeError) as e:
+				report['error'] = str(e)
+				sys.stdout.write('Sync to {} failed: {}\n'.format(target.name,e))
+				sys.stdout.flush()
+				target.close()
+				ok = False
+			else:
+				report['error'] = None
+				report['last'] = time()
+		return ok
+
+	def syncTarget(self,target,report):
+		state = target.state(self.node)
+		highWater = state['highWater']
+		for name, size in sorted(state['partial'].items()):
+			title, first, last, prefix = parseBlockName(name)
+			block = None
+			if title in self.store.titles and highWater.get(title,float('-inf')) < first:
+				rows = self.store.readRange(self.store.titles.index(title),first,last)
+				if rows is not None:
+					block = encodeBlock(rows)
+			if block is None or hashlib.sha256(block).hexdigest()[:16] != prefix:
+				target.abort(self.node,name)
+				continue
+			highWater[title] = self.upload(target,name,block,size)
+			report['resumed'] += 1
+			report['blocks'] += 1
+			report['rows'] += len(rows['TimeStamp'])
+			report['bytes'] += len(block) - size
+		for ind, title in enumerate(self.store.titles):
+			while True:
+				rows = self.store.readAfter(ind,highWater.get(title,float('-inf')),self.maxRows)
+				if rows is None:
+					break
+				block = encodeBlock(rows)
+				name = blockName(title,rows['TimeStamp'][0],rows['TimeStamp'][-1],hashlib.sha256(block).hexdigest())
+				highWater[title] = self.upload(target,name,block,0)
+				report['blocks'] += 1
+				report['rows'] += len(rows['TimeStamp'])
+				report['bytes'] += len(block)
+		report['highWater'] = highWater
+
+	def upload(self,target,name,block,offset):
+		for pos in range(offset,len(block),self.chunkSize):
+			target.write(self.node,name,pos,block[pos:pos + self.chunkSize])
+		return target.commit(self.node,name,hashlib.sha256(block).hexdigest())
+
+	def status(self):
+		return self.report
+
+	def close(self):
+		for target in self.targets:
+			target.close()
+
+
+class SyncServer(socketserver.ThreadingTCPServer):
+	# Serves a DirectoryTarget to RemoteTarget clients, one lock for all of them.  With a token, requests
+	# without it are refused.
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self,root,host='127.0.0.1',port=0,token=None):
+		self.target = DirectoryTarget(root)
+		self.token = token
+		self.lock = threading.Lock()
+		socketserver.ThreadingTCPServer.__init__(self,(host,port),SyncHandler)
+		self.port = self.server_address[1]
+		self.thread = threading.Thread(target=self.serve_forever,daemon=True)
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+class SyncHandler(socketserver.StreamRequestHandler):
+	def answer(self,answer):
+		self.wfile.write((json.dumps(answer) + '\n').encode('utf-8'))
+
+	def handle(self):
+		while True:
+			line = self.rfile.readline(65536)
+			if not line:
+				return
+			# A request that cannot be framed is answered and the connection closed
+			try:
+				fields = json.loads(line.decode('utf-8'))
+				size = int(fields.get('size',0))
+				if not 0 <= size <= maxRequestBytes:
+					raise ValueError('Bad request size {}'.format(size))
+			except (ValueError,TypeError,AttributeError) as e:
+				self.answer({'ok':False,'error':'Bad request: {}'.format(e)})
+				return
+			data = self.rfile.read(size)
+			if len(data) < size:
+				return
+			try:
+				answer = {'ok':True,'result':self.dispatch(fields,data)}
+			except KeyError as e:
+				answer = {'ok':False,'error':'Missing field {}'.format(e)}
+			except (OSError,ValueError,TypeError) as e:
+				answer = {'ok':False,'error':str(e)}
+			self.answer(answer)
+
+	def dispatch(self,fields,data):
+		token = self.server.token
+		if token is not None and not hmac.compare_digest(str(fields.get('token','')).encode('utf-8'),token.encode('utf-8')):
+			raise ValueError('Bad token')
+		with self.server.lock:
+			target = self.server.target
+			if fields['op'] == 'state':
+				return target.state(fields['node'])
+			elif fields['op'] == 'write':
+				return target.write(fields['node'],fields['name'],int(fields['offset']),data)
+			elif fields['op'] == 'commit':
+				return target.commit(fields['node'],fields['name'],fields['digest'])
+			elif fields['op'] == 'abort':
+				return target.abort(fields['node'],fields['name'])
+			raise ValueError('Unknown request {}'.format(fields['op']))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='ThermoSync store server')
+	parser.add_argument('root',help='store directory')
+	parser.add_argument('port',nargs='?',type=int,default=defaultPort)
+	parser.add_argument('--host',default='127.0.0.1',help='address to listen on, \'\' for all')
+	parser.add_argument('--token',help='shared secret clients must send')
+	args = parser.parse_args()
+	if args.host not in ('127.0.0.1','localhost','::1') and args.token is None:
+		print('Listening on {!r} needs --token'.format(args.host))
+		exit(1)
+	server = SyncServer(args.root,args.host,args.port,args.token)
+	print('Serving {} on port {}'.format(args.root,server.port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
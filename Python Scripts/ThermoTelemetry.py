@@ -0,0 +1,283 @@
+#!/usr/bin/python3
+
+# Batched telemetry publisher (MQTT 3.1.1, QoS 1) for the ThermoPi samples
+#
+# ThermoRead hands every logged sample to TelemetryPublisher.publish, which only appends to a bounded deque,
+# so a slow or missing broker can never hold up acquisition.  A worker thread takes everything queued once
+# per interval, encodes it as one ThermoCodec block (ThermoCodec.decodeBlock on the receiving side) and
+# publishes it to '<prefix>/<node>/samples'.  Batches that cannot be delivered go to a spool directory,
+# bounded to maxSpoolBytes by dropping the oldest, and are replayed in order before new batches once the
+# broker is reachable again.  Reconnects back off from retryMin up to retryMax seconds.
+#
+# Only the packets a QoS 1 publisher needs are implemented: CONNECT / CONNACK, PUBLISH / PUBACK,
+# PINGREQ / PINGRESP and DISCONNECT.  LocalBroker is an in-process stand-in that acknowledges them and
+# keeps every (topic, payload) it receives in .messages:
+#	broker = LocalBroker(); broker.start()
+#	publisher = TelemetryPublisher(port=broker.port)
+
+import sys, os, socket, struct, threading, socketserver
+from collections import deque
+from time import time
+
+from ThermoCodec import encodeBlock, columns
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def encodeLength(n):
+	out = bytearray()
+	while True:
+		b = n % 128
+		n //= 128
+		out.append(b | 0x80 if n else b)
+		if not n:
+			return bytes(out)
+
+
+def packet(kind,flags,body):
+	return bytes([(kind << 4) | flags]) + encodeLength(len(body)) + body
+
+
+def encodeString(s):
+	b = s.encode('utf-8')
+	return struct.pack('>H',len(b)) + b
+
+
+def readPacket(rfile):
+	# Returns (kind, flags, body), None at end of stream
+	first = rfile.read(1)
+	if not first:
+		return None
+	n = 0
+	shift = 0
+	while True:
+		b = rfile.read(1)
+		if not b:
+			return None
+		n |= (b[0] & 0x7F) << shift
+		shift += 7
+		if not b[0] & 0x80:
+			break
+	body = rfile.read(n)
+	if len(body) < n:
+		return None
+	return first[0] >> 4, first[0] & 0x0F, body
+
+
+class TelemetryPublisher(threading.Thread):
+	def __init__(self,host='127.0.0.1',port=1883,node=None,prefix='thermopi',interval=10,user=None,password=None,
+			spoolDir='TelemetrySpool',maxSpoolBytes=8 * 2 ** 20,maxQueued=1200,retryMin=5,retryMax=300,keepAlive=60,
+			timeout=10):
+		threading.Thread.__init__(self,daemon=True)
+		self.host = host
+		self.port = port
+		self.node = node if node is not None else socket.gethostname()
+		self.topic = '{}/{}/samples'.format(prefix,self.node)
+		self.interval = interval
+		self.user = user
+		self.password = password
+		self.spoolDir = spoolDir
+		self.maxSpoolBytes = maxSpoolBytes
+		self.retryMin = retryMin
+		self.retryMax = retryMax
+		self.keepAlive = keepAlive
+		self.timeout = timeout
+		self.samples = deque(maxlen=maxQueued)
+		self.stopEvent = threading.Event()
+		self.sock = None
+		self.rfile = None
+		self.packetId = 0
+		self.retry = retryMin
+		self.retryAt = 0
+		self.lastSend = 0
+		self.sent = 0
+		self.spooled = 0
+		self.dropped = 0
+		self.lost = 0
+
+	def publish(self,sample):
+		# sample is a TempLog entry (t1, t1ambient, t2, t2ambient, timestamp), called from ThermoRead
+		if len(self.samples) == self.samples.maxlen:
+			self.lost += 1
+		self.samples.append(sample)
+
+	def stop(self,timeout=None):
+		# The default waits out a connect attempt in progress plus the final flush
+		self.stopEvent.set()
+		self.join(self.timeout * 2 + 1 if timeout is None else timeout)
+
+	def run(self):
+		os.makedirs(self.spoolDir,exist_ok=True)
+		while not self.stopEvent.wait(self.interval):
+			self.cycle()
+		self.cycle()
+		self.disconnect()
+
+	def cycle(self):
+		batch = self.takeBatch()
+		if self.sock is None and time() < self.retryAt:
+			if batch is not None:
+				self.spool(batch)
+			return
+		try:
+			self.connect()
+			for fname in self.spoolFiles():
+				with open(fname,'rb') as fid:
+					self.send(fid.read())
+				os.remove(fname)
+			if batch is not None:
+				self.send(batch)
+			elif time() - self.lastSend > self.keepAlive / 2:
+				self.ping()
+			self.retry = self.retryMin
+		except (OSError,RuntimeError) as e:
+			sys.stdout.write('Telemetry unavailable: {}\n'.format(e))
+			sys.stdout.flush()
+			self.disconnect()
+			self.retryAt = time() + self.retry
+			self.retry = min(self.retry * 2,self.retryMax)
+			if batch is not None:
+				self.spool(batch)
+
+	def takeBatch(self):
+		n = len(self.samples)
+		if n == 0:
+			return None
+		rows = [self.samples.popleft() for ind in range(n)]
+		# TempLog entries are (t1, t1ambient, t2, t2ambient, timestamp)
+		order = {'T1':0,'T1Ambient':1,'T2':2,'T2Ambient':3,'TimeStamp':4}
+		return encodeBlock({col:[row[order[col]] for row in rows] for col in columns})
+
+	def spoolFiles(self):
+		return sorted(os.path.join(self.spoolDir,f) for f in os.listdir(self.spoolDir) if f.endswith('.tpg'))
+
+	def spool(self,batch):
+		# The counter keeps batches spooled within the same microsecond apart and in order
+		fname = os.path.join(self.spoolDir,'{:.6f}_{:06d}.tpg'.format(time(),self.spooled % 1000000))
+		with open(fname + '.tmp','wb') as fid:
+			fid.write(batch)
+		os.replace(fname + '.tmp',fname)
+		self.spooled += 1
+		files = self.spoolFiles()
+		total = sum(os.path.getsize(f) for f in files)
+		while files and total > self.maxSpoolBytes:
+			total -= os.path.getsize(files[0])
+			os.remove(files.pop(0))
+			self.dropped += 1
+
+	def connect(self):
+		if self.sock is not None:
+			return
+		self.sock = socket.create_connection((self.host,self.port),timeout=self.timeout)
+		self.rfile = self.sock.makefile('rb')
+		flags = 0x02
+		payload = encodeString('thermopi-' + self.node)
+		if self.user is not None:
+			flags |= 0x80
+			payload += encodeString(self.user)
+			if self.password is not None:
+				flags |= 0x40
+				payload += encodeString(self.password)
+		body = encodeString('MQTT') + bytes([4,flags]) + struct.pack('>H',self.keepAlive) + payload
+		self.sock.sendall(packet(CONNECT,0,body))
+		reply = readPacket(self.rfile)
+		if reply is None or reply[0] != CONNACK or reply[2][1] != 0:
+			raise RuntimeError('CONNACK refused: {}'.format(reply))
+		self.lastSend = time()
+
+	def send(self,payload):
+		self.packetId = self.packetId % 65535 + 1
+		body = encodeString(self.topic) + struct.pack('>H',self.packetId) + payload
+		self.sock.sendall(packet(PUBLISH,0x02,body))
+		reply = readPacket(self.rfile)
+		if reply is None or reply[0] != PUBACK or struct.unpack('>H',reply[2][:2])[0] != self.packetId:
+			raise RuntimeError('PUBACK missing: {}'.format(reply))
+		self.lastSend = time()
+		self.sent += 1
+
+	def ping(self):
+		self.sock.sendall(packet(PINGREQ,0,b''))
+		reply = readPacket(self.rfile)
+		if reply is None or reply[0] != PINGRESP:
+			raise RuntimeError('PINGRESP missing')
+		self.lastSend = time()
+
+	def disconnect(self):
+		if self.sock is None:
+			return
+		try:
+			self.sock.sendall(packet(DISCONNECT,0,b''))
+		except OSError:
+			pass
+		self.rfile.close()
+		self.sock.close()
+		self.sock = None
+		self.rfile = None
+
+	def status(self):
+		return {'topic':self.topic,'connected':self.sock is not None,'queued':len(self.samples),'sent':self.sent,
+			'spooled':self.spooled,'spoolFiles':len(self.spoolFiles()),'dropped':self.dropped,'lost':self.lost}
+
+
+class LocalBroker(socketserver.ThreadingTCPServer):
+	# Acknowledges CONNECT / PUBLISH / PINGREQ and keeps (topic, payload) of every PUBLISH in self.messages.
+	# stop() also drops the open connections, to simulate an outage.
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self,host='127.0.0.1',port=0):
+		self.messages = []
+		self.connections = 0
+		self.open = set()
+		socketserver.ThreadingTCPServer.__init__(self,(host,port),LocalBrokerHandler)
+		self.port = self.server_address[1]
+		self.thread = threading.Thread(target=self.serve_forever,daemon=True)
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+		for sock in list(self.open):
+			try:
+				sock.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+
+
+class LocalBrokerHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		self.server.connections += 1
+		self.server.open.add(self.connection)
+		try:
+			self.serve()
+		finally:
+			self.server.open.discard(self.connection)
+
+	def serve(self):
+		while True:
+			p = readPacket(self.rfile)
+			if p is None:
+				return
+			kind, flags, body = p
+			if kind == CONNECT:
+				self.wfile.write(packet(CONNACK,0,b'\x00\x00'))
+			elif kind == PUBLISH:
+				size, = struct.unpack_from('>H',body,0)
+				topic = body[2:2 + size].decode('utf-8')
+				pos = 2 + size
+				if (flags >> 1) & 0x3:
+					self.wfile.write(packet(PUBACK,0,body[pos:pos + 2]))
+					pos += 2
+				self.server.messages.append((topic,body[pos:]))
+			elif kind == PINGREQ:
+				self.wfile.write(packet(PINGRESP,0,b''))
+			elif kind == DISCONNECT:
+				return
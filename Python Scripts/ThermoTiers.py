@@ -0,0 +1,641 @@
+#!/usr/bin/python3
+
+# Multi-resolution retention engine for the ThermoPi logs
+#
+# Each tier is declared as (title, step in seconds, capacity, consolidation) where consolidation is one
+# of 'avg', 'min', 'max' or 'last' and is applied to the entries of the previous tier when enough of
+# them have accumulated to span one step of this tier.  The first tier receives the raw samples, so its
+# consolidation is unused.
+#
+# Keeping a year of hourly data is then just a matter of configuration:
+#	[('SecondsX2',0.5,7200,'last'),('Minutes',60,1440,'max'),('Hours',3600,8760,'avg')]
+#
+# TierStore(tiers, packed=True) keeps every column in a PackedColumn: time stamps as int32 offsets from a
+# tier epoch, thermocouple temperatures as int16 sixteenths of a degree (+-2048 C, four times finer than
+# the 0.25 C sensor resolution) and ambients as int16 1/64ths (+-512 C).  That is 12 bytes per entry,
+# against about 160 for five boxed floats in list slots.  TierStore.memory() reports the bytes per tier.
+
+from time import time, sleep
+from bisect import bisect_left, bisect_right
+from array import array
+import sys, json, csv, struct
+
+
+defaultTiers = [
+	('SecondsX2',0.5,7200,'last'),
+	('Minutes',60,1440,'max'),
+	('Hours',3600,168,'avg'),
+	('Days',86400,42,'avg'),
+]
+
+# Row labels written by saveLogsCSV that differ from the tier title
+csvLabels = {'SecondsX2':'Seconds x2'}
+
+columns = ['T1','T1Ambient','T2','T2Ambient','TimeStamp']
+
+# Steps per degree of the int16 temperature columns of a packed TierStore
+packedScales = {'T1':16,'T1Ambient':64,'T2':16,'T2Ambient':64}
+
+
+class PackedColumn():
+	# List-like column in a typed array.  typecode 'i' holds time stamps as offsets of resolution seconds
+	# from epoch, 'h' holds values as multiples of resolution with -32768 standing for NaN.
+	def __init__(self,typecode='h',resolution=1 / 16):
+		self.data = array(typecode)
+		self.resolution = resolution
+		self.epoch = None
+		self.limit = 2 ** 31 - 1 if typecode == 'i' else 32767
+
+	def encode(self,x):
+		if self.epoch is not None:
+			v = round((x - self.epoch) / self.resolution)
+			if not -self.limit <= v <= self.limit:
+				self.rebase(x)
+				v = 0
+			return v
+		if self.data.typecode == 'i':
+			self.epoch = float(int(x))
+			return round((x - self.epoch) / self.resolution)
+		if x != x:
+			return -32768
+		return max(-self.limit,min(self.limit,round(x / self.resolution)))
+
+	def decode(self,values):
+		if self.epoch is not None:
+			epoch = self.epoch
+			res = self.resolution
+			return [epoch + v * res for v in values]
+		nan = float('NaN')
+		res = self.resolution
+		return [nan if v == -32768 else v * res for v in values]
+
+	def rebase(self,x):
+		# Moves the epoch to x, only needed when a time stamp jumps by more than the int32 range
+		values = self.decode(self.data)
+		self.epoch = float(int(x))
+		limit = self.limit
+		self.data = array('i',[max(-limit,min(limit,round((v - self.epoch) / self.resolution))) for v in values])
+
+	def append(self,x):
+		self.data.append(self.encode(x))
+
+	def extend(self,values):
+		# One pass over the whole column, per value encode only when the epoch has to move
+		if len(values) == 0:
+			return
+		res = self.resolution
+		limit = self.limit
+		if self.data.typecode == 'i':
+			if self.epoch is None:
+				self.epoch = float(int(values[0]))
+			epoch = self.epoch
+			out = [round((x - epoch) / res) for x in values]
+			if max(out) > limit or min(out) < -limit:
+				out = [self.encode(x) for x in values]
+		else:
+			out = [-32768 if x != x else round(x / res) for x in values]
+			if max(out) > limit or min(out) < -limit:
+				out = [v if v == -32768 else max(-limit,min(limit,v)) for v in out]
+		self.data.extend(array(self.data.typecode,out))
+
+	def __len__(self):
+		return len(self.data)
+
+	def __getitem__(self,key):
+		if isinstance(key,slice):
+			return self.decode(self.data[key])
+		return self.decode([self.data[key]])[0]
+
+	def __delitem__(self,key):
+		del self.data[key]
+
+	def __iter__(self):
+		return iter(self[:])
+
+	def clear(self):
+		del self.data[:]
+		if self.data.typecode == 'i':
+			self.epoch = None
+
+	def nbytes(self):
+		return sys.getsizeof(self.data)
+
+
+def packedColumn(col,step):
+	# Time stamps in hundredths of a second below one minute steps (+-248 days), whole seconds above
+	if col == 'TimeStamp':
+		return PackedColumn('i',0.01 if step < 60 else 1.0)
+	return PackedColumn('h',1 / packedScales[col])
+
+
+def entryBytes(col):
+	if isinstance(col,PackedColumn):
+		return col.data.itemsize
+	# list (or Manager list proxy) of boxed floats: one pointer slot plus one float object per entry
+	return 8 + sys.getsizeof(0.0)
+
+
+def columnBytes(col):
+	if isinstance(col,PackedColumn):
+		return col.nbytes()
+	return sys.getsizeof([]) + len(col) * entryBytes(col)
+
+
+class TempLog():
+	def __init__(self,title='generic',t1=None,t1a=None,t2=None,t2a=None,ts=None):
+		self.Title = title
+		self.numEntries = 0
+		if t1 is not None and t1a is not None and t2 is not None and t2a is not None and ts is not None:
+			self.T1 = t1
+			self.T1Ambient = t1a
+			self.T2 = t2
+			self.T2Ambient = t2a
+			self.TimeStamp = ts
+
+		else:
+			self.T1 = []
+			self.T1Ambient = []
+			self.T2 = []
+			self.T2Ambient = []
+			self.TimeStamp = []
+
+	def addTemp(self,t1=0,t1ambient=0,t2=0,t2ambient=0,logtime=None):
+		if logtime is None:
+			self.TimeStamp.append(time())
+		else:
+			self.TimeStamp.append(logtime)
+		self.T1.append(t1)
+		self.T1Ambient.append(t1ambient)
+		self.T2.append(t2)
+		self.T2Ambient.append(t2ambient)
+		self.numEntries += 1
+
+	def average(self,howMany=None):
+		if howMany is None:
+			howMany = self.numEntries
+		T1 = self.T1[-howMany:]
+		t1 = sum(T1) / howMany
+		T1A = self.T1Ambient[-howMany:]
+		t1ambient = sum(T1A) / howMany
+		T2 = self.T2[-howMany:]
+		t2 = sum(T2) / howMany
+		T2A = self.T2Ambient[-howMany:]
+		t2ambient = sum(T2A) / howMany
+		TS = self.TimeStamp[-howMany:]
+		logtime = sum(TS) / howMany
+		return t1, t1ambient, t2, t2ambient, logtime
+
+	def max(self,howMany=None):
+		if howMany is None:
+			howMany = self.numEntries
+		T1 = self.T1[-howMany:]
+		t1 = max(T1)
+		T1A = self.T1Ambient[-howMany:]
+		t1ambient = max(T1A)
+		T2 = self.T2[-howMany:]
+		t2 = max(T2)
+		T2A = self.T2Ambient[-howMany:]
+		t2ambient = max(T2A)
+		TS = self.TimeStamp[-howMany:]
+		logtime = sum(TS) / howMany
+		return t1, t1ambient, t2, t2ambient, logtime
+
+	def min(self,howMany=None):
+		if howMany is None:
+			howMany = self.numEntries
+		T1 = self.T1[-howMany:]
+		t1 = min(T1)
+		T1A = self.T1Ambient[-howMany:]
+		t1ambient = min(T1A)
+		T2 = self.T2[-howMany:]
+		t2 = min(T2)
+		T2A = self.T2Ambient[-howMany:]
+		t2ambient = min(T2A)
+		TS = self.TimeStamp[-howMany:]
+		logtime = sum(TS) / howMany
+		return t1, t1ambient, t2, t2ambient, logtime
+
+	def last(self,howMany=None):
+		return self.T1[-1], self.T1Ambient[-1], self.T2[-1], self.T2Ambient[-1], self.TimeStamp[-1]
+
+	def consolidate(self,fn='avg',howMany=None):
+		if fn == 'max':
+			return self.max(howMany)
+		elif fn == 'min':
+			return self.min(howMany)
+		elif fn == 'last':
+			return self.last(howMany)
+		return self.average(howMany)
+
+	def purge(self,howMany=0):
+		if howMany >= self.numEntries:
+			self.T1.clear()
+			self.T1Ambient.clear()
+			self.T2.clear()
+			self.T2Ambient.clear()
+			self.TimeStamp.clear()
+			self.numEntries = 0
+			return
+		del self.T1[:howMany]
+		del self.T1Ambient[:howMany]
+		del self.T2[:howMany]
+		del self.T2Ambient[:howMany]
+		del self.TimeStamp[:howMany]
+		self.numEntries = len(self.T1)
+
+	def keep_only(self,howMany=None):
+		if howMany is None or howMany >= self.numEntries:
+			return
+		del self.T1[:-howMany]
+		del self.T1Ambient[:-howMany]
+		del self.T2[:-howMany]
+		del self.T2Ambient[:-howMany]
+		del self.TimeStamp[:-howMany]
+		self.numEntries = howMany
+
+	def saveTo(self,fid=None,format='csv'):
+		if format == 'json':
+			if fid is None:
+				closeFile = True
+				fname = 'Log_' + str(time()) + '.json'
+				print('Saving log: {}'.format(fname))
+				fid = open(fname,'w')
+			else:
+				closeFile = False
+			saveDict = {'LogType':self.Title,'TimeStamp':self.TimeStamp[:],'T1':self.T1[:],
+				'T1Ambient':self.T1Ambient[:],'T2':self.T2[:],'T2Ambient':self.T2Ambient[:]}
+			json.dump(saveDict,fid)
+			if closeFile:
+				fid.close()
+		else:
+			if fid is None:
+				fname = 'Log_' + str(time()) + '.csv'
+				print('Saving log: {}'.format(fname))
+				fid = open(fname,'w', newline='')
+				closeFile = True
+			else:
+				closeFile = False
+			try:
+				writer = csv.writer(fid)
+				writer.writerow(['Log Type','Time Stamp','T1','T2','T1 Ambient','T2 Ambient'])
+				writer.writerow([self.Title])
+				t = self.getTable()
+				for ind in range(len(t)):
+					writer.writerow([''] + t[ind])
+				if closeFile:
+					fid.close()
+			except Exception as e:
+				print(e)
+				lastLogSaveName = 'failed'
+			else:
+				lastLogSaveName = fname
+
+	def getDict(self):
+		saveDict = {'TimeStamp':self.TimeStamp[:],'T1':self.T1[:],
+			'T1Ambient':self.T1Ambient[:],'T2':self.T2[:],'T2Ambient':self.T2Ambient[:]}
+		return {self.Title:saveDict}
+
+	def load(self,logdict):
+		if self.numEntries > 0:
+			self.TimeStamp.clear()
+			self.T1.clear()
+			self.T1Ambient.clear()
+			self.T2.clear()
+			self.T2Ambient.clear()
+		self.TimeStamp.extend(logdict['TimeStamp'])
+		self.T1.extend(logdict['T1'])
+		self.T1Ambient.extend(logdict['T1Ambient'])
+		self.T2.extend(logdict['T2'])
+		self.T2Ambient.extend(logdict['T2Ambient'])
+		self.numEntries = len(self.TimeStamp)
+
+	def getJSONBytes(self):
+		saveDict = {'LogType':self.Title,'TimeStamp':self.TimeStamp[:],'T1':self.T1[:],
+			'T1Ambient':self.T1Ambient[:],'T2':self.T2[:],'T2Ambient':self.T2Ambient[:]}
+		return json.dumps(saveDict).encode()
+
+	def getTable(self):
+		ts = self.TimeStamp[:]
+		t1 = self.T1[:]
+		t1a = self.T1Ambient[:]
+		t2 = self.T2[:]
+		t2a = self.T2Ambient[:]
+		t = []
+		for ind in range(len(ts)):
+			t.append([ts[ind],t1[ind],t2[ind],t1a[ind],t2a[ind]])
+			if ind % 1000 == 0:
+				sleep(0)
+		return t
+
+
+def decimate(cols,start,end,maxPoints):
+	# Averages rows into maxPoints equal width time buckets, dropping empty buckets.  A row at end goes into
+	# the last bucket, so at most maxPoints rows come back.
+	width = (end - start) / maxPoints
+	last = maxPoints - 1
+	out = {col:[] for col in columns}
+	ts = cols['TimeStamp']
+	ind = 0
+	n = len(ts)
+	while ind < n:
+		bucket = min(int((ts[ind] - start) / width),last) if width > 0 else 0
+		stop = ind + 1
+		while stop < n and (min(int((ts[stop] - start) / width),last) if width > 0 else 0) == bucket:
+			stop += 1
+		for col in columns:
+			out[col].append(sum(cols[col][ind:stop]) / (stop - ind))
+		ind = stop
+	return out
+
+
+class TierStore():
+	def __init__(self,tiers=defaultTiers,listFactory=list,packed=False):
+		self.tiers = [tuple(tier) for tier in tiers]
+		self.titles = [tier[0] for tier in self.tiers]
+		self.logs = []
+		self.shared = dict()
+		for tier in self.tiers:
+			if packed:
+				cols = [packedColumn(col,tier[1]) for col in columns]
+			else:
+				cols = [listFactory() for col in columns]
+			for col, l in zip(columns,cols):
+				self.shared[tier[0] + col] = l
+			self.logs.append(TempLog(tier[0],*cols))
+		# Number of entries of the previous tier that make up one entry of each tier
+		self.ratios = [1] + [max(1,round(self.tiers[ind][1] / self.tiers[ind - 1][1])) for ind in range(1,len(self.tiers))]
+		# Entries added to each tier since it was last consolidated into the next one
+		self.pending = [0] * len(self.tiers)
+		# Most recent entry added to each tier, for consumers of the rollups
+		self.latest = [None] * len(self.tiers)
+
+	def lastEntry(self,title):
+		return self.latest[self.titles.index(title)]
+
+	def getLog(self,title):
+		return self.logs[self.titles.index(title)]
+
+	def addSample(self,t1,t1ambient,t2,t2ambient,logtime=None):
+		# Returns the titles of every tier that received a new entry
+		self.logs[0].addTemp(t1,t1ambient,t2,t2ambient,logtime)
+		self.latest[0] = (t1,t1ambient,t2,t2ambient,logtime)
+		updated = [self.titles[0]]
+		last = len(self.tiers) - 1
+		ind = 0
+		while ind < last:
+			self.pending[ind] += 1
+			if self.pending[ind] < self.ratios[ind + 1]:
+				break
+			self.pending[ind] = 0
+			entry = self.logs[ind].consolidate(self.tiers[ind + 1][3],self.ratios[ind + 1])
+			self.logs[ind + 1].addTemp(*entry)
+			self.latest[ind + 1] = entry
+			self.logs[ind].keep_only(self.tiers[ind][2])
+			updated.append(self.titles[ind + 1])
+			ind += 1
+		if ind == last:
+			self.logs[last].keep_only(self.tiers[last][2])
+		return updated
+
+	def planTier(self,start,end,maxPoints):
+		# Coarsest tier whose step still gives at least maxPoints points over the range
+		target = (end - start) / max(1,maxPoints)
+		best = 0
+		for ind, tier in enumerate(self.tiers):
+			if tier[1] <= target:
+				best = ind
+		return best
+
+	def readRange(self,ind,start,end):
+		# Reads the rows of one tier with start <= TimeStamp <= end, fetching only that slice of each column
+		log = self.logs[ind]
+		ts = log.TimeStamp[:]
+		lo = bisect_left(ts,start)
+		hi = bisect_right(ts,end)
+		if hi <= lo:
+			return None
+		return {'TimeStamp':ts[lo:hi],'T1':log.T1[lo:hi],'T1Ambient':log.T1Ambient[lo:hi],
+			'T2':log.T2[lo:hi],'T2Ambient':log.T2Ambient[lo:hi]}
+
+	def readAfter(self,ind,since,limit=None):
+		# Reads at most limit rows of one tier with TimeStamp > since.  The column is bisected in place, so
+		# the cost follows the number of rows returned rather than the tier length.  A purge by a rollup
+		# between the bisect and the slices shifts the rows, in which case the read is repeated.
+		log = self.logs[ind]
+		while True:
+			lo = bisect_right(log.TimeStamp,since)
+			hi = len(log.TimeStamp)
+			if limit is not None:
+				hi = min(hi,lo + limit)
+			if hi <= lo:
+				return None
+			rows = {col:getattr(log,col)[lo:hi] for col in columns}
+			if bisect_right(log.TimeStamp,since) == lo:
+				return rows
+
+	def query(self,start=None,end=None,maxPoints=500):
+		# Returns {column: list} covering start..end with at most maxPoints rows.  The data comes from the
+		# tier picked by planTier, with older time taken from coarser tiers and the most recent time (not
+		# yet rolled up) taken from finer tiers.
+		if end is None:
+			end = time()
+		if start is None:
+			start = end - self.tiers[-1][1] * self.tiers[-1][2]
+		k = self.planTier(start,end,maxPoints)
+		half = self.tiers[k][1] / 2
+		segments = []
+		# lo..hi is the time covered so far, empty until a tier has rows in range
+		lo = end
+		hi = start
+		main = self.readRange(k,start,end)
+		if main is not None:
+			segments.append((self.titles[k],main))
+			lo = main['TimeStamp'][0] - half
+			hi = main['TimeStamp'][-1] + half
+		for ind in range(k + 1,len(self.tiers)):
+			if lo <= start:
+				break
+			seg = self.readRange(ind,start,lo)
+			if seg is not None:
+				segments.insert(0,(self.titles[ind],seg))
+				lo = seg['TimeStamp'][0] - self.tiers[ind][1] / 2
+				hi = max(hi,seg['TimeStamp'][-1] + self.tiers[ind][1] / 2)
+		for ind in range(k - 1,-1,-1):
+			if hi >= end:
+				break
+			seg = self.readRange(ind,max(start,hi),end)
+			if seg is None:
+				continue
+			# Rows up to hi are already covered by a coarser tier
+			skip = bisect_right(seg['TimeStamp'],hi)
+			if skip < len(seg['TimeStamp']):
+				segments.append((self.titles[ind],{col:seg[col][skip:] for col in columns}))
+				hi = seg['TimeStamp'][-1]
+		result = {col:[] for col in columns}
+		for title, seg in segments:
+			for col in columns:
+				result[col].extend(seg[col])
+		if len(result['TimeStamp']) > maxPoints:
+			result = decimate(result,start,end,maxPoints)
+		result['Tiers'] = [(title,len(seg['TimeStamp'])) for title, seg in segments]
+		return result
+
+	def memory(self):
+		# Bytes held by the columns of every tier, and the bytes per entry to size the tier capacities
+		report = dict()
+		for log, tier in zip(self.logs,self.tiers):
+			perEntry = sum(entryBytes(getattr(log,col)) for col in columns)
+			report[log.Title] = {'entries':len(log.TimeStamp),'capacity':tier[2],
+				'bytes':sum(columnBytes(getattr(log,col)) for col in columns),'bytesPerEntry':perEntry,
+				'bytesAtCapacity':perEntry * tier[2]}
+		report['total'] = sum(r['bytes'] for r in report.values())
+		return report
+
+	def getDict(self):
+		saveDict = dict()
+		for log in self.logs:
+			saveDict.update(log.getDict())
+		return saveDict
+
+	def load(self,saveDict):
+		for ind, log in enumerate(self.logs):
+			if log.Title in saveDict:
+				log.load(saveDict[log.Title])
+				log.keep_only(self.tiers[ind][2])
+			if ind + 1 < len(self.logs):
+				self.pending[ind] = log.numEntries % self.ratios[ind + 1]
+
+	def saveJSON(self,fname,extra=None):
+		# extra is merged into the top level dict, e.g. {'Forecast': ...}; load() ignores unknown keys
+		saveDict = self.getDict()
+		if extra is not None:
+			saveDict.update(extra)
+		with open(fname,'w') as logfile:
+			json.dump(saveDict,logfile)
+
+	def loadJSON(self,fname):
+		with open(fname) as f:
+			self.load(json.load(f))
+
+	def saveBinary(self,fname):
+		# Lossless snapshot: b'TPB1', uint32 header length, JSON header, then every column of every tier as
+		# raw float64 in the header's byte order.  PackedColumns are written as their raw typed array instead,
+		# with [typecode, resolution, epoch] under header['packed'][title][column].
+		header = {'byteorder':sys.byteorder,'columns':columns,'pending':self.pending,
+			'tiers':[[log.Title,len(log.TimeStamp)] for log in self.logs],'packed':{}}
+		data = []
+		for ind, log in enumerate(self.logs):
+			cols = []
+			for col in columns:
+				c = getattr(log,col)
+				if isinstance(c,PackedColumn):
+					header['packed'].setdefault(log.Title,dict())[col] = [c.data.typecode,c.resolution,c.epoch]
+					cols.append(c.data[:])
+				else:
+					cols.append(array('d',c[:]))
+			n = min(len(c) for c in cols)
+			for c in cols:
+				data.append(c[:n].tobytes())
+			header['tiers'][ind][1] = n
+		head = json.dumps(header).encode('utf-8')
+		with open(fname,'wb') as logfile:
+			logfile.write(b'TPB1' + struct.pack('<I',len(head)) + head)
+			for chunk in data:
+				logfile.write(chunk)
+
+	def loadBinary(self,fname):
+		with open(fname,'rb') as f:
+			raw = f.read()
+		if raw[:4] != b'TPB1':
+			raise ValueError('Not a binary log snapshot')
+		size, = struct.unpack_from('<I',raw,4)
+		header = json.loads(raw[8:8 + size].decode('utf-8'))
+		view = memoryview(raw)
+		pos = 8 + size
+		packed = header.get('packed',dict())
+		for ind, (title, n) in enumerate(header['tiers']):
+			cols = dict()
+			for col in header['columns']:
+				spec = packed.get(title,dict()).get(col)
+				arr = array('d' if spec is None else spec[0])
+				arr.frombytes(view[pos:pos + arr.itemsize * n])
+				pos += arr.itemsize * n
+				if header['byteorder'] != sys.byteorder:
+					arr.byteswap()
+				if spec is not None:
+					source = PackedColumn(spec[0],spec[1])
+					source.data = arr
+					source.epoch = spec[2]
+					arr = source
+				cols[col] = arr
+			if title not in self.titles:
+				continue
+			log = self.getLog(title)
+			# One bulk copy per column: packed columns of the same layout take the array as is, anything else
+			# gets one extend (the arrays pickle as raw bytes when the columns are Manager lists)
+			for col in columns:
+				target = getattr(log,col)
+				if log.numEntries > 0:
+					target.clear()
+				source = cols[col]
+				if isinstance(source,PackedColumn):
+					if isinstance(target,PackedColumn) and target.data.typecode == source.data.typecode \
+							and target.resolution == source.resolution:
+						target.data = source.data
+						target.epoch = source.epoch
+						continue
+					source = source[:]
+				target.extend(source)
+			log.numEntries = n
+			log.keep_only(self.tiers[self.titles.index(title)][2])
+		for ind, title in enumerate(self.titles):
+			if ind < len(header['pending']) and header['tiers'][ind][0] == title:
+				self.pending[ind] = header['pending'][ind]
+			elif ind + 1 < len(self.logs):
+				self.pending[ind] = self.logs[ind].numEntries % self.ratios[ind + 1]
+
+	def saveCompressed(self,fname,quantum=None):
+		from ThermoCodec import encodeArchive, defaultQuantum
+		with open(fname,'wb') as logfile:
+			logfile.write(encodeArchive(self.getDict(),defaultQuantum if quantum is None else quantum))
+
+	def loadCompressed(self,fname):
+		from ThermoCodec import decodeArchive
+		with open(fname,'rb') as f:
+			self.load(decodeArchive(f.read()))
+
+	def saveSQLite(self,fname):
+		# Full export into the ThermoSQL.py schema, rows already present are replaced
+		from ThermoSQL import openDatabase, insertRows
+		db = openDatabase(fname,self.titles)
+		try:
+			with db:
+				for log in self.logs:
+					insertRows(db,log.Title,zip(*[getattr(log,col)[:] for col in columns]))
+		finally:
+			db.close()
+
+	def loadSQLite(self,fname):
+		# Loads the most recent capacity rows of every tier
+		from ThermoSQL import openDatabase, readRows
+		db = openDatabase(fname,self.titles)
+		try:
+			self.load({tier[0]:readRows(db,tier[0],limit=tier[2]) for tier in self.tiers})
+		finally:
+			db.close()
+
+	def saveNpz(self,fname):
+		# Columnar NumPy archive, see ThermoExport.py
+		from ThermoExport import writeNpz
+		writeNpz(fname,{log.Title:{col:getattr(log,col) for col in columns} for log in self.logs},self.tiers)
+
+	def saveCSV(self,fname):
+		with open(fname,'w', newline='') as logfile:
+			writer = csv.writer(logfile)
+			for ind, log in enumerate(self.logs):
+				if ind > 0:
+					writer.writerow(['\t'])
+				writer.writerow(['Log Type','Time Stamp','T1','T2','T1 Ambient','T2 Ambient'])
+				writer.writerow([csvLabels.get(log.Title,log.Title)])
+				for row in log.getTable():
+					writer.writerow([''] + row)
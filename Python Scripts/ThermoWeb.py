@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+
+# Optional built-in HTTP endpoint for ThermoPi
+#
+# GET /metrics				Prometheus / OpenMetrics text exposition of the current readings, fault states,
+#							tier sizes and the StageStats counters
+# GET /						live dashboard page
+# GET /history?span=&points=	downsampled history from TierStore.query as JSON
+# GET /latest?since=<seq>		long-poll for the next sample after <seq>
+# GET /events				Server-Sent Events stream of samples
+#
+# The server loop publishes a small snapshot dict once per logged sample.  Every response body is rendered
+# lazily by the first request after a new sample and served from cache until the next one, and carries an
+# ETag tied to the sample number so browsers revalidate with a 304 instead of a download.  Any number of
+# scrapers or browsers therefore adds no work to the acquisition path.
+
+import threading, json, math
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+stateNames = ['openCircuit','shortGND','shortVCC','fault']
+
+
+def renderMetrics(snap):
+	out = []
+	out.append('# HELP thermopi_temperature_celsius Linearized thermocouple temperature')
+	out.append('# TYPE thermopi_temperature_celsius gauge')
+	for ch in ['T1','T2']:
+		out.append('thermopi_temperature_celsius{{channel="{}"}} {}'.format(ch,snap[ch]))
+	out.append('# HELP thermopi_ambient_celsius Cold junction (board) temperature')
+	out.append('# TYPE thermopi_ambient_celsius gauge')
+	for ch, key in [('T1','Ambient1'),('T2','Ambient2')]:
+		out.append('thermopi_ambient_celsius{{channel="{}"}} {}'.format(ch,snap[key]))
+	out.append('# HELP thermopi_fault MAX31855 fault flags, 1 when the fault is present')
+	out.append('# TYPE thermopi_fault gauge')
+	for ch, key in [('T1','S1'),('T2','S2')]:
+		for name, ok in zip(stateNames,snap[key]):
+			out.append('thermopi_fault{{channel="{}",kind="{}"}} {}'.format(ch,name,0 if ok else 1))
+	out.append('# HELP thermopi_sample_timestamp_seconds Time of the last logged sample')
+	out.append('# TYPE thermopi_sample_timestamp_seconds gauge')
+	out.append('thermopi_sample_timestamp_seconds {}'.format(snap['TimeStamp']))
+	out.append('# HELP thermopi_tier_entries Entries held in each log tier')
+	out.append('# TYPE thermopi_tier_entries gauge')
+	for title, n in snap['Tiers']:
+		out.append('thermopi_tier_entries{{tier="{}"}} {}'.format(title,n))
+	stats = snap.get('Stats')
+	if stats is not None:
+		bounds = stats['buckets_us']
+		out.append('# HELP thermopi_stage_latency_seconds Time spent in each hot path stage')
+		out.append('# TYPE thermopi_stage_latency_seconds histogram')
+		for stage, s in sorted(stats['stages'].items()):
+			acc = 0
+			for b, n in zip(bounds,s['hist']):
+				acc += n
+				out.append('thermopi_stage_latency_seconds_bucket{{stage="{}",le="{}"}} {}'.format(stage,b / 1e6,acc))
+			out.append('thermopi_stage_latency_seconds_bucket{{stage="{}",le="+Inf"}} {}'.format(stage,s['n']))
+			out.append('thermopi_stage_latency_seconds_count{{stage="{}"}} {}'.format(stage,s['n']))
+			out.append('thermopi_stage_latency_seconds_sum{{stage="{}"}} {:.6f}'.format(stage,s['mean_us'] * s['n'] / 1e6))
+	out.append('# EOF')
+	return ('\n'.join(out) + '\n').encode('utf-8')
+
+
+def renderSample(snap):
+	return json.dumps({'seq':snap['seq'],'TimeStamp':snap['TimeStamp'],'T1':snap['T1'],'T2':snap['T2'],
+		'Ambient1':snap['Ambient1'],'Ambient2':snap['Ambient2'],'S1':snap['S1'],'S2':snap['S2']},
+		separators=(',',':')).encode('utf-8')
+
+
+dashboardPage = b'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>ThermoPi</title>
+<style>body{font-family:monospace;margin:1em}canvas{width:100%;height:300px;border:1px solid #ccc}
+span.v{display:inline-block;width:9em}.bad{color:#c00}</style></head>
+<body><h3>ThermoPi</h3>
+<div>T1 <span class="v" id="T1">-</span> T2 <span class="v" id="T2">-</span>
+Ambient1 <span class="v" id="Ambient1">-</span> Ambient2 <span class="v" id="Ambient2">-</span>
+<span id="faults"></span></div>
+<div>span <select id="span"><option value="3600">1 h</option><option value="86400" selected>1 day</option>
+<option value="604800">1 week</option></select> <span id="age"></span></div>
+<canvas id="plot" width="1200" height="300"></canvas>
+<script>
+var data = {TimeStamp:[],T1:[],T2:[]}, span = 86400, points = 600;
+function draw(){
+	var c = document.getElementById('plot'), g = c.getContext('2d');
+	g.clearRect(0,0,c.width,c.height);
+	var ts = data.TimeStamp; if(ts.length < 2) return;
+	var t1 = ts[ts.length-1] - span, lo = Infinity, hi = -Infinity;
+	['T1','T2'].forEach(function(k){data[k].forEach(function(v){if(v<lo)lo=v;if(v>hi)hi=v;});});
+	if(hi - lo < 1){hi += 0.5; lo -= 0.5;}
+	[['T1','#c00'],['T2','#00c']].forEach(function(kc){
+		g.strokeStyle = kc[1]; g.beginPath();
+		ts.forEach(function(t,i){
+			var x = (t - t1) / span * c.width, y = c.height - (data[kc[0]][i] - lo) / (hi - lo) * c.height;
+			if(i) g.lineTo(x,y); else g.moveTo(x,y);
+		});
+		g.stroke();
+	});
+	g.fillText(hi.toFixed(1),2,10); g.fillText(lo.toFixed(1),2,c.height-2);
+}
+function load(){
+	fetch('history?span='+span+'&points='+points).then(function(r){return r.json();}).then(function(h){data = h; draw();});
+}
+function sample(s){
+	['T1','T2','Ambient1','Ambient2'].forEach(function(k){document.getElementById(k).textContent = s[k].toFixed(3);});
+	var f = s.S1.concat(s.S2).indexOf(false) >= 0;
+	document.getElementById('faults').textContent = f ? 'FAULT' : '';
+	document.getElementById('faults').className = f ? 'bad' : '';
+	document.getElementById('age').textContent = new Date(s.TimeStamp*1000).toLocaleString();
+	var ts = data.TimeStamp, step = span / points;
+	// Only append a point once a full plot step has passed, the history already holds the averages
+	if(!ts.length || s.TimeStamp - ts[ts.length-1] >= step){
+		ts.push(s.TimeStamp); data.T1.push(s.T1); data.T2.push(s.T2);
+		while(ts.length && ts[0] < s.TimeStamp - span){ts.shift(); data.T1.shift(); data.T2.shift();}
+		draw();
+	}
+}
+document.getElementById('span').onchange = function(){span = +this.value; load();};
+load();
+if(window.EventSource){
+	new EventSource('events').onmessage = function(e){sample(JSON.parse(e.data));};
+}else{
+	(function poll(seq){
+		fetch('latest?since='+seq).then(function(r){return r.json();}).then(function(s){sample(s); poll(s.seq);},
+			function(){setTimeout(function(){poll(seq);},5000);});
+	})(-1);
+}
+</script></body></html>
+'''
+
+
+class WebServer():
+	def __init__(self,port=8000,host='',history=None):
+		# history(start, end, maxPoints) returns a {column: list} dict, normally TierStore.query
+		self.lock = threading.Lock()
+		self.newSample = threading.Condition(self.lock)
+		self.seq = -1
+		self.snap = None
+		self.cache = dict()
+		self.history = history
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				server.handle(self)
+
+			def log_message(self,format,*args):
+				pass
+
+		self.httpd = ThreadingHTTPServer((host,port),Handler)
+		self.httpd.daemon_threads = True
+		self.port = self.httpd.server_address[1]
+		self.thread = threading.Thread(target=self.httpd.serve_forever,daemon=True)
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def publish(self,seq,snap):
+		# Called by the server loop once per sample, only swaps references
+		snap['seq'] = seq
+		with self.lock:
+			self.seq = seq
+			self.snap = snap
+			self.newSample.notify_all()
+
+	def cached(self,name,render,version=None):
+		# Renders at most once per version (by default once per published sample), returns (version, body)
+		with self.lock:
+			snap = self.snap
+			hit = self.cache.get(name)
+		if version is None:
+			version = snap['seq']
+		if hit is not None and hit[0] == version:
+			return hit
+		hit = (version,render(snap))
+		with self.lock:
+			if len(self.cache) > 64:
+				self.cache = dict()
+			self.cache[name] = hit
+		return hit
+
+	def send(self,req,code,body,ctype,etag=None):
+		if etag is not None and req.headers.get('If-None-Match') == etag:
+			req.send_response(304)
+			req.send_header('ETag',etag)
+			req.end_headers()
+			return
+		req.send_response(code)
+		req.send_header('Content-Type',ctype)
+		req.send_header('Content-Length',str(len(body)))
+		if etag is not None:
+			req.send_header('ETag',etag)
+			req.send_header('Cache-Control','no-cache')
+		req.end_headers()
+		req.wfile.write(body)
+
+	def waitSample(self,since,timeout):
+		with self.lock:
+			self.newSample.wait_for(lambda: self.seq > since,timeout)
+			return self.seq
+
+	def handle(self,req):
+		url = urlsplit(req.path)
+		path = url.path
+		query = parse_qs(url.query)
+		if path == '/':
+			self.send(req,200,dashboardPage,'text/html; charset=utf-8','"dashboard"')
+			return
+		if self.snap is None:
+			self.send(req,503,b'no sample yet\n','text/plain')
+			return
+		if path == '/metrics':
+			seq, body = self.cached('metrics',renderMetrics)
+			self.send(req,200,body,'application/openmetrics-text; version=1.0.0; charset=utf-8')
+		elif path == '/history' and self.history is not None:
+			try:
+				span = float(query.get('span',['86400'])[0])
+				points = int(query.get('points',['500'])[0])
+			except ValueError:
+				span = points = 0
+			if not math.isfinite(span) or span <= 0 or points < 1:
+				self.send(req,400,b'span must be a finite number > 0 and points an integer >= 1\n','text/plain')
+				return
+			points = min(points,5000)
+			# The history only changes once per plot step, the page appends live samples in between
+			step = span / points
+			bucket = int(self.snap['TimeStamp'] // step)
+			def render(snap):
+				end = (bucket + 1) * step
+				result = self.history(end - span,end,points)
+				return json.dumps({col:result[col] for col in ['TimeStamp','T1','T2','T1Ambient','T2Ambient']},
+					separators=(',',':')).encode('utf-8')
+			version, body = self.cached('history{}:{}'.format(span,points),render,bucket)
+			self.send(req,200,body,'application/json','"h{}-{}-{}"'.format(version,span,points))
+		elif path == '/latest':
+			try:
+				since = int(query.get('since',['-1'])[0])
+			except ValueError:
+				self.send(req,400,b'since must be an integer\n','text/plain')
+				return
+			self.waitSample(since,25)
+			seq, body = self.cached('sample',renderSample)
+			self.send(req,200,body,'application/json','"s{}"'.format(seq))
+		elif path == '/events':
+			req.send_response(200)
+			req.send_header('Content-Type','text/event-stream')
+			req.send_header('Cache-Control','no-cache')
+			req.end_headers()
+			seq = -1
+			try:
+				while True:
+					if self.waitSample(seq,15) == seq:
+						req.wfile.write(b': keepalive\n\n')
+					else:
+						seq, body = self.cached('sample',renderSample)
+						req.wfile.write(b'id: ' + str(seq).encode() + b'\ndata: ' + body + b'\n\n')
+					req.wfile.flush()
+			except (BrokenPipeError,ConnectionResetError):
+				pass
+		else:
+			self.send(req,404,b'not found\n','text/plain')
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+# Client load generator for the ThermoPi socket
+#
+# usage: benchClients.py [-n clients] [-t seconds] [--subscribe spec] [--command cmd --every s] [socket]
+#
+# Opens n concurrent clients on the daemon socket (./ThermoPi.pe by default, or host:port when tcpPort is
+# set) and reads all of them from one selector.  Clients ask for time stamped samples ('stamp'), or for a
+# decimated stream with --subscribe (e.g. 0,T1;T2;TimeStamp), and the fan-out latency of every line is the
+# receive time minus the sample TimeStamp (the end of the interval for a subscription), so run it on the
+# daemon host.  With --command every client also
+# sends that request every --every seconds and the round trip to its done / failed event is timed.
+# Reports latency percentiles, lines per second and the least / most lines any one client got.
+#
+# Pair it with the replay mode for live-looking traffic without the sensors:
+#	python3 ThermoPi.py replay LogDump.bin 20 &
+#	python3 benchClients.py -n 200 -t 30 --command stats --every 2
+
+import socket, argparse, selectors, json
+from time import time
+
+
+def percentiles(values,points=(50,90,99,99.9)):
+	values = sorted(values)
+	if not values:
+		return {}
+	out = {'p{:g}'.format(p):values[min(len(values) - 1,int(len(values) * p / 100))] for p in points}
+	out['max'] = values[-1]
+	return out
+
+
+def connect(address):
+	if ':' in address:
+		host, sep, port = address.rpartition(':')
+		sock = socket.create_connection((host,int(port)))
+		sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+	else:
+		sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+		sock.connect(address)
+	return sock
+
+
+class Client():
+	def __init__(self,ind,sock):
+		self.ind = ind
+		self.sock = sock
+		self.buffer = b''
+		self.lines = 0
+		self.requests = dict()
+		self.nextId = 0
+
+	def request(self,command):
+		self.nextId += 1
+		reqId = '{}.{}'.format(self.ind,self.nextId)
+		self.requests[reqId] = time()
+		self.sock.sendall('#{} {}\a'.format(reqId,command).encode('utf-8'))
+
+
+def stampOf(line):
+	# TimeStamp field of a 'T1: x  T2: y  TimeStamp: z' line, None for other lines
+	pos = line.find('TimeStamp: ')
+	if pos < 0:
+		return None
+	return float(line[pos + 11:].split()[0])
+
+
+def run(address,n,duration,subscribe=None,command=None,every=1.0):
+	sel = selectors.DefaultSelector()
+	clients = []
+	for ind in range(n):
+		client = Client(ind,connect(address))
+		client.sock.sendall(('subscribe:{}\a'.format(subscribe) if subscribe else 'stamp\a').encode('utf-8'))
+		client.sock.setblocking(False)
+		sel.register(client.sock,selectors.EVENT_READ,client)
+		clients.append(client)
+	# Subscription lines are stamped with the start of their interval
+	delay = float(subscribe.split(',')[0]) if subscribe else 0.0
+	latency = []
+	roundTrip = []
+	failed = 0
+	start = time()
+	nextCommand = start + every
+	while time() - start < duration:
+		for key, mask in sel.select(0.1):
+			client = key.data
+			try:
+				data = client.sock.recv(65536)
+			except BlockingIOError:
+				continue
+			now = time()
+			if not data:
+				sel.unregister(client.sock)
+				continue
+			*lines, client.buffer = (client.buffer + data).split(b'\a')
+			for line in lines:
+				line = line.decode('utf-8','replace')
+				if line.startswith('EVENT: '):
+					event = json.loads(line[7:])
+					if event['event'] in ('done','failed') and event.get('id') in client.requests:
+						roundTrip.append(now - client.requests.pop(event['id']))
+						failed += event['event'] == 'failed'
+					continue
+				stamp = stampOf(line)
+				if stamp is not None:
+					latency.append(now - stamp - delay)
+					client.lines += 1
+		# No requests in the last interval, their answers would arrive after the end
+		if command and time() >= nextCommand and time() - start < duration - every:
+			nextCommand += every
+			for client in clients:
+				client.request(command)
+	elapsed = time() - start
+	sel.close()
+	for client in clients:
+		client.sock.close()
+	lines = [client.lines for client in clients]
+	report = {'clients':n,'seconds':round(elapsed,1),'lines':sum(lines),'linesPerSecond':round(sum(lines) / elapsed,1),
+		'perClient':{'min':min(lines),'max':max(lines)},
+		'latency_ms':{k:round(v * 1000,2) for k, v in percentiles(latency).items()}}
+	if command:
+		report['command'] = {'sent':sum(client.nextId for client in clients),'answered':len(roundTrip),'failed':failed,
+			'roundTrip_ms':{k:round(v * 1000,2) for k, v in percentiles(roundTrip).items()}}
+	return report
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='ThermoPi client load generator')
+	parser.add_argument('address',nargs='?',default='./ThermoPi.pe',help='unix socket path or host:port')
+	parser.add_argument('-n','--clients',type=int,default=50)
+	parser.add_argument('-t','--seconds',type=float,default=20)
+	parser.add_argument('--subscribe',help='subscription spec instead of stamp, e.g. 0,T1;T2;TimeStamp')
+	parser.add_argument('--command',help='request every client sends, e.g. stats')
+	parser.add_argument('--every',type=float,default=1.0,help='seconds between requests')
+	args = parser.parse_args()
+	report = run(args.address,args.clients,args.seconds,args.subscribe,args.command,args.every)
+	print(json.dumps(report,indent=1))
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+# Per read CPU time and latency of the bit-banged GPIO driver against the spidev driver (ThermoSPI.py)
+#
+# usage: benchSPI.py [reads] [hw]
+# Without hw both drivers run against stand-ins: the Adafruit BitBang SPI (or the same GPIO call pattern
+# when Adafruit_GPIO is not installed) on a GPIO object that only records the calls, and MAX31855SPI on
+# MockSpiDev.  This measures the Python side of each read, the real GPIO and ioctl costs come on top.
+# With hw it reads the sensors on the board pins and /dev/spidev0.0 on a Pi.
+
+import sys
+from time import perf_counter, process_time
+from ThermoSPI import MAX31855SPI, MockSpiDev, encodeWord
+
+CLK = 24
+SO = 10
+CS1 = 9
+
+
+class MockGPIO():
+	# Enough of Adafruit_GPIO.GPIO for SPI.BitBang, MISO shifts out word MSB first
+	def __init__(self,word):
+		self.word = word
+		self.bit = 31
+		self.calls = 0
+
+	def setup(self,pin,mode,pull_up_down=None):
+		self.calls += 1
+
+	def output(self,pin,value):
+		self.calls += 1
+
+	def set_high(self,pin):
+		self.calls += 1
+		self.bit = 31
+
+	def set_low(self,pin):
+		self.calls += 1
+
+	def input(self,pin):
+		self.calls += 1
+		value = (self.word >> self.bit) & 1
+		self.bit = (self.bit - 1) % 32
+		return value
+
+	def is_high(self,pin):
+		return self.input(pin) == 1
+
+
+class EmulatedBitBang():
+	# Same GPIO calls per read as Adafruit_GPIO.SPI.BitBang in mode 0, MSB first
+	def __init__(self,gpio,sclk,miso,ss):
+		self.gpio = gpio
+		self.sclk = sclk
+		self.miso = miso
+		self.ss = ss
+		gpio.set_high(ss)
+
+	def _read32(self):
+		self.gpio.set_low(self.ss)
+		v = 0
+		for ind in range(32):
+			self.gpio.output(self.sclk,True)
+			v = (v << 1) | (1 if self.gpio.is_high(self.miso) else 0)
+			self.gpio.output(self.sclk,False)
+		self.gpio.set_high(self.ss)
+		return v
+
+
+class BitBangSensor():
+	def __init__(self,spi):
+		self.spi = spi
+
+	def _read32(self):
+		raw = self.spi.read(4)
+		return (raw[0] << 24) | (raw[1] << 16) | (raw[2] << 8) | raw[3]
+
+
+def mockBitBang(word):
+	gpio = MockGPIO(word)
+	try:
+		from Adafruit_GPIO import SPI
+	except ImportError:
+		return 'bitbang (emulated)', EmulatedBitBang(gpio,CLK,SO,CS1)
+	return 'bitbang (Adafruit)', BitBangSensor(SPI.BitBang(gpio,CLK,None,SO,CS1))
+
+
+def measure(name,sensor,reads,expect=None):
+	sensor._read32()
+	latency = []
+	c0 = process_time()
+	for ind in range(reads):
+		t = perf_counter()
+		v = sensor._read32()
+		latency.append(perf_counter() - t)
+	cpu = (process_time() - c0) / reads
+	if expect is not None and v != expect:
+		print('{}: read {:08x}, expected {:08x}'.format(name,v,expect))
+	latency.sort()
+	print('{:20s} cpu {:8.1f} us/read   latency median {:8.1f} us  p99 {:8.1f} us'.format(name,cpu * 1e6,
+		latency[len(latency) // 2] * 1e6,latency[int(len(latency) * 0.99)] * 1e6))
+	return cpu
+
+
+if __name__ == '__main__':
+	reads = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	if len(sys.argv) > 2 and sys.argv[2] == 'hw':
+		from Adafruit_MAX31855 import MAX31855 as mx3
+		slow = measure('bitbang (GPIO)',mx3.MAX31855(CLK,CS1,SO),reads)
+		fast = measure('spidev0.0',MAX31855SPI(0,0),reads)
+	else:
+		word = encodeWord(-195.75,21.5)
+		name, sensor = mockBitBang(word)
+		slow = measure(name,sensor,reads,word)
+		fast = measure('spidev (mock)',MAX31855SPI(0,0,spi=MockSpiDev(word)),reads,word)
+	print('spidev path uses {:.1f}x less CPU per read'.format(slow / fast))
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+# SQLite history (ThermoSQL.py) against the JSON / CSV dump path
+#
+# usage: benchSQL.py [hours]
+# Feeds <hours> (default 24) of 0.5 s samples through a TierStore with an SQLiteLog writer attached, then
+# compares the insert throughput with the time of one full saveCSV / saveJSON dump of the same store, and
+# the latency of range queries against the database with reading them back from the JSON dump.
+
+import sys, os, json, tempfile, random, shutil
+from time import perf_counter, time
+from ThermoTiers import TierStore, defaultTiers
+from ThermoSQL import SQLiteLog, openDatabase, readRows
+
+
+def timed(fn,*args):
+	t = perf_counter()
+	result = fn(*args)
+	return perf_counter() - t, result
+
+
+if __name__ == '__main__':
+	hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+	n = int(hours * 7200)
+	tmp = tempfile.mkdtemp()
+	dbName = os.path.join(tmp,'ThermoPi.db')
+	store = TierStore(defaultTiers)
+	writer = SQLiteLog(dbName,defaultTiers)
+	writer.start()
+	t0 = time() - n * 0.5
+	t1 = -195.0
+	start = perf_counter()
+	addTime = 0
+	for ind in range(n):
+		t1 += random.gauss(0,0.05)
+		a = perf_counter()
+		updated = store.addSample(t1,21.0,t1 + 70,21.5,t0 + ind * 0.5)
+		writer.add(updated,[store.lastEntry(title) for title in updated])
+		addTime += perf_counter() - a
+	writer.stop(600)
+	total = perf_counter() - start
+	print('{} samples, {} rows in {} commits'.format(n,writer.inserted,writer.commits))
+	print('sqlite  {:10.0f} rows/s overall, {:6.1f} us per sample on the acquisition thread'.format(
+		writer.inserted / total,addTime / n * 1e6))
+	csvTime, r = timed(store.saveCSV,os.path.join(tmp,'Log.csv'))
+	jsonTime, r = timed(store.saveJSON,os.path.join(tmp,'Log.json'))
+	print('csv dump  {:8.1f} ms per save, json dump {:8.1f} ms per save'.format(csvTime * 1000,jsonTime * 1000))
+	print('db {:.1f} MB, csv {:.1f} MB, json {:.1f} MB'.format(*[os.path.getsize(os.path.join(tmp,f)) / 1e6
+		for f in ['ThermoPi.db','Log.csv','Log.json']]))
+
+	end = t0 + n * 0.5
+	db = openDatabase(dbName,store.titles)
+	for title, span in [('SecondsX2',3600),('Minutes',86400),('Hours',7 * 86400)]:
+		sqlTime, rows = timed(readRows,db,title,end - span,end)
+		def fromJSON():
+			with open(os.path.join(tmp,'Log.json')) as f:
+				d = json.load(f)[title]
+			return [t for t in d['TimeStamp'] if end - span <= t <= end]
+		jsonTime, jrows = timed(fromJSON)
+		print('{:10s} last {:7.0f} s: sqlite {:7.2f} ms ({} rows), json {:7.2f} ms ({} rows)'.format(title,span,
+			sqlTime * 1000,len(rows['TimeStamp']),jsonTime * 1000,len(jrows)))
+	db.close()
+	restore = TierStore(defaultTiers)
+	loadTime, r = timed(restore.loadSQLite,dbName)
+	print('loadSQLite {:.1f} ms, {} entries'.format(loadTime * 1000,[log.numEntries for log in restore.logs]))
+	shutil.rmtree(tmp)
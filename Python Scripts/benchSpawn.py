@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+# Measures worker start latency from the forkserver, with and without the ThermoPiPreload modules
+#
+# usage: benchSpawn.py [runs]
+# Each mode runs in a fresh interpreter because the preload list is fixed once the forkserver is running.
+
+import sys, os, subprocess
+from time import time, perf_counter
+
+
+def probe(t0,q):
+	# Does the same imports as ThermoPiMP.savePlot before it can start drawing
+	try:
+		import matplotlib
+		matplotlib.use('Agg')
+		from matplotlib import pyplot as plt
+	except ImportError:
+		pass
+	import ThermoTiers
+	q.put(perf_counter() - t0)
+
+
+def run(preload,runs):
+	import multiprocessing as mp
+	mp.set_start_method('forkserver')
+	if preload:
+		mp.set_forkserver_preload(['ThermoPiPreload'])
+	from multiprocessing import forkserver
+	t = perf_counter()
+	forkserver.ensure_running()
+	warm = perf_counter() - t
+	q = mp.Queue()
+	times = []
+	for ind in range(runs):
+		t0 = perf_counter()
+		p = mp.Process(target=probe,args=(t0,q))
+		p.start()
+		times.append(q.get(timeout=60))
+		p.join()
+	times.sort()
+	print('{:10s} forkserver start {:7.1f} ms   worker ready median {:7.1f} ms  max {:7.1f} ms'.format(
+		'preload' if preload else 'cold',warm * 1000,times[len(times) // 2] * 1000,times[-1] * 1000))
+
+
+if __name__ == '__main__':
+	if len(sys.argv) > 2:
+		run(sys.argv[2] == 'preload',int(sys.argv[1]))
+	else:
+		runs = sys.argv[1] if len(sys.argv) > 1 else '10'
+		here = os.path.dirname(os.path.abspath(__file__))
+		for mode in ['cold','preload']:
+			subprocess.run([sys.executable,os.path.abspath(__file__),runs,mode],cwd=here)
@@ -1,11 +1,25 @@
 #!/usr/bin/python3
 
+# usage: monitorThermoPi.py [minutes]
+#
+# Keeps the last <minutes> (default 10) of T1 / T2 samples in a fixed ring buffer and shows sparklines and
+# min / max over that window.  The screen is only redrawn where it changed, at most once per frameInterval,
+# so a fast sample stream costs a few bytes per frame over SSH instead of a full repaint per message.
+
 import socket, sys
 from select import select
-from time import sleep
+from time import sleep, time
+from array import array
 import threading
 
 running = True
+redraw = False
+
+historyMinutes = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+sparkWidth = 60
+frameInterval = 0.1
+sparkChars = '\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'
+promptRow = 10
 
 sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
 
@@ -14,8 +28,88 @@ s2Text = 'S2:     ,     ,     ,     '
 amText = 'Ambient1: **.***  Ambient2: **.***'
 tpText = 'T1: -***.***  T2: -***.***'
 
+
+class History():
+	# Ring buffer of (time, T1, T2), sized for rate samples per second over the window
+	def __init__(self,seconds,rate=2):
+		self.seconds = seconds
+		self.size = int(seconds * rate * 1.25) + 16
+		self.times = array('d',[0.0]) * self.size
+		self.t1 = array('f',[0.0]) * self.size
+		self.t2 = array('f',[0.0]) * self.size
+		self.pos = 0
+		self.n = 0
+
+	def add(self,t,t1,t2):
+		self.times[self.pos] = t
+		self.t1[self.pos] = t1
+		self.t2[self.pos] = t2
+		self.pos = (self.pos + 1) % self.size
+		self.n = min(self.n + 1,self.size)
+
+	def recent(self,now):
+		# Indices of the samples inside the window, oldest first
+		start = now - self.seconds
+		for ind in range(self.pos - self.n,self.pos):
+			ind %= self.size
+			if self.times[ind] >= start:
+				yield ind
+
+	def summary(self,col,now,width):
+		# Returns (sparkline, min, max) for column col over the window
+		values = self.t1 if col == 1 else self.t2
+		start = now - self.seconds
+		sums = [0.0] * width
+		counts = [0] * width
+		lo = float('inf')
+		hi = -lo
+		for ind in self.recent(now):
+			v = values[ind]
+			if v != v:
+				continue
+			b = min(int((self.times[ind] - start) / self.seconds * width),width - 1)
+			sums[b] += v
+			counts[b] += 1
+			lo = min(lo,v)
+			hi = max(hi,v)
+		if lo > hi:
+			return ' ' * width, None, None
+		span = max(hi - lo,1e-3)
+		line = ''.join(' ' if c == 0 else sparkChars[min(int((s / c - lo) / span * len(sparkChars)),len(sparkChars) - 1)]
+			for s, c in zip(sums,counts))
+		return line, lo, hi
+
+
+class Screen():
+	# Remembers the text on every row and only rewrites the cells from the first difference onwards
+	def __init__(self):
+		self.rows = dict()
+
+	def clear(self):
+		self.rows = dict()
+		return '\033[2J'
+
+	def put(self,row,text):
+		old = self.rows.get(row)
+		if old == text:
+			return ''
+		self.rows[row] = text
+		start = 0
+		if old is not None:
+			n = min(len(old),len(text))
+			while start < n and old[start] == text[start]:
+				start += 1
+		out = '\033[{};{}H'.format(row,start + 1) + text[start:]
+		if old is None or len(text) < len(old):
+			out += '\033[K'
+		return out
+
+
+history = History(historyMinutes * 60)
+screen = Screen()
+
 def keyboardListener():
-	global running, sock
+	global running, sock, redraw
 	email = False
 	display = False
 	message = ''
@@ -43,12 +137,16 @@ def keyboardListener():
 			message = 'save:'
 			if 'json' in entry:
 				message += 'json'
+			elif 'compressed' in entry:
+				message += 'compressed'
+			elif 'npz' in entry:
+				message += 'npz'
 		elif entry.find('linearize') > -1:
 			message = 'linearize:'
 			if entry.find('on') > -1:
 				message += 'on'
 		elif 'redraw' in entry:
-			drawDisplay()
+			redraw = True
 			continue
 		if len(message) > 0:
 			try:
@@ -72,55 +170,94 @@ except socket.error as msg:
 	sys.exit(1)
 	
 
-def drawDisplay():
-	sys.stdout.write("\033[2J")
-	sys.stdout.flush()
-	sys.stdout.write("\033[1;0H\033[2J") # Title on line 1
-	print('ThermoPi monitor',end='')
-	sys.stdout.write("\033[2;0H") # Status labels on line 2
-	print('  NoProbe  GND  VCC  fault',end='')
-	sys.stdout.write("\033[3;0H") # Status 1 on line 3
-	print(s1Text,end='')
-	sys.stdout.write("\033[4;0H") # Status 2 on line 4
-	print(s2Text,end='')
-	sys.stdout.write("\033[5;0H") # Ambients on line 5
-	print(amText,end='')
-	sys.stdout.write("\033[6;0H") # Temps on line 6
-	print(tpText,end='')
-	sys.stdout.write("\033[7;0H") # Prompt on line 7
-	print('mTP:> ',end='')
+def render(full=False):
+	# Builds the escape sequences for everything that changed and writes them in one go
+	now = time()
+	out = []
+	if full:
+		out.append(screen.clear())
+	age = now - lastRecv
+	out.append(screen.put(1,'ThermoPi monitor' + ('  (no message for {:.0f} s)'.format(age) if age > 1 else '')))
+	out.append(screen.put(2,'  NoProbe  GND  VCC  fault'))
+	out.append(screen.put(3,s1Text))
+	out.append(screen.put(4,s2Text))
+	out.append(screen.put(5,amText))
+	out.append(screen.put(6,tpText))
+	for row, col, name in [(8,1,'T1'),(9,2,'T2')]:
+		line, lo, hi = history.summary(col,now,sparkWidth)
+		if lo is None:
+			out.append(screen.put(row,'{} {}'.format(name,line)))
+		else:
+			out.append(screen.put(row,'{} {}  min {:9.3f}  max {:9.3f}'.format(name,line,lo,hi)))
+	out.append(screen.put(7,'Last {:g} min, {} samples'.format(historyMinutes,sum(1 for ind in history.recent(now)))))
+	text = ''.join(out)
+	if full:
+		sys.stdout.write(text + '\033[{};1H\033[K'.format(promptRow))
+		print('mTP:> ',end='')
+	elif text:
+		sys.stdout.write('\033[s' + text + '\033[u')
 	sys.stdout.flush()
 
 
+def parseTemps(message):
+	global tpText
+	tpText = message
+	fields = message.split()
+	try:
+		history.add(time(),float(fields[1]),float(fields[3]))
+	except (IndexError,ValueError):
+		pass
+
+
+def parseAmbient(message):
+	global amText
+	amText = message
+
+
+def parseS1(message):
+	global s1Text
+	s1Text = message
+
+
+def parseS2(message):
+	global s2Text
+	s2Text = message
+
+
+handlers = {'T1':parseTemps,'Ambient1':parseAmbient,'S1':parseS1,'S2':parseS2}
+
 incoming = ''
 message = ''
 
+lastRecv = time()
+lastFrame = 0
+dirty = False
+
 try:
-	drawDisplay()
+	render(True)
 	while running:
-		r,w,e = select([sock],[],[],1)
+		r,w,e = select([sock],[],[],frameInterval)
 		if r:
-			incoming += sock.recv(1024).decode('utf-8')
+			data = sock.recv(4096)
+			if not data:
+				break
+			lastRecv = time()
+			dirty = True
+			incoming += data.decode('utf-8')
 			while '\a' in incoming:
 				message, incoming = incoming.split('\a',1)
-				if 'T1:' in message:
-					tpText = message
-					sys.stdout.write("\033[s\033[6;0H\033[K")
-					print(message,end='')
-					sys.stdout.write("\033[u")
-					sys.stdout.flush()
-				elif 'Ambient1:' in message:
-					amText = message
-				elif 'S1:' in message:
-					s1Text = message
-				elif 'S2:' in message:
-					s2Text = message
-					drawDisplay()
-		else:
-			sys.stdout.write("\033[s\033[6;0H\033[K")
-			print('No message',end='')
-			sys.stdout.write("\033[u")
-			sys.stdout.flush()
+				handler = handlers.get(message.split(':',1)[0])
+				if handler is not None:
+					handler(message)
+		if redraw:
+			redraw = False
+			render(True)
+			lastFrame = time()
+		elif (dirty and time() - lastFrame >= frameInterval) or time() - lastFrame >= 1:
+			# Idle frames once a second keep the window and the no message age current
+			dirty = False
+			render()
+			lastFrame = time()
 finally:
 	sock.close()
 	sys.stdout.write("\033[1A\033[100D\033[K")
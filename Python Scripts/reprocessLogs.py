@@ -0,0 +1,291 @@
+#!/usr/bin/python3
+
+# Offline batch reprocessing of ThermoPi log dumps
+#
+# Reads any mix of Log_*.csv (saveLogsCSV / TempLog.saveTo), Log_*.json / LogDump.json
+# (saveLogsJSON / TempLog.saveTo) and Log_*.tpc / LogDump.tpc (saveLogsCompressed) files, parses each one with a streaming parser in a pool of
+# worker processes, and merges everything into a single deduplicated, time ordered archive.
+#
+# usage: reprocessLogs.py [-o out.json|out.csv|out.tpc|out.npz] [-j jobs] [--rollup] [--correct module:function] files...
+#
+# --rollup      rebuild the Minutes / Hours / Days tiers from the merged SecondsX2 tier with the same
+#               consolidation as ThermoRead (max per minute, average per hour, average per day), grouped
+#               by aligned time buckets so no row spans a gap; rows outside the rebuilt buckets are kept
+# --correct     apply a correction function f(temp, ambient) -> temp to every T1 / T2 entry, e.g. to
+#               re-linearize with corrected coefficients
+
+import sys, os, csv, re, argparse, importlib
+from concurrent.futures import ProcessPoolExecutor
+from heapq import merge
+
+# Tier names as written by saveLogsJSON / TempLog.saveTo, and the aliases used by saveLogsCSV
+tierNames = ['SecondsX2','Minutes','Hours','Days']
+tierAliases = {'Seconds x2':'SecondsX2'}
+columns = ['TimeStamp','T1','T2','T1Ambient','T2Ambient']
+
+chunkSize = 1 << 16
+
+jsonToken = re.compile(r'"((?:[^"\\]|\\.)*)"|([\[\]{}:,])|(-?Infinity|NaN|-?[0-9][0-9.eE+-]*)')
+
+
+def parseCSV(fname):
+	logs = dict()
+	rows = None
+	with open(fname, newline='') as fid:
+		for row in csv.reader(fid):
+			if len(row) == 0:
+				continue
+			if row[0] == 'Log Type' or row[0] == '\t':
+				continue
+			if row[0] != '':
+				title = tierAliases.get(row[0],row[0])
+				rows = logs.setdefault(title,[])
+				continue
+			if rows is None or len(row) < 6:
+				continue
+			try:
+				rows.append((float(row[1]),float(row[2]),float(row[3]),float(row[4]),float(row[5])))
+			except ValueError:
+				pass
+	return logs
+
+
+def iterJSONTokens(fid):
+	tail = ''
+	while True:
+		chunk = fid.read(chunkSize)
+		if not chunk:
+			break
+		data = tail + chunk
+		# Only tokenize up to the last structural character so no token is split across chunks
+		cut = max(data.rfind(','),data.rfind(']'),data.rfind('}'),data.rfind('['),data.rfind('{'))
+		if cut < 0:
+			tail = data
+			continue
+		tail = data[cut + 1:]
+		for m in jsonToken.finditer(data,0,cut + 1):
+			yield m.group(1),m.group(2),m.group(3)
+	for m in jsonToken.finditer(tail):
+		yield m.group(1),m.group(2),m.group(3)
+
+
+def parseJSON(fname):
+	# Streaming scan of {"Tier": {"Column": [..], ..}, ..} or {"LogType": "Tier", "Column": [..], ..}
+	cols = dict()
+	path = []
+	key = None
+	values = None
+	logType = None
+	expectValue = False
+	with open(fname) as fid:
+		for string, struct, number in iterJSONTokens(fid):
+			if values is not None:
+				if number is not None:
+					values.append(float(number))
+				elif struct == ']':
+					values = None
+				continue
+			if string is not None:
+				if expectValue:
+					if key == 'LogType':
+						logType = string
+					expectValue = False
+				else:
+					key = string
+			elif struct == ':':
+				expectValue = True
+			elif struct == '[':
+				values = cols.setdefault((tuple(path),key),[])
+				expectValue = False
+			elif struct == '{':
+				if key is not None:
+					path.append(key)
+				key = None
+				expectValue = False
+			elif struct == '}':
+				if path:
+					path.pop()
+			elif number is not None:
+				expectValue = False
+	logs = dict()
+	tiers = dict()
+	for (p, col), v in cols.items():
+		if len(p) > 0:
+			title = tierAliases.get(p[-1],p[-1])
+		elif logType is not None:
+			title = tierAliases.get(logType,logType)
+		else:
+			continue
+		tiers.setdefault(title,dict())[col] = v
+	for title, d in tiers.items():
+		if not all(c in d for c in columns):
+			continue
+		logs[title] = list(zip(*[d[c] for c in columns]))
+	return logs
+
+
+def parseCompressed(fname):
+	from ThermoCodec import iterArchive, iterBlockColumns
+	logs = dict()
+	with open(fname,'rb') as fid:
+		data = fid.read()
+	for title, block in iterArchive(data):
+		d = {col:list(values) for col, values in iterBlockColumns(block)}
+		logs[tierAliases.get(title,title)] = list(zip(*[d[c] for c in columns]))
+	return logs
+
+
+def parseFile(fname):
+	try:
+		if fname.endswith('.tpc'):
+			logs = parseCompressed(fname)
+		elif fname.endswith('.json'):
+			logs = parseJSON(fname)
+		else:
+			logs = parseCSV(fname)
+	except Exception as e:
+		sys.stderr.write('{}: {}\n'.format(fname,e))
+		return dict()
+	# Each worker hands back its tiers already time ordered so the parent only has to merge
+	for rows in logs.values():
+		rows.sort()
+	return logs
+
+
+def mergeLogs(results):
+	merged = dict()
+	for title in set(t for r in results for t in r):
+		rows = []
+		last = None
+		for row in merge(*[r[title] for r in results if title in r]):
+			if row[0] == last:
+				continue
+			last = row[0]
+			rows.append(row)
+		merged[title] = rows
+	return merged
+
+
+def consolidate(rows, step, fn):
+	# One row per aligned step-second bucket (t - t % step) that holds rows, so a bucket never spans a gap
+	out = []
+	ind = 0
+	while ind < len(rows):
+		bucket = rows[ind][0] - rows[ind][0] % step
+		stop = ind + 1
+		while stop < len(rows) and rows[stop][0] - rows[stop][0] % step == bucket:
+			stop += 1
+		block = rows[ind:stop]
+		n = len(block)
+		ts = sum(r[0] for r in block) / n
+		if fn == 'max':
+			out.append((ts,) + tuple(max(r[c] for r in block) for c in range(1,5)))
+		else:
+			out.append((ts,) + tuple(sum(r[c] for r in block) / n for c in range(1,5)))
+		ind = stop
+	return out
+
+
+def rollup(logs):
+	# Only the buckets the SecondsX2 rows fall in are rebuilt, each coarser tier from the rows of its finer
+	# tier in those buckets, so the coarse history older than SecondsX2 stays as it was
+	rebuilt = logs.get('SecondsX2',[])
+	for source, title, step, fn in [('SecondsX2','Minutes',60,'max'),('Minutes','Hours',3600,'avg'),
+			('Hours','Days',86400,'avg')]:
+		if not rebuilt:
+			break
+		buckets = set(r[0] - r[0] % step for r in rebuilt)
+		rebuilt = consolidate([r for r in logs[source] if r[0] - r[0] % step in buckets],step,fn)
+		logs[title] = list(merge([r for r in logs.get(title,[]) if r[0] - r[0] % step not in buckets],rebuilt))
+	return logs
+
+
+def correct(logs, fn):
+	for title in logs:
+		logs[title] = [(r[0],fn(r[1],r[3]),fn(r[2],r[4]),r[3],r[4]) for r in logs[title]]
+	return logs
+
+
+def tierOrder(title):
+	return tierNames.index(title) if title in tierNames else len(tierNames)
+
+
+def writeJSON(logs, fname):
+	import json
+	saveDict = dict()
+	for title in sorted(logs, key=tierOrder):
+		cols = list(zip(*logs[title])) if logs[title] else [()] * 5
+		saveDict[title] = {c:list(cols[ind]) for ind, c in enumerate(columns)}
+	with open(fname,'w') as fid:
+		json.dump(saveDict,fid)
+
+
+def writeCompressed(logs, fname):
+	from ThermoCodec import encodeArchive
+	saveDict = dict()
+	for title in sorted(logs, key=tierOrder):
+		cols = list(zip(*logs[title])) if logs[title] else [()] * 5
+		saveDict[title] = {c:list(cols[ind]) for ind, c in enumerate(columns)}
+	with open(fname,'wb') as fid:
+		fid.write(encodeArchive(saveDict))
+
+
+def writeNpz(logs, fname):
+	from ThermoExport import writeNpz as write
+	tiers = dict()
+	for title in sorted(logs, key=tierOrder):
+		cols = list(zip(*logs[title])) if logs[title] else [()] * 5
+		tiers[title] = {c:list(cols[ind]) for ind, c in enumerate(columns)}
+	write(fname,tiers)
+
+
+def writeCSV(logs, fname):
+	with open(fname,'w', newline='') as fid:
+		writer = csv.writer(fid)
+		first = True
+		for title in sorted(logs, key=tierOrder):
+			if not first:
+				writer.writerow(['\t'])
+			first = False
+			writer.writerow(['Log Type','Time Stamp','T1','T2','T1 Ambient','T2 Ambient'])
+			writer.writerow([title])
+			writer.writerows([''] + list(r) for r in logs[title])
+
+
+def loadCorrection(spec):
+	modname, fnname = spec.split(':',1)
+	sys.path.insert(0,os.getcwd())
+	return getattr(importlib.import_module(modname),fnname)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Merge and reprocess ThermoPi log dumps')
+	parser.add_argument('files',nargs='+')
+	parser.add_argument('-o','--output',default='Log_merged.json')
+	parser.add_argument('-j','--jobs',type=int,default=os.cpu_count())
+	parser.add_argument('--rollup',action='store_true')
+	parser.add_argument('--correct',default=None)
+	args = parser.parse_args()
+
+	fn = loadCorrection(args.correct) if args.correct else None
+
+	# Largest files first so the pool is not left waiting on one big straggler
+	files = sorted(args.files, key=lambda f: os.path.getsize(f) if os.path.isfile(f) else 0, reverse=True)
+	with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+		results = list(pool.map(parseFile,files))
+	logs = mergeLogs(results)
+	if fn is not None:
+		logs = correct(logs,fn)
+	if args.rollup:
+		logs = rollup(logs)
+	for title in sorted(logs, key=tierOrder):
+		sys.stdout.write('{}: {} entries\n'.format(title,len(logs[title])))
+	if args.output.endswith('.csv'):
+		writeCSV(logs,args.output)
+	elif args.output.endswith('.tpc'):
+		writeCompressed(logs,args.output)
+	elif args.output.endswith('.npz'):
+		writeNpz(logs,args.output)
+	else:
+		writeJSON(logs,args.output)
+	sys.stdout.write('Saved {}\n'.format(args.output))
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+# Telemetry publisher against the LocalBroker stand-in
+#
+# usage: python3 -m unittest testTelemetry	(or python3 -m pytest testTelemetry.py)
+
+import os, shutil, tempfile, unittest
+from time import time, sleep
+
+from ThermoCodec import decodeBlock
+from ThermoTelemetry import TelemetryPublisher, LocalBroker
+
+
+def waitFor(condition,timeout=10):
+	end = time() + timeout
+	while time() < end:
+		if condition():
+			return True
+		sleep(0.02)
+	return condition()
+
+
+def stamps(messages):
+	return [t for topic, payload in messages for t in decodeBlock(payload)['TimeStamp']]
+
+
+class TelemetryTest(unittest.TestCase):
+	def setUp(self):
+		self.spoolDir = tempfile.mkdtemp()
+		self.t = 1.7e9
+
+	def tearDown(self):
+		shutil.rmtree(self.spoolDir)
+
+	def feed(self,publisher,n):
+		for ind in range(n):
+			publisher.publish((-195.0,21.0,-120.0,22.0,self.t))
+			self.t += 0.5
+
+	def testOutageSpoolAndReplay(self):
+		broker = LocalBroker()
+		broker.start()
+		port = broker.port
+		publisher = TelemetryPublisher(port=port,node='test',interval=0.05,spoolDir=self.spoolDir,retryMin=0.1,
+			retryMax=0.2,timeout=2)
+		publisher.start()
+		try:
+			self.feed(publisher,20)
+			self.assertTrue(waitFor(lambda: len(stamps(broker.messages)) == 20))
+			before = list(broker.messages)
+			broker.stop()
+			# Batches taken while the broker is down go to the spool
+			self.feed(publisher,30)
+			self.assertTrue(waitFor(lambda: publisher.status()['spoolFiles'] > 0 and len(publisher.samples) == 0))
+			self.feed(publisher,10)
+			sleep(0.2)
+			broker = LocalBroker(port=port)
+			broker.start()
+			self.feed(publisher,10)
+			self.assertTrue(waitFor(lambda: len(stamps(before + broker.messages)) == 70))
+			received = stamps(before + broker.messages)
+			self.assertEqual(received,sorted(received))
+			self.assertEqual(len(set(received)),70)
+			self.assertEqual(publisher.status()['spoolFiles'],0)
+			self.assertEqual(publisher.lost,0)
+			self.assertTrue(all(topic == 'thermopi/test/samples' for topic, payload in broker.messages))
+		finally:
+			publisher.stop()
+			broker.stop()
+
+	def testSpoolLimitDropsOldest(self):
+		# Nothing listens on the port, cycle() is driven by hand so every batch is spooled
+		broker = LocalBroker()
+		port = broker.port
+		broker.server_close()
+		publisher = TelemetryPublisher(port=port,node='test',spoolDir=self.spoolDir,maxSpoolBytes=2000,retryMin=60,
+			timeout=2)
+		first = []
+		for batch in range(40):
+			self.feed(publisher,10)
+			first.append(self.t - 5.0)
+			publisher.cycle()
+		files = publisher.spoolFiles()
+		self.assertLessEqual(sum(os.path.getsize(f) for f in files),2000)
+		self.assertGreater(publisher.dropped,0)
+		self.assertEqual(publisher.dropped + len(files),40)
+		kept = []
+		for fname in files:
+			with open(fname,'rb') as fid:
+				kept.append(decodeBlock(fid.read())['TimeStamp'][0])
+		# The newest batches survive, in order
+		self.assertEqual(kept,first[-len(files):])
+
+
+if __name__ == '__main__':
+	unittest.main()